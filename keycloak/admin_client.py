@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import json
+import queue
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, HTTPResponse, RemoteDisconnected
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlencode, urlparse, quote
+
+# Constants
+ADMIN_POOL_SIZE = 4  # keep-alive connections kept around per client
+ADMIN_REQUEST_TIMEOUT = 30  # seconds before an admin API request is abandoned
+TOKEN_REFRESH_MARGIN = 10  # refresh tokens these many seconds before they expire
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'PUT', 'DELETE']  # safe to send twice
+
+
+class KeycloakAdminAPIError(Exception):
+
+    def __init__(self, status: int, method: str, path: str, body: str) -> None:
+        self.status = status
+        self.method = method
+        self.path = path
+        self.body = body
+
+    def __str__(self) -> str:
+        return (
+            'Error invoking Keycloak Admin REST API.\n'
+            f'Request: {self.method} {self.path}\n'
+            f'Status: {self.status}\n'
+            f'Body:\n{self.body}\n'
+        )
+
+
+# Escapes a single path segment (like a flow alias with spaces in it)
+def quote_segment(segment: str) -> str:
+    return quote(segment, safe='')
+
+
+# Whether a request failed because its keep-alive connection had been closed
+# by the server: it was refused while being written, or the server hung up
+# without a single byte of response, which is how an idle connection it
+# dropped shows. A read timeout doesn't count, the server may be working on it.
+def _found_closed(error: Exception, sent: bool) -> bool:
+    if isinstance(error, RemoteDisconnected):
+        return True
+    return not sent and isinstance(error, (BrokenPipeError, ConnectionResetError))
+
+
+# ConnectionPool hands out keep-alive HTTP(S) connections to a single host.
+# Connections are returned to the pool after a successful request and closed
+# after a failed one, so a request never reuses a connection in a bad state.
+class ConnectionPool:
+
+    def __init__(self, base_url: str, size: int = ADMIN_POOL_SIZE, timeout: float = ADMIN_REQUEST_TIMEOUT) -> None:
+        parsed = urlparse(base_url)
+        self._scheme = parsed.scheme
+        self._host = str(parsed.hostname)
+        self._port = parsed.port
+        self._timeout = timeout
+        self._idle: 'queue.LifoQueue[HTTPConnection]' = queue.LifoQueue(maxsize=size)
+        self.connections_opened = 0
+
+    def _new_connection(self) -> HTTPConnection:
+        self.connections_opened += 1
+        if self._scheme == 'https':
+            return HTTPSConnection(self._host, self._port, timeout=self._timeout)
+        return HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+    # Returns an idle connection if there is one, along with whether it was reused
+    def get(self) -> Tuple[HTTPConnection, bool]:
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def put(self, conn: HTTPConnection) -> None:
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# KeycloakAdminClient talks to the Keycloak Admin REST API in-process, instead
+# of spawning kcadm.sh (and a JVM) for every call. The bearer token is held in
+# memory and refreshed shortly before it expires.
+# server_url is the Keycloak root, like http://localhost:8080/auth
+class KeycloakAdminClient:
+
+    def __init__(
+            self,
+            server_url: str,
+            user: str,
+            password: str,
+            auth_realm: str = 'master',
+            client_id: str = 'admin-cli',
+            pool_size: int = ADMIN_POOL_SIZE,
+    ) -> None:
+        self._server_url = server_url.rstrip('/')
+        self._base_path = urlparse(self._server_url).path
+        self._user = user
+        self._password = password
+        self._auth_realm = auth_realm
+        self._client_id = client_id
+        self._pool = ConnectionPool(self._server_url, pool_size)
+        self._token_lock = threading.Lock()
+        self._access_token = ''
+        self._access_expiry = 0.0
+        self._refresh_token = ''
+        self._refresh_expiry = 0.0
+
+    @property
+    def server_url(self) -> str:
+        return self._server_url
+
+    # Sends one HTTP request over a pooled connection. A reused keep-alive
+    # connection may have been closed by the server in the meantime (say, due
+    # to a restart), so a failure on one is retried on a fresh connection, as
+    # long as that can't send the request twice: idempotent requests always
+    # are, others (like a POST creating an execution) only when the connection
+    # turned out closed before the server could have acted on them.
+    def _send(
+            self,
+            method: str,
+            path: str,
+            body: Optional[bytes],
+            headers: Dict[str, str],
+    ) -> Tuple[HTTPResponse, bytes]:
+        while True:
+            conn, reused = self._pool.get()
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+            except (HTTPException, OSError) as e:
+                conn.close()
+                if reused and (method in IDEMPOTENT_METHODS or _found_closed(e, sent)):
+                    continue
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._pool.put(conn)
+            return resp, data
+
+    def _token_request(self, form: Dict[str, str]) -> None:
+        path = f'{self._base_path}/realms/{quote_segment(self._auth_realm)}/protocol/openid-connect/token'
+        body = urlencode(form).encode('utf-8')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        now = time.monotonic()
+        resp, data = self._send('POST', path, body, headers)
+        if resp.status != 200:
+            raise KeycloakAdminAPIError(resp.status, 'POST', path, data.decode('utf-8', 'replace'))
+        token = json.loads(data.decode('utf-8'))
+        self._access_token = token['access_token']
+        self._access_expiry = now + float(token.get('expires_in', 60))
+        self._refresh_token = token.get('refresh_token', '')
+        self._refresh_expiry = now + float(token.get('refresh_expires_in', 0))
+
+    # Obtains a fresh token pair using the admin credentials
+    def login(self) -> None:
+        with self._token_lock:
+            self._token_request({
+                'grant_type': 'password',
+                'client_id': self._client_id,
+                'username': self._user,
+                'password': self._password,
+            })
+
+    # Returns a valid access token, refreshing (or logging in again) if the
+    # current one is about to expire
+    def _bearer_token(self) -> str:
+        with self._token_lock:
+            now = time.monotonic()
+            if self._access_token and now < self._access_expiry - TOKEN_REFRESH_MARGIN:
+                return self._access_token
+            if self._refresh_token and now < self._refresh_expiry - TOKEN_REFRESH_MARGIN:
+                try:
+                    self._token_request({
+                        'grant_type': 'refresh_token',
+                        'client_id': self._client_id,
+                        'refresh_token': self._refresh_token,
+                    })
+                    return self._access_token
+                except KeycloakAdminAPIError:
+                    pass  # session is gone (server restarted?); log in afresh
+            self._token_request({
+                'grant_type': 'password',
+                'client_id': self._client_id,
+                'username': self._user,
+                'password': self._password,
+            })
+            return self._access_token
+
+    def _invalidate_token(self) -> None:
+        with self._token_lock:
+            self._access_token = ''
+            self._refresh_token = ''
+
+    # Invokes an admin endpoint, relative to /admin/, like
+    # 'realms/master/authentication/flows'. Returns the response headers and
+    # the decoded JSON body (or None for an empty body).
+    def request_full(
+            self,
+            method: str,
+            admin_path: str,
+            payload: Any = None,
+            query: Optional[Dict[str, str]] = None,
+    ) -> Tuple[Dict[str, str], Any]:
+        path = f'{self._base_path}/admin/{admin_path}'
+        if query:
+            path = f'{path}?{urlencode(query)}'
+        body = None if payload is None else json.dumps(payload).encode('utf-8')
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {self._bearer_token()}',
+                'Accept': 'application/json',
+            }
+            if body is not None:
+                headers['Content-Type'] = 'application/json'
+            resp, data = self._send(method, path, body, headers)
+            if resp.status == 401 and attempt == 0:
+                self._invalidate_token()
+                continue
+            break
+        text = data.decode('utf-8', 'replace')
+        if resp.status >= 400:
+            raise KeycloakAdminAPIError(resp.status, method, path, text)
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        return resp_headers, (json.loads(text) if text.strip() else None)
+
+    def request(self, method: str, admin_path: str, payload: Any = None, query: Optional[Dict[str, str]] = None) -> Any:
+        _, body = self.request_full(method, admin_path, payload, query)
+        return body
+
+    # Creates a resource and returns its id, as found in the Location header
+    def create(self, admin_path: str, payload: Any) -> str:
+        headers, _ = self.request_full('POST', admin_path, payload)
+        location = headers.get('location', '')
+        return location.rstrip('/').rsplit('/', 1)[-1]
+
+    def list_authentication_flows(self, realm: str) -> Any:
+        return self.request('GET', f'realms/{quote_segment(realm)}/authentication/flows')
+
+    def create_authentication_flow(
+            self,
+            realm: str,
+            alias: str,
+            provider_id: str,
+            description: str,
+            top_level: bool,
+            built_in: bool,
+    ) -> str:
+        return self.create(f'realms/{quote_segment(realm)}/authentication/flows', {
+            'alias': alias,
+            'providerId': provider_id,
+            'description': description,
+            'topLevel': top_level,
+            'builtIn': built_in,
+        })
+
+    def list_executions(self, realm: str, auth_flow_name: str) -> Any:
+        path = f'realms/{quote_segment(realm)}/authentication/flows/{quote_segment(auth_flow_name)}/executions'
+        return self.request('GET', path)
+
+    # Keycloak always creates executions as DISABLED, so the requirement is
+    # applied with a follow-up update when it is anything else
+    def create_execution(self, realm: str, auth_flow_name: str, provider_id: str, requirement: str) -> str:
+        flow_path = f'realms/{quote_segment(realm)}/authentication/flows/{quote_segment(auth_flow_name)}'
+        execution_id = self.create(f'{flow_path}/executions/execution', {'provider': provider_id})
+        if requirement != 'DISABLED':
+            self.request('PUT', f'{flow_path}/executions', {'id': execution_id, 'requirement': requirement})
+        return execution_id
+
+    def update_execution(self, realm: str, auth_flow_name: str, payload: Dict[str, Any]) -> None:
+        path = f'realms/{quote_segment(realm)}/authentication/flows/{quote_segment(auth_flow_name)}/executions'
+        self.request('PUT', path, payload)
+
+    def get_authentication_config(self, realm: str, config_id: str) -> Any:
+        return self.request('GET', f'realms/{quote_segment(realm)}/authentication/config/{quote_segment(config_id)}')
+
+    def create_execution_config(self, realm: str, execution_id: str, payload: Dict[str, Any]) -> str:
+        path = f'realms/{quote_segment(realm)}/authentication/executions/{quote_segment(execution_id)}/config'
+        return self.create(path, payload)
+
+    def update_authentication_config(self, realm: str, config_id: str, payload: Dict[str, Any]) -> None:
+        path = f'realms/{quote_segment(realm)}/authentication/config/{quote_segment(config_id)}'
+        self.request('PUT', path, payload)
+
+    def get_realm(self, realm: str) -> Any:
+        return self.request('GET', f'realms/{quote_segment(realm)}')
+
+    # Only the fields present in payload are changed
+    def update_realm(self, realm: str, payload: Dict[str, Any]) -> None:
+        self.request('PUT', f'realms/{quote_segment(realm)}', payload)
+
+    # The realm with its authentication flows and, if asked for, its clients
+    # (secrets masked), groups and roles
+    def partial_export(self, realm: str, export_clients: bool, export_groups_and_roles: bool) -> Any:
+        return self.request('POST', f'realms/{quote_segment(realm)}/partial-export', query={
+            'exportClients': str(export_clients).lower(),
+            'exportGroupsAndRoles': str(export_groups_and_roles).lower(),
+        })
+
+    # Imports several resources (like clients) into a realm in one transaction.
+    # payload carries the resources and ifResourceExists (FAIL, SKIP or
+    # OVERWRITE); the reply lists what happened to each of them.
+    def partial_import(self, realm: str, payload: Dict[str, Any]) -> Any:
+        return self.request('POST', f'realms/{quote_segment(realm)}/partialImport', payload)
+
+    def update_client(self, realm: str, client_id: str, payload: Dict[str, Any]) -> None:
+        self.request('PUT', f'realms/{quote_segment(realm)}/clients/{quote_segment(client_id)}', payload)
+
+    def close(self) -> None:
+        self._pool.close()
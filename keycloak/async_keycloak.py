@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import asyncio
+import functools
+import os
+from asyncio.subprocess import PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# Local Imports
+from keycloak import (
+    KeycloakHandle,
+    KeycloakAdminCLIError,
+    JBossCLIError,
+    to_json_if_json,
+    kcadm_args_list_authentication_flows,
+    kcadm_args_create_authentication_flow,
+    kcadm_args_list_executions,
+    kcadm_args_create_execution,
+    kcadm_args_update_execution,
+    kcadm_args_get_authentication_config,
+    kcadm_args_create_execution_config,
+    kcadm_args_update_authentication_config,
+    kcadm_args_get_realm,
+    kcadm_args_update_realm,
+    kcadm_args_partial_export,
+    kcadm_args_partial_import,
+    write_payload_file,
+)
+
+
+# Environment Variable Arguments
+HS_ASYNC_CONCURRENCY = int(os.getenv('HS_ASYNC_CONCURRENCY', '8'))  # admin calls in flight at the same time
+
+
+# Outcome of one item of a fan_out(): either a value or the error it raised
+class FanOutResult(NamedTuple):
+    item: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+# Applies fn to every item, with at most concurrency calls in flight. A failing
+# item doesn't stop the others; its error is collected in its result instead.
+# Results come back in the order of the items.
+async def fan_out(
+        items: List[Any],
+        fn: Callable[[Any], Awaitable[Any]],
+        concurrency: int = HS_ASYNC_CONCURRENCY,
+) -> List[FanOutResult]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_item(item: Any) -> FanOutResult:
+        async with semaphore:
+            try:
+                return FanOutResult(item, await fn(item))
+            except Exception as e:
+                return FanOutResult(item, error=e)
+
+    return list(await asyncio.gather(*[run_item(item) for item in items]))
+
+
+# Runs a coroutine to completion on a fresh event loop (asyncio.run() needs
+# Python 3.7). Call it from the main thread, where the loop can watch children.
+def run_async(coro: Awaitable[Any]) -> Any:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+# AsyncKeycloakHandle exposes the realm administration methods of a
+# KeycloakHandle as coroutines, so many of them can be in flight at once. With
+# the kcadm backend each call is its own kcadm_cli process, spawned without
+# blocking the loop. With the rest backend the handle's pooled, thread-safe
+# admin client does the requests on a thread pool of the same size as the
+# concurrency, so tokens and keep-alive connections are shared with the
+# synchronous handle. Starting and stopping Keycloak stays with KeycloakHandle.
+#
+# Usage:
+#   akc = AsyncKeycloakHandle(singleton)
+#   results = run_async(akc.fan_out(realms, akc.list_authentication_flows))
+class AsyncKeycloakHandle:
+
+    def __init__(self, kc: KeycloakHandle, concurrency: int = HS_ASYNC_CONCURRENCY) -> None:
+        self._kc = kc
+        self._concurrency = max(1, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self._concurrency)
+
+    @property
+    def kc(self) -> KeycloakHandle:
+        return self._kc
+
+    def _uses_rest(self) -> bool:
+        return self._kc.admin_client is not None
+
+    async def _in_thread(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    async def _exec(self, argv: List[str]) -> Tuple[int, str]:
+        proc = await asyncio.create_subprocess_exec(*argv, stdout=PIPE, stderr=STDOUT)
+        stdout, _ = await proc.communicate()
+        output = stdout.decode('utf-8', 'replace')
+        if output.endswith('\n'):
+            output = output[:-1]
+        return proc.returncode or 0, output
+
+    async def fan_out(self, items: List[Any], fn: Callable[[Any], Awaitable[Any]]) -> List[FanOutResult]:
+        return await fan_out(items, fn, self._concurrency)
+
+    async def kcadm_cli(self, cli_args: str) -> Tuple[int, str]:
+        return await self._exec(self._kc.kcadm_cli_argv(cli_args))
+
+    async def kcadm_cli_raise_error(self, cli_args: str) -> str:
+        exitcode, output = await self.kcadm_cli(cli_args)
+        if exitcode != 0:
+            raise KeycloakAdminCLIError(exitcode, output, cli_args)
+        return output
+
+    async def kcadm_cli_as_json_raise_error(self, cli_args: str) -> Any:
+        output = await self.kcadm_cli_raise_error(cli_args)
+        _, json_output = to_json_if_json(output)
+        return json_output
+
+    async def jboss_cli(self, cmd_name: str, commands: str) -> Tuple[int, str]:
+        return await self._exec(self._kc.jboss_cli_argv(cmd_name, commands))
+
+    async def jboss_cli_raise_error(self, cmd_name: str, commands: str) -> str:
+        exitcode, output = await self.jboss_cli(cmd_name, commands)
+        if exitcode != 0:
+            raise JBossCLIError(exitcode, output, cmd_name, commands)
+        return output
+
+    async def login(self) -> None:
+        if self._uses_rest():
+            await self._in_thread(self._kc.login)
+            return
+        await self.kcadm_cli_raise_error(self._kc.kcadm_login_args())
+
+    async def list_authentication_flows(self, realm: str) -> Any:
+        if self._uses_rest():
+            return await self._in_thread(self._kc.list_authentication_flows, realm)
+        return await self.kcadm_cli_as_json_raise_error(kcadm_args_list_authentication_flows(realm))
+
+    async def list_authentication_flow_names(self, realm: str) -> List[str]:
+        flows = await self.list_authentication_flows(realm)
+        return [str(flow.get('alias')) for flow in flows]
+
+    async def create_authentication_flow(
+            self,
+            realm: str,
+            alias: str,
+            provider_id: str,
+            description: str,
+            top_level: bool,
+            built_in: bool,
+    ) -> None:
+        if self._uses_rest():
+            await self._in_thread(
+                self._kc.create_authentication_flow, realm, alias, provider_id, description, top_level, built_in
+            )
+            return
+        await self.kcadm_cli_raise_error(
+            kcadm_args_create_authentication_flow(realm, alias, provider_id, description, top_level, built_in)
+        )
+
+    async def list_executions(self, realm: str, auth_flow_name: str) -> Any:
+        if self._uses_rest():
+            return await self._in_thread(self._kc.list_executions, realm, auth_flow_name)
+        return await self.kcadm_cli_as_json_raise_error(kcadm_args_list_executions(realm, auth_flow_name))
+
+    async def list_execution_names(self, realm: str, auth_flow_name: str) -> List[str]:
+        executions = await self.list_executions(realm, auth_flow_name)
+        return [str(execution.get('displayName')) for execution in executions]
+
+    async def create_execution(self, realm: str, auth_flow_name: str, provider_id: str, requirement: str) -> None:
+        if self._uses_rest():
+            await self._in_thread(self._kc.create_execution, realm, auth_flow_name, provider_id, requirement)
+            return
+        await self.kcadm_cli_raise_error(kcadm_args_create_execution(realm, auth_flow_name, provider_id, requirement))
+
+    async def create_required_execution(self, realm: str, auth_flow_name: str, provider: str) -> None:
+        await self.create_execution(realm, auth_flow_name, provider, 'REQUIRED')
+
+    async def update_execution_requirement(
+            self,
+            realm: str,
+            auth_flow_name: str,
+            execution_id: str,
+            requirement: str,
+    ) -> None:
+        if self._uses_rest():
+            await self._in_thread(
+                self._kc.update_execution_requirement, realm, auth_flow_name, execution_id, requirement
+            )
+            return
+        payload = {'id': execution_id, 'requirement': requirement}
+        await self.kcadm_cli_raise_error(kcadm_args_update_execution(realm, auth_flow_name, payload))
+
+    async def get_authentication_config(self, realm: str, config_id: str) -> Any:
+        if self._uses_rest():
+            return await self._in_thread(self._kc.get_authentication_config, realm, config_id)
+        return await self.kcadm_cli_as_json_raise_error(kcadm_args_get_authentication_config(realm, config_id))
+
+    async def create_execution_config(self, realm: str, execution_id: str, alias: str, config: Dict[str, str]) -> None:
+        if self._uses_rest():
+            await self._in_thread(self._kc.create_execution_config, realm, execution_id, alias, config)
+            return
+        payload = {'alias': alias, 'config': config}
+        await self.kcadm_cli_raise_error(kcadm_args_create_execution_config(realm, execution_id, payload))
+
+    async def update_authentication_config(self, realm: str, config_id: str, alias: str, config: Dict[str, str]) -> None:
+        if self._uses_rest():
+            await self._in_thread(self._kc.update_authentication_config, realm, config_id, alias, config)
+            return
+        payload = {'id': config_id, 'alias': alias, 'config': config}
+        await self.kcadm_cli_raise_error(kcadm_args_update_authentication_config(realm, config_id, payload))
+
+    async def get_realm(self, realm: str) -> Any:
+        if self._uses_rest():
+            return await self._in_thread(self._kc.get_realm, realm)
+        return await self.kcadm_cli_as_json_raise_error(kcadm_args_get_realm(realm))
+
+    async def update_realm(self, realm: str, payload: Dict[str, Any]) -> None:
+        if self._uses_rest():
+            await self._in_thread(self._kc.update_realm, realm, payload)
+            return
+        await self.kcadm_cli_raise_error(kcadm_args_update_realm(realm, payload))
+
+    async def partial_export(self, realm: str, export_clients: bool = True, export_groups_and_roles: bool = False) -> Any:
+        if self._uses_rest():
+            return await self._in_thread(self._kc.partial_export, realm, export_clients, export_groups_and_roles)
+        return await self.kcadm_cli_as_json_raise_error(
+            kcadm_args_partial_export(realm, export_clients, export_groups_and_roles)
+        )
+
+    async def partial_import(self, realm: str, payload: Dict[str, Any]) -> Any:
+        if self._uses_rest():
+            return await self._in_thread(self._kc.partial_import, realm, payload)
+        payload_file = write_payload_file(self._kc.kcbase, 'partial-import', payload)
+        try:
+            return await self.kcadm_cli_as_json_raise_error(kcadm_args_partial_import(realm, payload_file))
+        finally:
+            payload_file.unlink()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,437 @@
+#!/usr/bin/python3
+
+# Offline benchmarks of the provisioning code. Every Keycloak piece is faked
+# (see fake_keycloak.py, fake_kcadm.py and fake_jboss_cli.py) with latencies
+# that can be tuned through BENCH_* environment variables, and the plugin
+# tarball is built locally and served from 127.0.0.1, so this runs on any
+# Linux box without network access or a JVM.
+#
+# Usage: bench.py [--scenario NAME]... [--iterations N] [--json PATH] [--keep]
+# Scenarios: cold-start, warm-start, prebaked-start, download-mirrors, handle-kcadm, handle-rest,
+#            jboss-cli
+
+# Stdlib Imports
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# Environment Variable Arguments
+BENCH_PLUGIN_SIZE = int(os.getenv('BENCH_PLUGIN_SIZE', str(2 * 1024 * 1024)))  # bytes of filler in the plugin jar
+
+# Constants
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+SCENARIOS = ['cold-start', 'warm-start', 'prebaked-start', 'download-mirrors', 'handle-kcadm', 'handle-rest', 'jboss-cli']
+KC_USER = 'admin'
+KC_PASS = 'admin'
+STANDALONE_XML = '''<?xml version="1.0" ?>
+<server xmlns="urn:jboss:domain:10.0">
+    <profile>
+        <subsystem xmlns="urn:jboss:domain:logging:8.0">
+            <root-logger><level name="INFO"/></root-logger>
+        </subsystem>
+        <subsystem xmlns="urn:jboss:domain:keycloak-server:1.1">
+            <web-context>auth</web-context>
+            <providers>
+                <provider>classpath:${jboss.home.dir}/providers/*</provider>
+            </providers>
+            <master-realm-name>master</master-realm-name>
+            <scheduled-task-interval>900</scheduled-task-interval>
+            <theme>
+                <staticMaxAge>2592000</staticMaxAge>
+                <cacheThemes>true</cacheThemes>
+                <cacheTemplates>true</cacheTemplates>
+                <dir>${jboss.home.dir}/themes</dir>
+            </theme>
+            <spi name="userCache"><provider name="default" enabled="true"/></spi>
+        </subsystem>
+        <subsystem xmlns="urn:jboss:domain:undertow:10.0" default-server="default-server"/>
+    </profile>
+</server>
+'''
+
+
+# Measurements of one scenario run
+class BenchResult(NamedTuple):
+    scenario: str
+    wall: float
+    kcadm_spawns: int
+    jboss_spawns: int
+    boots: int
+    restarts: int
+    bytes_read: int
+    bytes_downloaded: int
+    per_call: Dict[str, float]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return int(sock.getsockname()[1])
+
+
+# Bytes this process has read through read() and friends, from /proc/self/io
+def bytes_read() -> int:
+    try:
+        with open('/proc/self/io', 'r') as fp:
+            for line in fp:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def write_wrapper(path: Path, script: str, env: Dict[str, str], args: str = '"$@"') -> None:
+    exports = ''.join(f'{key}={json.dumps(value)} ' for key, value in env.items())
+    path.write_text(f'#!/bin/sh\n{exports}exec {sys.executable} {BENCH_DIR.joinpath(script)} {args}\n')
+    path.chmod(0o755)
+
+
+# Lays out a fake Keycloak distribution: bin/ scripts wrapping the fakes, the
+# configuration files, and empty modules and themes directories
+def make_kcbase(kcbase: Path, port: int) -> None:
+    if kcbase.exists():
+        shutil.rmtree(kcbase)
+    kcbase.joinpath('bin').mkdir(parents=True)
+    kcbase.joinpath('modules').mkdir()
+    kcbase.joinpath('themes', 'base', 'login').mkdir(parents=True)
+    config_dir = kcbase.joinpath('standalone', 'configuration')
+    config_dir.mkdir(parents=True)
+    for mode in ['standalone', 'standalone-ha']:
+        config_dir.joinpath(f'{mode}.xml').write_text(STANDALONE_XML)
+    env = {'BENCH_KCBASE': str(kcbase), 'BENCH_KC_PORT': str(port)}
+    write_wrapper(kcbase.joinpath('bin', 'standalone.sh'), 'fake_keycloak.py', env, str(port))
+    write_wrapper(kcbase.joinpath('bin', 'kcadm.sh'), 'fake_kcadm.py', env)
+    write_wrapper(kcbase.joinpath('bin', 'jboss-cli.sh'), 'fake_jboss_cli.py', env)
+
+
+# Builds a plugin tarball shaped like the real one: a top level directory with
+# the module's jar and a nested hs-theme.tar.gz
+def make_plugin_tarball(path: Path) -> str:
+    def add(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        archive.addfile(info, io.BytesIO(data))
+
+    theme = io.BytesIO()
+    with tarfile.open(fileobj=theme, mode='w:gz') as archive:
+        add(archive, 'hs-theme/hs-login.ftl', b'<#import "template.ftl" as layout>\n')
+        add(archive, 'hs-theme/hs.css', b'.hs-qr { width: 256px; }\n')
+    with tarfile.open(path, mode='w:gz') as archive:
+        add(archive, 'hs-authenticator/hs-plugin-keycloak-ejb-0.2-SNAPSHOT.jar', os.urandom(BENCH_PLUGIN_SIZE))
+        add(archive, 'hs-authenticator/hs-theme.tar.gz', theme.getvalue())
+    return hashlib.sha512(path.read_bytes()).hexdigest()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# Serves the files of a directory over HTTP on 127.0.0.1, byte ranges
+# included, counting the bytes sent. Each response waits `latency` seconds
+# first, like a mirror far away.
+class TarballServer:
+
+    def __init__(self, directory: Path, latency: float = 0) -> None:
+        self.bytes_sent = 0
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                server.requests += 1
+                time.sleep(latency)
+                path = directory.joinpath(os.path.basename(self.path.split('?', 1)[0]))
+                if not path.is_file():
+                    self.send_error(404)
+                    return
+                data = path.read_bytes()
+                match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+                if match is None:
+                    self.send_response(200)
+                    body = data
+                else:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(data)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                    body = data[start:end + 1]
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+                self.wfile.write(body)
+                server.bytes_sent += len(body)
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+
+
+class Bench:
+
+    def __init__(self, root: Path, iterations: int) -> None:
+        self.root = root
+        self.iterations = iterations
+        self.port = free_port()
+        self.kcbase = root.joinpath('keycloak')
+        self.workdir = root.joinpath('work')
+        dist = root.joinpath('dist')
+        dist.mkdir(parents=True)
+        self.checksum = make_plugin_tarball(dist.joinpath('hs-authenticator.tar.gz'))
+        self.tarballs = TarballServer(dist)
+        self.mirrors = [TarballServer(dist, latency=0.05), TarballServer(dist, latency=0.005)]
+        make_kcbase(self.kcbase, self.port)
+        self.workdir.mkdir()
+        os.chdir(str(self.workdir))
+        os.environ.update({
+            'KCBASE': str(self.kcbase),
+            'KEYCLOAK_MODE': 'standalone',
+            'KC_EXECUTION_STRATEGY': 'kcdist',
+            'KC_BASEURL': f'http://127.0.0.1:{self.port}',
+            'KEYCLOAK_USER': KC_USER,
+            'KEYCLOAK_PASSWORD': KC_PASS,
+            'AUTHENTICATOR_BUILD_URL': f'http://127.0.0.1:{self.tarballs.port}/hs-authenticator.tar.gz',
+            'AUTHENTICATOR_CHECKSUM': self.checksum,
+            'HS_DOWNLOAD_SEGMENT_SIZE': str(max(64 * 1024, BENCH_PLUGIN_SIZE // 8)),
+            'AUTH_FLOW_NAME': 'hs-auth-flow',
+            'HYPERSIGN_EXECUTION_NAME': 'hyerpsign-qrocde-authenticator',
+            'HS_AUTH_SERVER_ENDPOINT': 'http://127.0.0.1:3000',
+            'KC_RUN_AS_UID': str(os.getuid()),  # the fakes live in a private scratch directory
+        })
+        # The code under test reads its configuration when imported, so it can
+        # only be imported once the environment above is in place
+        sys.path.insert(0, str(REPO_DIR))
+        import keycloak
+        import tracing
+        self._keycloak = keycloak
+        self._tracer = tracing.tracer
+
+    def handle(self, admin_backend: str = 'kcadm') -> Any:
+        return self._keycloak.KeycloakHandle(
+            str(self.kcbase), 'standalone', KC_USER, KC_PASS, 'kcdist', admin_backend=admin_backend
+        )
+
+    def _spawns(self) -> Tuple[int, int]:
+        try:
+            lines = self.kcbase.joinpath('spawns.log').read_text().split()
+        except OSError:
+            return 0, 0
+        return lines.count('kcadm'), lines.count('jboss-cli')
+
+    def _boots(self) -> int:
+        try:
+            return len(self.kcbase.joinpath('boots.log').read_text().split())
+        except OSError:
+            return 0
+
+    def _bytes_sent(self) -> int:
+        return sum(server.bytes_sent for server in [self.tarballs] + self.mirrors)
+
+    def measure(self, scenario: str, fn: Callable[[], Optional[Dict[str, float]]]) -> BenchResult:
+        kcadm_before, jboss_before = self._spawns()
+        boots_before = self._boots()
+        restarts_before = self._tracer.count('kc.restart')
+        read_before = bytes_read()
+        sent_before = self._bytes_sent()
+        start = time.monotonic()
+        per_call = fn() or {}
+        wall = time.monotonic() - start
+        kcadm_after, jboss_after = self._spawns()
+        return BenchResult(
+            scenario,
+            wall,
+            kcadm_after - kcadm_before,
+            jboss_after - jboss_before,
+            self._boots() - boots_before,
+            self._tracer.count('kc.restart') - restarts_before,
+            bytes_read() - read_before,
+            self._bytes_sent() - sent_before,
+            per_call,
+        )
+
+    # The entrypoint's provisioning pipeline on a pristine Keycloak, with
+    # nothing downloaded yet
+    def cold_start(self) -> None:
+        make_kcbase(self.kcbase, self.port)
+        for leftover in self.workdir.iterdir():
+            if leftover.is_dir():
+                shutil.rmtree(leftover)
+            else:
+                leftover.unlink()
+        self._provision()
+
+    # The same pipeline again, like a container restart: the download and the
+    # module from the earlier run are still there
+    def warm_start(self) -> None:
+        if not self.kcbase.joinpath('modules', 'hs-plugin-keycloak-ejb').exists():
+            self.cold_start()
+        self._provision()
+
+    # The pipeline on a Keycloak pre-baked at build time (prebake.py), which
+    # is done before the measurement starts
+    def prebaked_start(self) -> None:
+        self._provision()
+
+    def _prebake(self) -> None:
+        import prebake
+        make_kcbase(self.kcbase, self.port)
+        kc = self.handle()
+        prebake.prebake(kc)
+
+    # Fetches the plugin tarball through mirrors (the first one down, the
+    # others slower and faster than the origin) into an empty artifact cache,
+    # in segments, then again with the tarball cached
+    def download_mirrors(self) -> Dict[str, float]:
+        import downloader
+        cache_dir = self.root.joinpath('artifact-cache')
+        shutil.rmtree(str(cache_dir), ignore_errors=True)
+        urls = [f'http://127.0.0.1:{free_port()}/hs-authenticator.tar.gz']
+        urls += [f'http://127.0.0.1:{server.port}/hs-authenticator.tar.gz' for server in self.mirrors + [self.tarballs]]
+        target = self.workdir.joinpath('hs-authenticator.tar.gz')
+        timings: Dict[str, float] = {}
+        for label in ['download (cold cache)', 'download (cached)']:
+            if target.exists():
+                target.unlink()
+            start = time.monotonic()
+            downloader.dld_with_checks(urls[0], target, self.checksum, urls[1:], str(cache_dir))
+            timings[label] = time.monotonic() - start
+        return timings
+
+    def _provision(self) -> None:
+        import entrypoint
+        kc = self.handle()
+        try:
+            entrypoint.provision(kc)
+        finally:
+            kc.stop()
+
+    # Times each realm administration call of a KeycloakHandle
+    def handle_calls(self, admin_backend: str) -> Dict[str, float]:
+        kc = self.handle(admin_backend)
+        timings: Dict[str, List[float]] = {}
+
+        def timed(name: str, fn: Callable[[], Any]) -> None:
+            start = time.monotonic()
+            fn()
+            timings.setdefault(name, []).append(time.monotonic() - start)
+
+        try:
+            kc.start()
+            timed('login', kc.login)
+            for i in range(self.iterations):
+                flow = f'bench-{admin_backend}-{i}'
+                timed('create_authentication_flow', partial(
+                    kc.create_authentication_flow, 'master', flow, 'basic-flow', flow, True, False))
+                timed('list_authentication_flows', partial(kc.list_authentication_flows, 'master'))
+                timed('create_execution', partial(
+                    kc.create_execution, 'master', flow, 'hyerpsign-qrocde-authenticator', 'REQUIRED'))
+                timed('list_executions', partial(kc.list_executions, 'master', flow))
+        finally:
+            kc.stop()
+        return {name: sum(values) / len(values) for name, values in timings.items()}
+
+    # Times management calls through one-off jboss_cli processes and through a
+    # long-lived session
+    def jboss_cli_calls(self) -> Dict[str, float]:
+        kc = self.handle()
+        timings: Dict[str, float] = {}
+        try:
+            kc.start()
+            start = time.monotonic()
+            for _ in range(self.iterations):
+                kc.is_ready()
+            timings['is_ready (one-off)'] = (time.monotonic() - start) / self.iterations
+            with kc.cli_session():
+                start = time.monotonic()
+                for _ in range(self.iterations):
+                    kc.is_ready()
+                timings['is_ready (session)'] = (time.monotonic() - start) / self.iterations
+        finally:
+            kc.stop()
+        return timings
+
+    def run(self, scenario: str) -> BenchResult:
+        scenarios: Dict[str, Callable[[], Optional[Dict[str, float]]]] = {
+            'cold-start': self.cold_start,
+            'warm-start': self.warm_start,
+            'prebaked-start': self.prebaked_start,
+            'download-mirrors': self.download_mirrors,
+            'handle-kcadm': partial(self.handle_calls, 'kcadm'),
+            'handle-rest': partial(self.handle_calls, 'rest'),
+            'jboss-cli': self.jboss_cli_calls,
+        }
+        if scenario == 'prebaked-start':
+            self._prebake()
+        return self.measure(scenario, scenarios[scenario])
+
+    def close(self) -> None:
+        for server in [self.tarballs] + self.mirrors:
+            server.close()
+
+
+def print_report(results: List[BenchResult]) -> None:
+    print()
+    print(f'{"scenario":<16} {"wall (s)":>9} {"kcadm":>6} {"jboss":>6} {"boots":>6} {"restarts":>8} '
+          f'{"read (KiB)":>11} {"downloaded (KiB)":>17}')
+    for r in results:
+        print(f'{r.scenario:<16} {r.wall:9.3f} {r.kcadm_spawns:6d} {r.jboss_spawns:6d} {r.boots:6d} '
+              f'{r.restarts:8d} {r.bytes_read / 1024:11.1f} {r.bytes_downloaded / 1024:17.1f}')
+        for name, seconds in sorted(r.per_call.items()):
+            print(f'    {name:<40} {seconds * 1000:9.1f} ms/call')
+
+
+# Main()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the Keycloak provisioning code')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these (repeatable)')
+    parser.add_argument('--iterations', type=int, default=5, help='calls per method in the handle scenarios')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory around')
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix='hskc-bench-'))
+    bench = Bench(root, args.iterations)
+    results: List[BenchResult] = []
+    try:
+        for scenario in args.scenario or SCENARIOS:
+            print(f'=== {scenario}')
+            results.append(bench.run(scenario))
+    finally:
+        bench.close()
+        if args.keep:
+            print(f'Scratch directory kept at {root}')
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump([r._asdict() for r in results], fp, indent=2)
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+# Stand-in for jboss-cli.sh, for benchmarks. It sleeps BENCH_JBOSS_LATENCY
+# seconds (the JVM startup) and then runs commands from --file or, like an
+# interactive session, from stdin. It understands the commands used by the
+# provisioning code: connect, module add, batch/run-batch, embed-server,
+# write-attribute of the keycloak-server providers (which it writes to the
+# configuration file) and the server-state check. Management operations reach
+# the fake server at BENCH_KC_PORT. Every spawn is appended to
+# $BENCH_KCBASE/spawns.log.
+
+# Stdlib Imports
+import json
+import os
+import re
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, TextIO
+
+# Environment Variable Arguments
+BENCH_KCBASE = Path(os.getenv('BENCH_KCBASE', '.'))
+BENCH_KC_PORT = int(os.getenv('BENCH_KC_PORT', '8080'))
+BENCH_JBOSS_LATENCY = float(os.getenv('BENCH_JBOSS_LATENCY', '0.8'))
+BENCH_EMBED_TIME = float(os.getenv('BENCH_EMBED_TIME', '0.5'))  # seconds an embed-server takes to boot
+KEYCLOAK_MODE = os.getenv('KEYCLOAK_MODE', 'standalone')
+
+# Constants
+PROVIDERS_WRITE = re.compile(r'/subsystem=keycloak-server/?:write-attribute\(name=providers,value=(\[.*\])\)')
+
+
+def server_up() -> bool:
+    try:
+        socket.create_connection(('127.0.0.1', BENCH_KC_PORT), 0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+def write_providers(cfg: Path, providers: List[str]) -> None:
+    text = cfg.read_text()
+    listing = ''.join(f'\n                <provider>{p}</provider>' for p in providers)
+    text = re.sub(r'<providers>.*?</providers>', f'<providers>{listing}\n            </providers>', text, flags=re.S)
+    cfg.write_text(text)
+
+
+def emit(doc: Dict[str, Any]) -> None:
+    print(json.dumps(doc, indent=4, separators=(',', ' : ')), flush=True)
+
+
+# CLI runs commands one by one, tracking the connection and the batch, and
+# returns the exit code jboss-cli would have in --file mode
+class CLI:
+
+    def __init__(self, cfg: Path, file_mode: bool) -> None:
+        self.cfg = cfg
+        self.file_mode = file_mode
+        self.connected = False
+        self.embedded = False
+        self.batch: List[str] = []
+        self.in_batch = False
+
+    def fail(self, message: str) -> bool:
+        print(message, flush=True)
+        return not self.file_mode
+
+    def run_batch(self) -> bool:
+        results = {f'step-{i + 1}': {'outcome': 'success', 'result': None} for i in range(len(self.batch))}
+        for op in self.batch:
+            match = PROVIDERS_WRITE.match(op)
+            if match:
+                write_providers(self.cfg, json.loads(match.group(1)))
+        emit({'outcome': 'success', 'result': results})
+        self.batch = []
+        self.in_batch = False
+        return True
+
+    # Returns False when jboss-cli would stop with an error
+    def run(self, line: str) -> bool:
+        if line == 'connect':
+            if not server_up():
+                return self.fail('Failed to connect to the controller: WFLYPRT0053: Could not connect to remote+http://localhost:9990')
+            self.connected = True
+        elif line.startswith('echo '):
+            print(line[len('echo '):], flush=True)
+        elif line in ('disconnect', 'shutdown'):
+            self.connected = False
+            if line == 'shutdown':
+                emit({'outcome': 'success'})
+        elif line.startswith('embed-server'):
+            time.sleep(BENCH_EMBED_TIME)
+            self.embedded = True
+        elif line == 'stop-embedded-server':
+            self.embedded = False
+        elif line.startswith('module add'):
+            name = re.search(r'--name=(\S+)', line)
+            module_dir = BENCH_KCBASE.joinpath('modules', name.group(1) if name else 'unknown', 'main')
+            module_dir.mkdir(parents=True, exist_ok=True)
+            module_dir.joinpath('module.xml').write_text('<module xmlns="urn:jboss:module:1.1"/>\n')
+        elif line == 'batch':
+            self.in_batch = True
+        elif line.startswith('run-batch'):
+            return self.run_batch()
+        elif self.in_batch:
+            self.batch.append(line)
+        elif not (self.connected or self.embedded):
+            return self.fail("You are disconnected at the moment. Type 'connect' to connect to the server or 'help' for the list of supported commands.")
+        elif 'server-state' in line:
+            emit({'outcome': 'success', 'result': 'running'})
+        else:
+            match = PROVIDERS_WRITE.match(line)
+            if match:
+                write_providers(self.cfg, json.loads(match.group(1)))
+            emit({'outcome': 'success', 'result': None})
+        return True
+
+
+def main(args: List[str]) -> int:
+    with open(BENCH_KCBASE.joinpath('spawns.log'), 'a') as fp:
+        fp.write('jboss-cli\n')
+    time.sleep(BENCH_JBOSS_LATENCY)
+    files = [a.split('=', 1)[1].strip('"') for a in args if a.startswith('--file=')]
+    cfg = BENCH_KCBASE.joinpath('standalone', 'configuration', f'{KEYCLOAK_MODE}.xml')
+    cli = CLI(cfg, bool(files))
+    source: TextIO = open(files[0], 'r') if files else sys.stdin
+    with source:
+        for line in source:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line == 'quit':
+                break
+            if not cli.run(line):
+                return 1
+    return 0
+
+
+# Main()
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# Stand-in for kcadm.sh, for benchmarks. It sleeps BENCH_KCADM_LATENCY seconds
+# (the JVM startup kcadm.sh pays on every call) and then makes the same Admin
+# REST API call kcadm.sh would, against the server given to
+# `config credentials`. Output is printed the way kcadm.sh prints it. Every
+# spawn is appended to $BENCH_KCBASE/spawns.log.
+
+# Stdlib Imports
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+# Environment Variable Arguments
+BENCH_KCBASE = os.getenv('BENCH_KCBASE', '.')
+BENCH_KCADM_LATENCY = float(os.getenv('BENCH_KCADM_LATENCY', '0.4'))
+
+
+def config_path() -> str:
+    return os.path.join(BENCH_KCBASE, 'kcadm.config')
+
+
+def http(method: str, url: str, token: str = '', body: Optional[bytes] = None, form: bool = False) -> Tuple[int, Any, str]:
+    req = Request(url, data=body, method=method)
+    if token:
+        req.add_header('Authorization', f'Bearer {token}')
+    if body is not None:
+        req.add_header('Content-Type', 'application/x-www-form-urlencoded' if form else 'application/json')
+    try:
+        with urlopen(req) as resp:
+            data = resp.read().decode('utf-8')
+            return resp.status, json.loads(data) if data else None, resp.headers.get('Location', '')
+    except HTTPError as err:
+        data = err.read().decode('utf-8')
+        return err.code, json.loads(data) if data else None, ''
+
+
+def parse_value(value: str) -> Any:
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+# Splits kcadm style arguments into the positional ones and the options
+def parse_args(args: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+    positional: List[str] = []
+    options: Dict[str, List[str]] = {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ('--noquotes', '-o'):
+            options[arg] = []
+        elif arg.startswith('-'):
+            options.setdefault(arg, []).append(args[i + 1] if i + 1 < len(args) else '')
+            i += 1
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
+
+
+def print_json(doc: Any) -> None:
+    print(json.dumps(doc, indent=2, separators=(',', ' : ')))
+
+
+def main(args: List[str]) -> int:
+    with open(os.path.join(BENCH_KCBASE, 'spawns.log'), 'a') as fp:
+        fp.write('kcadm\n')
+    time.sleep(BENCH_KCADM_LATENCY)
+    positional, options = parse_args(args)
+    if positional[:2] == ['config', 'credentials']:
+        server = options['--server'][0]
+        form = urlencode({
+            'grant_type': 'password',
+            'client_id': 'admin-cli',
+            'username': options['--user'][0],
+            'password': options['--password'][0],
+        }).encode('utf-8')
+        realm = options.get('--realm', ['master'])[0]
+        status, token, _ = http('POST', f'{server}/realms/{realm}/protocol/openid-connect/token', body=form, form=True)
+        if status != 200:
+            print('Invalid user credentials [invalid_grant]', file=sys.stderr)
+            return 1
+        with open(config_path(), 'w') as fp:
+            json.dump({'server': server, 'token': token['access_token']}, fp)
+        print(f'Logging into {server} as user {options["--user"][0]} of realm {realm}', file=sys.stderr)
+        return 0
+    try:
+        with open(config_path(), 'r') as fp:
+            config = json.load(fp)
+    except OSError:
+        print('No server specified. Use --server, or \'kcadm.sh config credentials or connection\'.', file=sys.stderr)
+        return 1
+    action, path = positional[0], positional[1]
+    realm = options.get('-r', ['master'])[0]
+    url = f'{config["server"]}/admin/realms/{realm}/{path}'
+    if path == 'realms' or path.startswith('realms/'):
+        url = f'{config["server"]}/admin/{path}'
+    if '-q' in options:
+        url = f'{url}?{"&".join(options["-q"])}'
+    body: Any = None
+    if '-b' in options:
+        body = json.loads(options['-b'][0])
+    elif '-f' in options:
+        with open(options['-f'][0], 'r') as fp:
+            body = json.load(fp)
+    if '-s' in options:
+        body = body or {}
+        for setting in options['-s']:
+            key, value = setting.split('=', 1)
+            body[key] = parse_value(value)
+    method = {'get': 'GET', 'create': 'POST', 'update': 'PUT', 'delete': 'DELETE'}[action]
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    status, reply, location = http(method, url, config['token'], data)
+    if status == 401:
+        print('Session has expired. Login again with \'kcadm.sh config credentials\'', file=sys.stderr)
+        return 1
+    if status >= 400:
+        message = reply.get('errorMessage') or reply.get('error') if isinstance(reply, dict) else reply
+        print(f'{method} {url}: HTTP {status}: {message}', file=sys.stderr)
+        return 1
+    if action == 'get' or (action == 'create' and '-o' in options and reply is not None):
+        print_json(reply)
+    elif action == 'create' and location:
+        print(f"Created new resource with id '{location.rstrip('/').rsplit('/', 1)[-1]}'", file=sys.stderr)
+    return 0
+
+
+# Main()
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+
+# Stand-in for a Keycloak server, for benchmarks. It takes BENCH_BOOT_TIME
+# seconds to "boot", then answers readiness probes, the token endpoint and the
+# parts of the Admin REST API that the provisioning code uses, keeping
+# everything in memory. Each boot is appended to $BENCH_KCBASE/boots.log.
+# While booting, it prints WildFly-like boot messages; with BENCH_BOOT_FAIL
+# set, the deployment fails and it never becomes ready.
+
+# Stdlib Imports
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Environment Variable Arguments
+BENCH_KCBASE = os.getenv('BENCH_KCBASE', '')
+BENCH_BOOT_TIME = float(os.getenv('BENCH_BOOT_TIME', '2'))  # seconds before the server starts listening
+BENCH_ADMIN_LATENCY = float(os.getenv('BENCH_ADMIN_LATENCY', '0.005'))  # seconds added to every admin request
+BENCH_BOOT_FAIL = os.getenv('BENCH_BOOT_FAIL', '') == 'true'  # fail the deployment, like a broken provider would
+
+# Constants
+TOKEN_LIFETIME = 60
+# Boot messages, roughly as WildFly logs them, spread over BENCH_BOOT_TIME
+BOOT_MESSAGES = [
+    'INFO  [org.jboss.as] (MSC service thread 1-2) WFLYSRV0049: Keycloak 9.0.0 (WildFly Core 10.0.3.Final) starting',
+    'INFO  [org.jboss.as.server] (Controller Boot Thread) WFLYSRV0039: Creating http management service',
+    'INFO  [org.jboss.as.clustering.infinispan] (ServerService Thread Pool -- 4) WFLYCLINF0001: Activating Infinispan subsystem.',
+    'INFO  [org.wildfly.extension.undertow] (MSC service thread 1-4) WFLYUT0006: Undertow HTTP listener default listening on 127.0.0.1:8080',
+    'INFO  [org.jboss.as.connector.subsystems.datasources] (ServerService Thread Pool -- 60) WFLYJCA0001: Bound data source [java:jboss/datasources/KeycloakDS]',
+    'INFO  [org.keycloak.services] (ServerService Thread Pool -- 60) KC-SERVICES0001: Loading config from standalone.xml or domain.xml',
+    'INFO  [org.wildfly.extension.undertow] (ServerService Thread Pool -- 60) WFLYUT0021: Registered web context: \'/auth\' for server \'default-server\'',
+]
+BOOT_SUCCESS_MESSAGES = [
+    'INFO  [org.jboss.as.server] (ServerService Thread Pool -- 46) WFLYSRV0010: Deployed "keycloak-server.war" (runtime-name : "keycloak-server.war")',
+    'INFO  [org.jboss.as] (Controller Boot Thread) WFLYSRV0025: Keycloak 9.0.0 (WildFly Core 10.0.3.Final) started in {ms}ms - Started 590 of 885 services (602 services are lazy, passive or on-demand)',
+]
+BOOT_FAILURE_MESSAGES = [
+    'ERROR [org.jboss.as.controller.management-operation] (Controller Boot Thread) WFLYCTL0013: Operation ("deploy") failed - address: ([("deployment" => "keycloak-server.war")])',
+    'ERROR [org.jboss.as] (Controller Boot Thread) WFLYSRV0026: Keycloak 9.0.0 (WildFly Core 10.0.3.Final) started (with errors) in {ms}ms - Started 540 of 885 services (1 services failed or missing dependencies)',
+]
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def new_realm(name: str) -> Dict[str, Any]:
+    return {
+        'rep': {'id': name, 'realm': name, 'enabled': True, 'attributes': {}},
+        'flows': {},
+        'configs': {},
+        'clients': {},
+        'users': {},
+    }
+
+
+# In-memory state of the fake server, shared by all request threads
+class FakeState:
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.realms: Dict[str, Dict[str, Any]] = {'master': new_realm('master')}
+        self.tokens: Dict[str, float] = {}
+
+    def issue_token(self) -> Dict[str, Any]:
+        token = uuid.uuid4().hex
+        self.tokens[token] = time.monotonic() + TOKEN_LIFETIME
+        return {
+            'access_token': token,
+            'expires_in': TOKEN_LIFETIME,
+            'refresh_token': uuid.uuid4().hex,
+            'refresh_expires_in': 1800,
+            'token_type': 'bearer',
+        }
+
+    def is_authorized(self, header: Optional[str]) -> bool:
+        if not header or not header.startswith('Bearer '):
+            return False
+        return self.tokens.get(header[len('Bearer '):], 0) > time.monotonic()
+
+
+STATE = FakeState()
+
+
+# Routes admin requests below /auth/admin/realms/ to the realm's state.
+# Returns a status code, a body and the id of a created resource (if any).
+def route_admin(method: str, parts: List[str], query: Dict[str, List[str]], body: Any) -> Tuple[int, Any, str]:
+    if not parts:
+        if method == 'POST':
+            STATE.realms[body['realm']] = new_realm(body['realm'])
+            return 201, None, body['realm']
+        return 200, [r['rep'] for r in STATE.realms.values()], ''
+    realm = STATE.realms.get(parts[0])
+    if realm is None:
+        return 404, {'error': 'Realm not found.'}, ''
+    rest = parts[1:]
+    if not rest:
+        if method == 'PUT':
+            attributes = dict(realm['rep'].get('attributes', {}), **body.get('attributes', {}))
+            realm['rep'].update(body, attributes=attributes)
+            return 204, None, ''
+        return 200, realm['rep'], ''
+    if rest == ['partial-export'] and method == 'POST':
+        return 200, partial_export(realm, query.get('exportClients') == ['true']), ''
+    if rest[:2] == ['authentication', 'flows']:
+        return route_flows(realm, method, rest[2:], body)
+    if rest[:2] == ['authentication', 'executions'] and rest[3:] == ['config'] and method == 'POST':
+        config_id = str(uuid.uuid4())
+        realm['configs'][config_id] = dict(body, id=config_id)
+        for flow in realm['flows'].values():
+            for execution in flow['executions']:
+                if execution['id'] == rest[2]:
+                    execution['authenticationConfig'] = config_id
+        return 201, None, config_id
+    if rest[:2] == ['authentication', 'config'] and len(rest) == 3:
+        config = realm['configs'].get(rest[2])
+        if config is None:
+            return 404, {'error': 'Could not find authenticator config'}, ''
+        if method == 'PUT':
+            config.update(body)
+            return 204, None, ''
+        return 200, config, ''
+    if rest == ['partialImport'] and method == 'POST':
+        return route_partial_import(realm, body)
+    if rest[0] in ('clients', 'users'):
+        return route_collection(realm[rest[0]], method, rest[1:], query, body)
+    return 404, {'error': 'RESTEASY003210: Could not find resource for full path'}, ''
+
+
+def route_flows(realm: Dict[str, Any], method: str, rest: List[str], body: Any) -> Tuple[int, Any, str]:
+    flows = realm['flows']
+    if not rest:
+        if method == 'POST':
+            if body['alias'] in flows:
+                return 409, {'errorMessage': 'Flow already exists'}, ''
+            flow_id = str(uuid.uuid4())
+            flows[body['alias']] = {'rep': dict(body, id=flow_id), 'executions': []}
+            return 201, None, flow_id
+        return 200, [dict(f['rep'], authenticationExecutions=[]) for f in flows.values()], ''
+    flow = flows.get(rest[0])
+    if flow is None:
+        return 404, {'error': 'Flow not found'}, ''
+    executions = flow['executions']
+    if rest[1:] == ['executions'] and method == 'GET':
+        return 200, executions, ''
+    if rest[1:] == ['executions'] and method == 'PUT':
+        for execution in executions:
+            if execution['id'] == body['id']:
+                execution['requirement'] = body.get('requirement', execution['requirement'])
+        return 204, None, ''
+    if rest[1:] == ['executions', 'execution'] and method == 'POST':
+        execution_id = str(uuid.uuid4())
+        executions.append({
+            'id': execution_id,
+            'requirement': body.get('requirement', 'DISABLED'),
+            'displayName': body['provider'],
+            'requirementChoices': ['REQUIRED', 'DISABLED', 'ALTERNATIVE'],
+            'configurable': True,
+            'providerId': body['provider'],
+            'level': 0,
+            'index': len(executions),
+        })
+        return 201, None, execution_id
+    return 404, {'error': 'RESTEASY003210: Could not find resource for full path'}, ''
+
+
+# The realm with its flows (executions listed the way an export has them, by
+# authenticator and config alias) and, if asked for, its clients
+def partial_export(realm: Dict[str, Any], export_clients: bool) -> Dict[str, Any]:
+    configs = realm['configs']
+    flows = []
+    for alias, flow in realm['flows'].items():
+        executions = [{
+            'authenticator': e['providerId'],
+            'authenticatorConfig': configs[e['authenticationConfig']]['alias'] if e.get('authenticationConfig') else None,
+            'requirement': e['requirement'],
+            'priority': (e['index'] + 1) * 10,
+            'userSetupAllowed': False,
+            'autheticatorFlow': False,
+        } for e in flow['executions']]
+        flows.append(dict(flow['rep'], builtIn=flow['rep'].get('builtIn', False), authenticationExecutions=executions))
+    export = dict(realm['rep'], authenticationFlows=flows, authenticatorConfig=list(configs.values()))
+    if export_clients:
+        export['clients'] = [dict(c, secret='**********') if 'secret' in c else c for c in realm['clients'].values()]
+    return export
+
+
+# Imports clients and users, like Keycloak does: in one go, and failing the
+# whole request if a resource exists and ifResourceExists is FAIL
+def route_partial_import(realm: Dict[str, Any], body: Any) -> Tuple[int, Any, str]:
+    policy = body.get('ifResourceExists', 'FAIL')
+    kinds = [('clients', 'clientId', 'CLIENT'), ('users', 'username', 'USER')]
+    planned: List[Tuple[str, Dict[str, Any], Dict[str, Any], Optional[str]]] = []
+    for key, name_field, _ in kinds:
+        existing = {item.get(name_field): item_id for item_id, item in realm[key].items()}
+        for rep in body.get(key, []):
+            if not rep.get(name_field):
+                return 400, {'errorMessage': f'{name_field} is required'}, ''
+            item_id = existing.get(rep[name_field])
+            if item_id is not None and policy == 'FAIL':
+                return 409, {'errorMessage': f'{rep[name_field]} already exists'}, ''
+            planned.append((key, rep, realm[key], item_id))
+    counts = {'added': 0, 'skipped': 0, 'overwritten': 0}
+    results: List[Dict[str, Any]] = []
+    for key, rep, items, item_id in planned:
+        name_field, resource_type = [(n, t) for k, n, t in kinds if k == key][0]
+        if item_id is None:
+            item_id, action = str(uuid.uuid4()), 'ADDED'
+            items[item_id] = dict(rep, id=item_id)
+        elif policy == 'SKIP':
+            action = 'SKIPPED'
+        else:
+            action = 'OVERWRITTEN'
+            items[item_id] = dict(rep, id=item_id)
+        counts[action.lower()] += 1
+        results.append({'action': action, 'resourceType': resource_type, 'resourceName': rep[name_field], 'id': item_id})
+    return 200, dict(counts, results=results), ''
+
+
+def route_collection(
+        items: Dict[str, Any],
+        method: str,
+        rest: List[str],
+        query: Dict[str, List[str]],
+        body: Any,
+) -> Tuple[int, Any, str]:
+    if not rest:
+        if method == 'POST':
+            item_id = body.get('id') or str(uuid.uuid4())
+            items[item_id] = dict(body, id=item_id)
+            return 201, None, item_id
+        found = list(items.values())
+        for key, values in query.items():
+            if key in ('clientId', 'username'):
+                found = [item for item in found if item.get(key) == values[0]]
+        return 200, found, ''
+    item = items.get(rest[0])
+    if item is None:
+        return 404, {'error': 'not found'}, ''
+    if method == 'PUT':
+        item.update(body)
+        return 204, None, ''
+    if method == 'DELETE':
+        del items[rest[0]]
+        return 204, None, ''
+    return 200, item, ''
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _reply(self, status: int, body: Any = None, location: str = '') -> None:
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', str(len(data)))
+        if data:
+            self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str) -> None:
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if parts[:2] == ['auth', 'realms'] and parts[-1:] == ['token']:
+            with STATE.lock:
+                return self._reply(200, STATE.issue_token())
+        if parts[:2] == ['auth', 'realms'] and len(parts) == 3 and method == 'GET':
+            known = parts[2] in STATE.realms
+            return self._reply(200 if known else 404, {'realm': parts[2]})
+        if parts[:3] != ['auth', 'admin', 'realms']:
+            return self._reply(404, {'error': 'not found'})
+        time.sleep(BENCH_ADMIN_LATENCY)
+        with STATE.lock:
+            if not STATE.is_authorized(self.headers.get('Authorization')):
+                return self._reply(401, {'error': 'HTTP 401 Unauthorized'})
+            body = json.loads(raw.decode('utf-8')) if raw else None
+            status, reply, created_id = route_admin(method, parts[3:], parse_qs(url.query), body)
+        location = f'http://{self.headers.get("Host")}{url.path.rstrip("/")}/{created_id}' if created_id else ''
+        self._reply(status, reply, location)
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def do_PUT(self) -> None:
+        self._handle('PUT')
+
+    def do_DELETE(self) -> None:
+        self._handle('DELETE')
+
+
+# Main()
+# Usage: fake_keycloak.py port
+if __name__ == '__main__':
+    if BENCH_KCBASE:
+        with open(os.path.join(BENCH_KCBASE, 'boots.log'), 'a') as fp:
+            fp.write(f'{time.time()}\n')
+    booted = time.monotonic()
+    for message in BOOT_MESSAGES:
+        print(time.strftime('%H:%M:%S,000 ') + message, flush=True)
+        time.sleep(BENCH_BOOT_TIME / len(BOOT_MESSAGES))
+    ms = int((time.monotonic() - booted) * 1000)
+    for message in BOOT_FAILURE_MESSAGES if BENCH_BOOT_FAIL else BOOT_SUCCESS_MESSAGES:
+        print(time.strftime('%H:%M:%S,000 ') + message.format(ms=ms), flush=True)
+    if BENCH_BOOT_FAIL:
+        while True:  # up, but never ready, like with keycloak-server.war not deployed
+            time.sleep(60)
+    server = ThreadingHTTPServer(('127.0.0.1', int(sys.argv[1])), Handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
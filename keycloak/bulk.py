@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import csv
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, TextIO, Tuple
+
+# Local Imports
+from admin_client import KeycloakAdminAPIError
+from keycloak import KeycloakAdminCLIError
+
+
+# Constants
+IF_EXISTS_POLICIES = ['SKIP', 'OVERWRITE']
+CSV_BOOLEANS = {'true': True, 'false': False}
+HTTP_CLIENT_ERROR = re.compile(r'\b4(0[02-9]|[1-9][0-9])\b')  # any 4xx but 401
+
+
+class InvalidIfExistsPolicyError(Exception):
+
+    def __init__(self, policy: str) -> None:
+        self.policy = policy
+
+    def __str__(self) -> str:
+        return f'ifResourceExists must be one of {", ".join(IF_EXISTS_POLICIES)}, not "{self.policy}"'
+
+
+# One record as read from a bulk input file, with the line it came from.
+# Records that could not be read carry the error instead of the fields.
+class SourceRecord(NamedTuple):
+    line: int
+    fields: Dict[str, Any]
+    error: str = ''
+
+
+# What happened to one imported resource: ADDED, SKIPPED, OVERWRITTEN or ERROR
+class ImportResult(NamedTuple):
+    line: int
+    name: str
+    action: str
+    id: str = ''
+    error: str = ''
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict())
+
+
+# Each line is a JSON object. Blank lines, and the lines up to start_after
+# (which aren't even decoded), are skipped.
+def read_jsonl(fp: TextIO, start_after: int = 0) -> Iterator[SourceRecord]:
+    for line_no, line in enumerate(fp, 1):
+        if line_no <= start_after or not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            yield SourceRecord(line_no, {}, f'not JSON: {e}')
+            continue
+        if not isinstance(fields, dict):
+            yield SourceRecord(line_no, {}, 'not a JSON object')
+            continue
+        yield SourceRecord(line_no, fields)
+
+
+# The header names the fields. list_columns hold whitespace separated values,
+# true/false in boolean_columns become booleans (other columns, like a
+# password, keep them as text), attributes.<name> columns go into the attributes
+# (as single element lists when attribute_lists is set, like users need) and
+# empty cells are left out. Rows ending on or before line start_after are skipped.
+def read_csv(
+        fp: TextIO,
+        list_columns: List[str],
+        boolean_columns: List[str],
+        attribute_lists: bool = False,
+        start_after: int = 0,
+) -> Iterator[SourceRecord]:
+    reader = csv.DictReader(fp)
+    for row in reader:
+        if reader.line_num <= start_after:
+            continue
+        fields: Dict[str, Any] = {}
+        for column, value in row.items():
+            if column is None or value is None or value == '':
+                continue
+            if column in list_columns:
+                fields[column] = value.split()
+            elif column.startswith('attributes.'):
+                fields.setdefault('attributes', {})[column[len('attributes.'):]] = [value] if attribute_lists else value
+            elif column in boolean_columns:
+                fields[column] = CSV_BOOLEANS.get(value.lower(), value)
+            else:
+                fields[column] = value
+        yield SourceRecord(reader.line_num, fields)
+
+
+# Streams records out of a .csv file, or a JSON Lines file otherwise
+def read_records(
+        path: Path,
+        list_columns: List[str],
+        boolean_columns: List[str],
+        attribute_lists: bool = False,
+        start_after: int = 0,
+) -> Iterator[SourceRecord]:
+    with open(path, 'r', newline='') as fp:
+        if path.suffix.lower() == '.csv':
+            yield from read_csv(fp, list_columns, boolean_columns, attribute_lists, start_after)
+        else:
+            yield from read_jsonl(fp, start_after)
+
+
+def check_if_exists_policy(policy: str) -> str:
+    if policy.upper() not in IF_EXISTS_POLICIES:
+        raise InvalidIfExistsPolicyError(policy)
+    return policy.upper()
+
+
+# Whether an error means Keycloak rejected the request itself (as opposed to
+# being unreachable), so that retrying smaller parts of it can isolate the
+# culprit
+def is_rejection(error: Exception) -> bool:
+    if isinstance(error, KeycloakAdminAPIError):
+        return 400 <= error.status < 500 and error.status != 401
+    if isinstance(error, KeycloakAdminCLIError):
+        return bool(HTTP_CLIENT_ERROR.search(error.output))
+    return False
+
+
+# The last line of an error's message, which says what went wrong
+def error_reason(error: Exception) -> str:
+    lines = str(error).strip().splitlines()
+    return lines[-1] if lines else type(error).__name__
+
+
+# Pairs the results of a partial import with the (line, name) of the resources
+# submitted, by the resource name
+def match_results(reply: Any, resource_type: str, submitted: List[Tuple[int, str]]) -> List[ImportResult]:
+    results = (reply or {}).get('results', [])
+    outcomes = {r.get('resourceName'): r for r in results if r.get('resourceType') == resource_type}
+    matched: List[ImportResult] = []
+    for line, name in submitted:
+        outcome = outcomes.get(name)
+        if outcome is None:
+            matched.append(ImportResult(line, name, 'ERROR', error='missing from the import results'))
+        else:
+            matched.append(ImportResult(line, name, outcome.get('action', ''), outcome.get('id', '')))
+    return matched
+
+
+def count_actions(results: List[ImportResult], counts: Dict[str, int]) -> Dict[str, int]:
+    for result in results:
+        counts[result.action] = counts.get(result.action, 0) + 1
+    return counts
+
+
+def describe_counts(counts: Dict[str, int]) -> str:
+    return ', '.join(f'{count} {action.lower()}' for action, count in sorted(counts.items()))
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+# Local Imports
+from admin_client import KeycloakAdminAPIError
+from bulk import (
+    IF_EXISTS_POLICIES,
+    ImportResult,
+    SourceRecord,
+    check_if_exists_policy,
+    count_actions,
+    describe_counts,
+    error_reason,
+    is_rejection,
+    match_results,
+    read_records,
+)
+from keycloak import KeycloakHandle, KeycloakAdminCLIError
+from tracing import span
+
+
+# Environment Variable Arguments
+AUTH_FLOW_NAME = os.getenv('AUTH_FLOW_NAME', '')
+HS_CLIENT_TEMPLATE = os.getenv('HS_CLIENT_TEMPLATE', str(Path(__file__).parent.joinpath('client-update.json')))
+HS_CLIENT_CHUNK_SIZE = int(os.getenv('HS_CLIENT_CHUNK_SIZE', '200'))  # clients per partial import request
+HS_CLIENT_IF_EXISTS = os.getenv('HS_CLIENT_IF_EXISTS', 'SKIP')  # SKIP or OVERWRITE clients that already exist
+
+# Constants
+# CSV columns holding lists; their values are separated by whitespace
+CSV_LIST_COLUMNS = ['redirectUris', 'webOrigins', 'defaultClientScopes', 'optionalClientScopes']
+# CSV columns holding true or false
+CSV_BOOLEAN_COLUMNS = [
+    'enabled',
+    'publicClient',
+    'bearerOnly',
+    'consentRequired',
+    'standardFlowEnabled',
+    'implicitFlowEnabled',
+    'directAccessGrantsEnabled',
+    'serviceAccountsEnabled',
+    'frontchannelLogout',
+    'fullScopeAllowed',
+    'surrogateAuthRequired',
+    'alwaysDisplayInConsole',
+]
+DEFAULT_REDIRECT_URIS = ['/*']
+
+
+class ClientDefinitionError(Exception):
+
+    def __init__(self, line: int, reason: str) -> None:
+        self.line = line
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f'Invalid client definition on line {self.line}: {self.reason}'
+
+
+# Client definitions are JSON objects (one per line) or CSV rows with the
+# clientId, optionally redirectUris (a list, or a single URI) and any other
+# fields of a client representation, which override those of the template.
+def read_client_definitions(path: Path) -> Iterator[SourceRecord]:
+    return read_records(path, CSV_LIST_COLUMNS, CSV_BOOLEAN_COLUMNS)
+
+
+# Replaces the placeholders of the template (whole string values, like
+# CLIENT_ALIAS) with their values. A list placeholder within a list, like
+# VALID_REDIRECT_URI within redirectUris, is expanded in place.
+def _substitute(node: Any, values: Dict[str, Any]) -> Any:
+    if isinstance(node, str):
+        return values.get(node, node)
+    if isinstance(node, list):
+        items: List[Any] = []
+        for item in node:
+            value = _substitute(item, values)
+            if isinstance(item, str) and isinstance(value, list):
+                items += value
+            else:
+                items.append(value)
+        return items
+    if isinstance(node, dict):
+        return {key: _substitute(value, values) for key, value in node.items()}
+    return node
+
+
+# Renders a client representation out of the same template (and placeholders)
+# hs-script/kc-configuration.sh fills in with sed. The id is left to Keycloak,
+# and without a flow the authentication flow overrides are dropped.
+def render_client(template: Dict[str, Any], source: SourceRecord, flow_id: str) -> Dict[str, Any]:
+    fields = dict(source.fields)
+    client_id = fields.get('clientId')
+    if not isinstance(client_id, str) or not client_id:
+        raise ClientDefinitionError(source.line, 'clientId is missing')
+    redirect_uris = fields.pop('redirectUris', DEFAULT_REDIRECT_URIS)
+    if isinstance(redirect_uris, str):
+        redirect_uris = [redirect_uris]
+    client = _substitute(template, {
+        'CLIENT_ALIAS': client_id,
+        'CLIENT_ID': '',
+        'FLOW_ID': flow_id,
+        'VALID_REDIRECT_URI': redirect_uris,
+    })
+    if not client.get('id'):
+        client.pop('id', None)
+    overrides = client.get('authenticationFlowBindingOverrides', {})
+    client['authenticationFlowBindingOverrides'] = {k: v for k, v in overrides.items() if v}
+    attributes = fields.pop('attributes', {})
+    client.update(fields)
+    client.setdefault('attributes', {}).update(attributes)
+    return client
+
+
+# BulkClientProvisioner creates clients in bulk through the realm partial
+# import endpoint: definitions are streamed from the input, rendered against
+# the client template and submitted in chunks, so thousands of clients cost
+# a few dozen admin calls instead of two kcadm_cli processes each. A partial
+# import is a single transaction; when Keycloak rejects a chunk, it is split
+# in halves and retried until the offending clients are isolated, so one bad
+# definition only fails itself. Every client gets an ImportResult.
+#
+# Usage:
+#   provisioner = BulkClientProvisioner(kc, 'master', load_template(path))
+#   counts = provisioner.provision(read_client_definitions(clients_path), report_fp)
+class BulkClientProvisioner:
+
+    def __init__(
+            self,
+            kc: KeycloakHandle,
+            realm: str,
+            template: Dict[str, Any],
+            if_exists: str = HS_CLIENT_IF_EXISTS,
+            chunk_size: int = HS_CLIENT_CHUNK_SIZE,
+            flow_alias: str = AUTH_FLOW_NAME,
+    ) -> None:
+        self._kc = kc
+        self._realm = realm
+        self._template = template
+        self._if_exists = check_if_exists_policy(if_exists)
+        self._chunk_size = max(1, chunk_size)
+        self._flow_alias = flow_alias
+        self.requests = 0
+
+    # Id of the flow that clients should use for browser and direct grant
+    # logins, or '' when there is none
+    def _flow_id(self) -> str:
+        if not self._flow_alias:
+            return ''
+        for flow in self._kc.list_authentication_flows(self._realm):
+            if flow.get('alias') == self._flow_alias:
+                return str(flow.get('id', ''))
+        print(f'Flow "{self._flow_alias}" not found in realm {self._realm}; clients will use the default flows')
+        return ''
+
+    # Renders the definitions, turning the ones that can't be imported (invalid
+    # or repeated) into results right away
+    def _prepare(self, sources: Iterable[SourceRecord], flow_id: str) -> Iterator[Any]:
+        seen: Dict[str, int] = {}  # clientId -> line it was first defined on
+        for source in sources:
+            if source.error:
+                yield ImportResult(source.line, '', 'ERROR', error=source.error)
+                continue
+            try:
+                client = render_client(self._template, source, flow_id)
+            except ClientDefinitionError as e:
+                yield ImportResult(source.line, '', 'ERROR', error=e.reason)
+                continue
+            first_line = seen.setdefault(client['clientId'], source.line)
+            if first_line != source.line:
+                yield ImportResult(source.line, client['clientId'], 'ERROR', error=f'duplicate of line {first_line}')
+                continue
+            yield (source.line, client)
+
+    def _import(self, chunk: List[Any]) -> List[ImportResult]:
+        payload = {'ifResourceExists': self._if_exists, 'clients': [client for _, client in chunk]}
+        self.requests += 1
+        with span('clients.partial_import', clients=len(chunk)):
+            reply = self._kc.partial_import(self._realm, payload)
+        return match_results(reply, 'CLIENT', [(line, client['clientId']) for line, client in chunk])
+
+    # Submits a chunk, bisecting it when Keycloak rejects it
+    def _submit(self, chunk: List[Any]) -> List[ImportResult]:
+        try:
+            return self._import(chunk)
+        except (KeycloakAdminAPIError, KeycloakAdminCLIError) as e:
+            if not is_rejection(e):
+                raise
+            if len(chunk) == 1:
+                line, client = chunk[0]
+                return [ImportResult(line, client['clientId'], 'ERROR', error=error_reason(e))]
+            middle = len(chunk) // 2
+            return self._submit(chunk[:middle]) + self._submit(chunk[middle:])
+
+    # Provisions every definition, writing one JSON line per client to report
+    # (if given) as soon as it is known. Returns the number of clients per
+    # action.
+    def provision(self, sources: Iterable[SourceRecord], report: Optional[TextIO] = None) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+
+        def record(results: List[ImportResult]) -> None:
+            count_actions(results, counts)
+            for result in results:
+                if report is not None:
+                    report.write(result.to_json() + '\n')
+                if result.action == 'ERROR':
+                    print(f'Client "{result.name}" (line {result.line}) failed: {result.error}')
+
+        def submit(chunk: List[Any], chunk_no: int) -> None:
+            results = self._submit(chunk)
+            record(results)
+            print(f'Chunk {chunk_no}: {len(chunk)} client(s) submitted, {describe_counts(count_actions(results, {}))}')
+
+        chunk: List[Any] = []
+        chunk_no = 0
+        for item in self._prepare(sources, self._flow_id()):
+            if isinstance(item, ImportResult):
+                record([item])
+                continue
+            chunk.append(item)
+            if len(chunk) == self._chunk_size:
+                chunk_no += 1
+                submit(chunk, chunk_no)
+                chunk = []
+        if chunk:
+            submit(chunk, chunk_no + 1)
+        return counts
+
+
+def load_template(path: Path) -> Dict[str, Any]:
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+# Main()
+# Usage: client_provisioner.py clients.jsonl|clients.csv [--realm R] [--if-exists SKIP|OVERWRITE]
+#                              [--chunk-size N] [--report results.jsonl] [--no-flow]
+if __name__ == '__main__':
+    from keycloak import singleton
+    parser = argparse.ArgumentParser(description='Create Keycloak clients in bulk via partial imports')
+    parser.add_argument('clients', type=Path, help='client definitions, as JSON Lines or CSV (by extension)')
+    parser.add_argument('--realm', default='master')
+    parser.add_argument('--template', type=Path, default=Path(HS_CLIENT_TEMPLATE))
+    parser.add_argument('--if-exists', default=HS_CLIENT_IF_EXISTS, choices=IF_EXISTS_POLICIES, type=str.upper)
+    parser.add_argument('--chunk-size', type=int, default=HS_CLIENT_CHUNK_SIZE)
+    parser.add_argument('--report', type=Path, help='write one JSON line per client here')
+    parser.add_argument('--no-flow', action='store_true', help='don\'t bind clients to AUTH_FLOW_NAME')
+    args = parser.parse_args()
+    singleton.start()
+    singleton.login()
+    provisioner = BulkClientProvisioner(
+        singleton,
+        args.realm,
+        load_template(args.template),
+        args.if_exists,
+        args.chunk_size,
+        '' if args.no_flow else AUTH_FLOW_NAME)
+    report_fp = open(args.report, 'w') if args.report else None
+    try:
+        counts = provisioner.provision(read_client_definitions(args.clients), report_fp)
+    finally:
+        if report_fp is not None:
+            report_fp.close()
+    print(f'Done in {provisioner.requests} request(s): {counts}')
+    sys.exit(1 if counts.get('ERROR') else 0)
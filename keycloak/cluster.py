@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable, List
+
+# Local Imports
+from dag import Step, run_dag
+from keycloak import KeycloakHandle, KEYCLOAK_MODE, KEYCLOAK_USER, KEYCLOAK_PASSWORD, KC_EXECUTION_STRATEGY, KC_ADMIN_BACKEND
+from step_download_install import TarIndex, download_plugin, extract_files, stage_plugin
+from supervisor import supervise
+
+
+# Environment Variable Arguments
+HS_CLUSTER_NODES = os.getenv('HS_CLUSTER_NODES', '')  # path to a JSON list of nodes, see load_cluster_nodes()
+HS_ROLLOUT_MAX_UNAVAILABLE = int(os.getenv('HS_ROLLOUT_MAX_UNAVAILABLE', '1'))  # nodes restarted at the same time
+
+
+class ClusterNodesError(Exception):
+
+    def __init__(self, path: Path, reason: str) -> None:
+        self.path = path
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return (
+            'Unusable list of cluster nodes.\n'
+            f'Path: {self.path}\n'
+            f'Reason: {self.reason}\n'
+        )
+
+
+class ClusterUnavailableError(Exception):
+
+    def __init__(self, reason: str, nodes: List[str]) -> None:
+        self.reason = reason
+        self.nodes = nodes
+
+    def __str__(self) -> str:
+        return (
+            'Refusing to continue the rolling restart.\n'
+            f'Reason: {self.reason}\n'
+            f'Nodes: {", ".join(self.nodes)}\n'
+        )
+
+
+# Loads the nodes of a cluster from a JSON document, like:
+# [ {
+#   "kcbase": "/opt/keycloak-1",
+#   "base_url": "http://localhost:8080",
+#   "controller": "localhost:9990",
+#   "start_cmd": ["/opt/keycloak-1/bin/standalone.sh", "-c", "standalone-ha.xml"]
+# }, ... ]
+# mode, execution_strategy and admin_backend may be set per node as well, and
+# default to the same environment variables the single node setup uses.
+# Nodes must differ in kcbase and base_url (which defaults to KC_BASEURL, so
+# only one node may leave it out).
+def load_cluster_nodes(path: Path) -> List[KeycloakHandle]:
+    with open(path, 'r') as fp:
+        specs = json.load(fp)
+    nodes: List[KeycloakHandle] = []
+    for spec in specs:
+        node = KeycloakHandle(
+            spec['kcbase'],
+            spec.get('mode', KEYCLOAK_MODE),
+            KEYCLOAK_USER,
+            KEYCLOAK_PASSWORD,
+            spec.get('execution_strategy', KC_EXECUTION_STRATEGY),
+            custom_start_cmd=spec.get('start_cmd', []),
+            admin_backend=spec.get('admin_backend', KC_ADMIN_BACKEND),
+            base_url=spec.get('base_url', ''),
+            controller=spec.get('controller', ''),
+        )
+        for other in nodes:
+            if other.kcbase == node.kcbase or other.base_url == node.base_url:
+                raise ClusterNodesError(path, f'two nodes share kcbase {node.kcbase} or base_url {node.base_url}')
+        nodes.append(node)
+    return nodes
+
+
+# KeycloakCluster rolls the plugin out to every node of a standalone-ha
+# cluster. Nodes that already serve are attached to first, so that they are
+# staged online and restarted through the management API. Staging (theme,
+# configuration, module) happens on all nodes at once, since it doesn't affect
+# serving. Nodes that need a restart are then
+# restarted in waves of at most max_unavailable nodes, each wave in parallel,
+# and the next wave only goes down once the previous one is ready again. The
+# rollout takes about as long as the number of waves times a single restart.
+class KeycloakCluster:
+
+    def __init__(self, nodes: List[KeycloakHandle], max_unavailable: int = HS_ROLLOUT_MAX_UNAVAILABLE) -> None:
+        self._nodes = nodes
+        self._max_unavailable = max(1, max_unavailable)
+
+    @property
+    def nodes(self) -> List[KeycloakHandle]:
+        return list(self._nodes)
+
+    def _node_step(self, verb: str, node: KeycloakHandle, fn: Callable[[KeycloakHandle], Any]) -> Step:
+        return Step(f'{verb} node {self._nodes.index(node) + 1} ({node.base_url})', lambda _: fn(node))
+
+    # Runs fn against every node concurrently
+    def for_each_node(self, verb: str, fn: Callable[[KeycloakHandle], Any], nodes: List[KeycloakHandle]) -> None:
+        if nodes:
+            run_dag([self._node_step(verb, node, fn) for node in nodes], max_workers=len(nodes))
+
+    # Finds the nodes that are serving already, started by whatever runs them
+    def attach_running(self) -> None:
+        self.for_each_node('attach', lambda node: node.attach(), self._nodes)
+        attached = [node.base_url for node in self._nodes if node.is_attached]
+        print(f'{len(attached)} of {len(self._nodes)} node(s) already serving: {", ".join(attached) or "none"}')
+
+    def stage(self, index: TarIndex) -> None:
+        self.for_each_node('stage', lambda node: stage_plugin(node, index), self._nodes)
+
+    # Splits the nodes that need a restart into waves, keeping at least one
+    # node out of each wave serving (unless the cluster is a single node)
+    def plan_waves(self) -> List[List[KeycloakHandle]]:
+        serving = [node for node in self._nodes if node.is_running()]
+        pending = [node for node in serving if node.pending_restarts]
+        wave_size = self._max_unavailable
+        if len(serving) > 1 and wave_size >= len(serving):
+            wave_size = len(serving) - 1
+            print(f'Restarting at most {wave_size} node(s) at a time, so the cluster keeps serving')
+        return [pending[i:i + wave_size] for i in range(0, len(pending), wave_size)]
+
+    def _ensure_others_ready(self, wave: List[KeycloakHandle]) -> None:
+        others = [node for node in self._nodes if node.is_running() and node not in wave]
+        not_ready = [node.base_url for node in others if not node.check_ready()]
+        if others and len(not_ready) == len(others):
+            raise ClusterUnavailableError('no other node is ready to serve', not_ready)
+        if not_ready:
+            print(f'Warning: nodes not ready while restarting the next wave: {", ".join(not_ready)}')
+
+    # Restarts the nodes with pending restarts, wave by wave. restart() waits
+    # for each node to be ready again, which is what lets the next wave start.
+    def rolling_restart(self) -> int:
+        waves = self.plan_waves()
+        for number, wave in enumerate(waves, start=1):
+            print(f'Rolling restart: wave {number}/{len(waves)}: {", ".join(node.base_url for node in wave)}')
+            self._ensure_others_ready(wave)
+            self.for_each_node('restart', lambda node: node.flush_restarts(), wave)
+        return len(waves)
+
+    # Nodes that aren't running yet don't serve anything, so they're all
+    # started together, with the plugin already in place
+    def start_stopped(self) -> None:
+        self.for_each_node('start', lambda node: node.start(), [n for n in self._nodes if not n.is_running()])
+
+    def rollout(self, index: TarIndex) -> None:
+        self.attach_running()
+        self.stage(index)
+        self.rolling_restart()
+        self.start_stopped()
+
+
+# Main()
+# Usage: cluster.py nodes.json (or set HS_CLUSTER_NODES)
+# Nodes started here are supervised afterwards; nodes that were already
+# serving are left to whatever started them
+if __name__ == '__main__':
+    cluster = KeycloakCluster(load_cluster_nodes(Path(sys.argv[1] if len(sys.argv) > 1 else HS_CLUSTER_NODES)))
+    cluster.rollout(extract_files(download_plugin()))
+    started = [node for node in cluster.nodes if node.pid is not None]
+    if started:
+        sys.exit(supervise(started))
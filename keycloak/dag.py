@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+# Local Imports
+from tracing import span
+
+# Constants
+DAG_MAX_WORKERS = 4  # steps that may run at the same time
+
+
+class DagError(Exception):
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+
+    def __str__(self) -> str:
+        return f'Invalid step graph: {self.message}'
+
+
+class DagFailedError(Exception):
+
+    def __init__(self, failed: List['StepResult'], skipped: List[str]) -> None:
+        self.failed = failed
+        self.skipped = skipped
+
+    def __str__(self) -> str:
+        failures = ''.join(f'{r.name}: {r.error!r}\n' for r in self.failed)
+        return (
+            'One or more steps failed.\n'
+            f'Failed Steps:\n{failures}'
+            f'Skipped Steps: {", ".join(self.skipped) or "none"}\n'
+        )
+
+
+# A step is a named function that runs once all of its dependencies have
+# succeeded. It is handed the return values of every step finished so far,
+# keyed by step name, and may return a value for the steps that depend on it.
+class Step(NamedTuple):
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: List[str] = []
+
+
+class StepResult(NamedTuple):
+    name: str
+    status: str  # ok, failed or skipped
+    started: float  # seconds since the graph started running
+    duration: float
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+def _validate(steps: List[Step]) -> None:
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise DagError('step names must be unique')
+    for step in steps:
+        unknown = [dep for dep in step.deps if dep not in names]
+        if unknown:
+            raise DagError(f'{step.name} depends on unknown step(s) {", ".join(unknown)}')
+    # Kahn's algorithm: every step must eventually have all its deps satisfied
+    done: Set[str] = set()
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if all(dep in done for dep in step.deps)]
+        if not ready:
+            raise DagError(f'cycle between {", ".join(step.name for step in pending)}')
+        done.update(step.name for step in ready)
+        pending = [step for step in pending if step.name not in done]
+
+
+# run_dag runs the steps on a thread pool, starting each as soon as all of its
+# dependencies have succeeded, so independent steps overlap and the total time
+# is that of the critical path. When a step fails, everything depending on it
+# (directly or not) is skipped while unrelated steps carry on. Prints a timing
+# summary and raises DagFailedError at the end if anything failed.
+def run_dag(steps: List[Step], max_workers: int = DAG_MAX_WORKERS) -> Dict[str, StepResult]:
+    _validate(steps)
+    graph_start = time.monotonic()
+    results: Dict[str, StepResult] = {}
+    values: Dict[str, Any] = {}
+    pending = {step.name: step for step in steps}
+    running: Dict['Future[Any]', str] = {}
+    started: Dict[str, float] = {}
+
+    def run_step(step: Step) -> Any:
+        started[step.name] = time.monotonic()
+        with span(f'step {step.name}', 'step'):
+            return step.fn(dict(values))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, step in list(pending.items()):
+                dep_status = [results[dep].status if dep in results else None for dep in step.deps]
+                if any(status in ('failed', 'skipped') for status in dep_status):
+                    del pending[name]
+                    results[name] = StepResult(name, 'skipped', time.monotonic() - graph_start, 0.0)
+                    print(f'Step {name}: skipped, since a dependency did not succeed')
+                elif all(status == 'ok' for status in dep_status):
+                    del pending[name]
+                    print(f'Step {name}: starting')
+                    running[executor.submit(run_step, step)] = name
+            if not running:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                step_start = started.get(name, time.monotonic())
+                duration = time.monotonic() - step_start
+                offset = step_start - graph_start
+                error = future.exception()
+                if error is None:
+                    values[name] = future.result()
+                    results[name] = StepResult(name, 'ok', offset, duration, values[name])
+                    print(f'Step {name}: done in {duration:.3f} seconds')
+                else:
+                    results[name] = StepResult(name, 'failed', offset, duration, error=error)
+                    print(f'Step {name}: failed after {duration:.3f} seconds')
+                    traceback.print_exception(type(error), error, error.__traceback__)
+
+    total = time.monotonic() - graph_start
+    print(f'Ran {len(steps)} steps in {total:.3f} seconds:')
+    for result in sorted(results.values(), key=lambda r: r.started):
+        print(f'  {result.name:<24} {result.status:<8} +{result.started:8.3f}s {result.duration:8.3f}s')
+    failed = [r for r in results.values() if r.status == 'failed']
+    if failed:
+        raise DagFailedError(failed, [r.name for r in results.values() if r.status == 'skipped'])
+    return results
@@ -1,11 +1,43 @@
+import fcntl
 import hashlib
-from typing import Any, Tuple
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.client import HTTPException
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 from pathlib import Path
 from urllib import request
+from urllib.error import HTTPError
 from urllib.parse import urlparse
 from os.path import basename
 from os import getcwd
 
+# Local Imports
+from tracing import annotate, traced
+
+# Environment Variables
+HS_STRICT_VERIFY = os.getenv('HS_STRICT_VERIFY', '') == 'true'  # always re-hash, ignoring the cache
+HS_ARTIFACT_CACHE = os.getenv('HS_ARTIFACT_CACHE', '')  # directory of verified downloads, shareable between containers
+HS_DOWNLOAD_SEGMENT_SIZE = int(os.getenv('HS_DOWNLOAD_SEGMENT_SIZE', str(4 * 1024 * 1024)))  # bytes per range request
+HS_DOWNLOAD_SEGMENTS = int(os.getenv('HS_DOWNLOAD_SEGMENTS', '4'))  # range requests in flight; 1 disables segments
+
+# Constants
+DOWNLOAD_CHUNK_SIZE = 128 * 1024
+PARTIAL_SUFFIX = '.part'  # downloads land here until their checksum is verified
+VERIFY_CACHE_SUFFIX = '.sha512cache'  # sidecar file remembering a file's last computed checksum
+VERIFY_CACHE_XATTR = 'user.hskc.sha512'  # same, as an extended attribute where supported
+SEGMENTS_SUFFIX = '.segments'  # progress of a segmented download, next to its part file
+DOWNLOAD_TIMEOUT = 30  # seconds without a byte before a request is given up
+MIRROR_LATENCY_WEIGHT = 0.3  # weight of the latest sample in a mirror's moving average latency
+SEGMENTS_AHEAD = 2  # per worker, segments fetched past the ones hashed so far
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
 
 class ChecksumMismatchError(Exception):
 
@@ -24,26 +56,458 @@ class ChecksumMismatchError(Exception):
         )
 
 
+class MirrorsExhaustedError(Exception):
+
+    def __init__(self, urls: List[str], what: str, last_error: Optional[BaseException]) -> None:
+        self.urls = urls
+        self.what = what
+        self.last_error = last_error
+
+    def __str__(self) -> str:
+        mirrors = ''.join(f'{url}\n' for url in self.urls)
+        return (
+            f'Every mirror failed to serve {self.what}.\n'
+            f'Mirrors:\n{mirrors}'
+            f'Last Error: {self.last_error}\n'
+        )
+
+
 def sha512sum(filepath: Path) -> str:
+    return sha512_of(filepath).hexdigest()
+
+
+# sha512_of returns the (still updatable) hash object of a file's contents
+@traced('download.sha512')
+def sha512_of(filepath: Path) -> Any:
     hash_val = hashlib.sha512()
-    b = bytearray(128 * 1024)
+    b = bytearray(DOWNLOAD_CHUNK_SIZE)
     mv = memoryview(b)
     with open(filepath, 'rb', buffering=0) as f:
         for n in iter(lambda: f.readinto(mv), 0):
             hash_val.update(mv[:n])
-    return hash_val.hexdigest()
+    return hash_val
+
+
+# The identity of a file's contents, short of hashing them. Any write to the
+# file changes its size or mtime; replacing it changes its inode.
+def _file_identity(filepath: Path) -> Dict[str, int]:
+    st = os.stat(filepath)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'ino': st.st_ino, 'dev': st.st_dev}
+
+
+def _verify_cache_path(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + VERIFY_CACHE_SUFFIX)
+
+
+# record_checksum remembers a file's checksum along with its identity, in an
+# extended attribute (when the filesystem supports it) and a sidecar file
+def record_checksum(filepath: Path, checksum: str) -> None:
+    entry = dict(_file_identity(filepath), sha512=checksum)
+    text = json.dumps(entry)
+    try:
+        os.setxattr(filepath, VERIFY_CACHE_XATTR, text.encode('utf-8'))
+    except (AttributeError, OSError):
+        pass  # no xattr support here; the sidecar file will do
+    cache_path = _verify_cache_path(filepath)
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(tmp_path, 'w') as fp:
+        fp.write(text)
+    os.replace(tmp_path, cache_path)
+
+
+# cached_checksum returns the recorded checksum of a file, as long as the file
+# hasn't changed since it was recorded
+def cached_checksum(filepath: Path) -> Optional[str]:
+    identity = _file_identity(filepath)
+    candidates = []
+    try:
+        candidates.append(os.getxattr(filepath, VERIFY_CACHE_XATTR).decode('utf-8'))
+    except (AttributeError, OSError):
+        pass
+    cache_path = _verify_cache_path(filepath)
+    if cache_path.exists():
+        with open(cache_path, 'r') as fp:
+            candidates.append(fp.read())
+    for text in candidates:
+        try:
+            entry = json.loads(text)
+        except ValueError:
+            continue
+        checksum = entry.pop('sha512', None)
+        if checksum and entry == identity:
+            return checksum
+    return None
 
 
 # is_sha512_valid returns true or false depending on whether a file's expected_checksum
-# matched the value provided to it
-def is_sha512_valid(filepath: Path, expected_hash: str) -> Tuple[bool, Any]:
-    actual_hash = sha512sum(filepath)
+# matched the value provided to it. Unless strict, a checksum recorded for the
+# unchanged file is trusted instead of hashing it all over again.
+def is_sha512_valid(filepath: Path, expected_hash: str, strict: bool = HS_STRICT_VERIFY) -> Tuple[bool, Any]:
+    actual_hash = None if strict else cached_checksum(filepath)
+    if actual_hash is None:
+        actual_hash = sha512sum(filepath)
+        record_checksum(filepath, actual_hash)
     if actual_hash != expected_hash:
         return False, actual_hash
     return True, actual_hash
 
 
+# stream_download fetches a URL into part_path and returns its SHA-512. Each
+# chunk is hashed as it is written, so the file never has to be read back. If
+# part_path holds an earlier, interrupted attempt, only the rest is requested
+# with a Range header; servers that ignore the range get a fresh download, and
+# so do those answering with a range other than the one asked for.
+@traced('download.stream')
+def stream_download(url: str, part_path: Path) -> str:
+    hash_val = hashlib.sha512()
+    offset = 0
+    if part_path.exists():
+        hash_val = sha512_of(part_path)
+        offset = part_path.stat().st_size
+    req = request.Request(url)
+    if offset:
+        req.add_header('Range', f'bytes={offset}-')
+    try:
+        resp = request.urlopen(req, timeout=DOWNLOAD_TIMEOUT)
+    except HTTPError as err:
+        if err.code == 416:  # the part already holds the whole file
+            return hash_val.hexdigest()
+        raise
+    with resp:
+        if offset and resp.status == 206:
+            match = CONTENT_RANGE.match(resp.headers.get('Content-Range', ''))
+            if match is None or int(match.group(1)) != offset:
+                print(f"'{url}' sent {resp.headers.get('Content-Range')} instead of bytes {offset}-; starting over")
+                part_path.unlink()
+                return stream_download(url, part_path)
+            print(f"Resuming download of '{url}' from byte {offset}")
+            mode = 'ab'
+        else:
+            hash_val = hashlib.sha512()
+            mode = 'wb'
+        received = 0
+        with open(part_path, mode) as fp:
+            for chunk in iter(lambda: resp.read(DOWNLOAD_CHUNK_SIZE), b''):
+                hash_val.update(chunk)
+                fp.write(chunk)
+                received += len(chunk)
+        annotate('bytes', received)
+        annotate('resumed_at', offset if mode == 'ab' else 0)
+    return hash_val.hexdigest()
+
+
+# MirrorSet is an ordered list of URLs serving the same file, along with how
+# each of them has been doing: a moving average of the time to the first byte
+# of its responses, and its failures. It is shared by download threads.
+class MirrorSet:
+
+    def __init__(self, urls: List[str]) -> None:
+        self.urls = list(dict.fromkeys(url for url in urls if url))  # in order, without repeats
+        self._lock = threading.Lock()
+        self._latency: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {url: 0 for url in self.urls}
+
+    def record(self, url: str, seconds: float) -> None:
+        with self._lock:
+            average = self._latency.get(url)
+            self._latency[url] = seconds if average is None else average + MIRROR_LATENCY_WEIGHT * (seconds - average)
+
+    def fail(self, url: str) -> None:
+        with self._lock:
+            self._failures[url] += 1
+
+    # Mirrors from the most to the least promising: the fewest failures first,
+    # then the lowest latency. Mirrors not measured yet come before measured
+    # ones, in their configured order, so that each gets a chance.
+    def ranked(self) -> List[str]:
+        with self._lock:
+            order = {url: i for i, url in enumerate(self.urls)}
+            return sorted(self.urls, key=lambda u: (self._failures[u], self._latency.get(u, 0.0), order[u]))
+
+    def healthy(self) -> List[str]:
+        return [url for url in self.ranked() if not self._failures[url]]
+
+    def describe(self) -> str:
+        with self._lock:
+            return ', '.join(
+                f'{url} ({self._latency.get(url, 0) * 1000:.0f}ms, {self._failures[url]} failures)'
+                for url in self.urls)
+
+
+# Sends a GET (for a byte range, if given) and records how long the mirror
+# took to answer
+def _open(mirrors: MirrorSet, url: str, byte_range: Optional[Tuple[int, int]] = None) -> Any:
+    req = request.Request(url)
+    if byte_range is not None:
+        req.add_header('Range', f'bytes={byte_range[0]}-{byte_range[1]}')
+    start = time.monotonic()
+    resp = request.urlopen(req, timeout=DOWNLOAD_TIMEOUT)
+    mirrors.record(url, time.monotonic() - start)
+    return resp
+
+
+# probe_ranges asks the mirrors for the first byte of the file, to learn its
+# size and whether byte ranges are served. Returns the size (None if unknown)
+# and whether some mirror serves ranges.
+def probe_ranges(mirrors: MirrorSet) -> Tuple[Optional[int], bool]:
+    size: Optional[int] = None
+    for url in mirrors.ranked():
+        try:
+            with _open(mirrors, url, (0, 0)) as resp:
+                match = CONTENT_RANGE.match(resp.headers.get('Content-Range', ''))
+                if resp.status == 206 and match:
+                    return int(match.group(3)), True
+                length = resp.headers.get('Content-Length')
+                size = int(length) if length else size
+        except (OSError, HTTPException) as e:
+            print(f"Mirror '{url}' is unavailable: {e}")
+            mirrors.fail(url)
+    return size, False
+
+
+# Fetches one segment of the file into fp, from the first mirror that serves
+# it, and returns its bytes. Workers start at different mirrors, so segments
+# are spread over all the healthy ones, and a faster mirror ends up serving
+# more of them.
+def _fetch_segment(mirrors: MirrorSet, worker_no: int, segment: Tuple[int, int], fp: Any) -> bytes:
+    start, end = segment
+    healthy = mirrors.healthy()
+    first = healthy[worker_no % len(healthy):] + healthy[:worker_no % len(healthy)] if healthy else []
+    candidates = first + [url for url in mirrors.ranked() if url not in first]
+    last_error: Optional[BaseException] = None
+    for url in candidates:
+        try:
+            with _open(mirrors, url, segment) as resp:
+                match = CONTENT_RANGE.match(resp.headers.get('Content-Range', ''))
+                if resp.status != 206 or not match or int(match.group(1)) != start or int(match.group(2)) != end:
+                    raise HTTPException(f'asked for bytes {start}-{end}, got {resp.headers.get("Content-Range")}')
+                fp.seek(start)
+                chunks: List[bytes] = []
+                remaining = end - start + 1
+                while remaining:
+                    chunk = resp.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise HTTPException(f'bytes {start}-{end} ended {remaining} bytes short')
+                    fp.write(chunk)
+                    chunks.append(chunk)
+                    remaining -= len(chunk)
+                return b''.join(chunks)
+        except (OSError, HTTPException) as e:
+            print(f"Mirror '{url}' failed to serve bytes {start}-{end}: {e}")
+            mirrors.fail(url)
+            last_error = e
+    raise MirrorsExhaustedError(mirrors.urls, f'bytes {start}-{end}', last_error)
+
+
+def _load_segments_done(progress_path: Path, size: int, segment_size: int) -> Set[int]:
+    if not progress_path.exists():
+        return set()
+    with open(progress_path, 'r') as fp:
+        progress = json.load(fp)
+    if progress.get('size') != size or progress.get('segment_size') != segment_size:
+        return set()
+    return set(progress.get('done', []))
+
+
+def _save_segments_done(progress_path: Path, size: int, segment_size: int, done: Set[int]) -> None:
+    tmp_path = progress_path.with_name(progress_path.name + '.tmp')
+    with open(tmp_path, 'w') as fp:
+        json.dump({'size': size, 'segment_size': segment_size, 'done': sorted(done)}, fp)
+    os.replace(tmp_path, progress_path)
+
+
+# segmented_download fetches a file of a known size into part_path as byte
+# ranges of segment_size, `workers` at a time, spread over the mirrors, and
+# returns its SHA-512. The segments done are recorded next to part_path, so an
+# interrupted download only fetches the missing ones the next time.
+# Segments are hashed in file order as they come in, so the file never has to
+# be read back (except for segments of an interrupted attempt). One that comes
+# in ahead of its turn is kept in memory until then, and workers don't fetch
+# further than SEGMENTS_AHEAD segments per worker past the hashed ones.
+@traced('download.segmented')
+def segmented_download(
+        mirrors: MirrorSet,
+        part_path: Path,
+        size: int,
+        segment_size: int = HS_DOWNLOAD_SEGMENT_SIZE,
+        workers: int = HS_DOWNLOAD_SEGMENTS,
+) -> str:
+    progress_path = part_path.with_name(part_path.name + SEGMENTS_SUFFIX)
+    done = _load_segments_done(progress_path, size, segment_size) if part_path.exists() else set()
+    if not done:
+        with open(part_path, 'wb') as fp:
+            fp.truncate(size)
+    pending: Any = queue.Queue()
+    for start in range(0, size, segment_size):
+        if start not in done:
+            pending.put((start, min(start + segment_size, size) - 1))
+    if done:
+        print(f"Resuming download of '{part_path.name}': {len(done)} segment(s) already there")
+    cond = threading.Condition()
+    hash_val = hashlib.sha512()
+    fetched: Dict[int, bytes] = {}  # segments fetched ahead of the hashed ones, by offset
+    ahead = max(1, workers) * SEGMENTS_AHEAD * segment_size
+    hashed = 0  # bytes hashed so far, from the start of the file
+    failed = False
+
+    # Hashes the segments that are next in line. Called with cond held.
+    def advance(fp: Any) -> None:
+        nonlocal hashed
+        while hashed < size:
+            if hashed in fetched:
+                hash_val.update(fetched.pop(hashed))
+            elif hashed in done:  # fetched by an interrupted attempt
+                fp.seek(hashed)
+                hash_val.update(fp.read(min(segment_size, size - hashed)))
+            else:
+                break
+            hashed = min(hashed + segment_size, size)
+        cond.notify_all()
+
+    def worker(worker_no: int) -> None:
+        nonlocal failed
+        with open(part_path, 'r+b') as fp:
+            try:
+                while True:
+                    try:
+                        segment = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    with cond:
+                        cond.wait_for(lambda: failed or segment[0] < hashed + ahead)
+                        if failed:
+                            return
+                    data = _fetch_segment(mirrors, worker_no, segment, fp)
+                    fp.flush()
+                    with cond:
+                        fetched[segment[0]] = data
+                        done.add(segment[0])
+                        _save_segments_done(progress_path, size, segment_size, done)
+                        advance(fp)
+            except BaseException:
+                with cond:
+                    failed = True
+                    cond.notify_all()
+                raise
+
+    segments = pending.qsize()
+    with open(part_path, 'rb') as head_fp, cond:
+        advance(head_fp)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(worker, n) for n in range(max(1, min(workers, segments)))]
+        for future in futures:
+            future.result()
+    progress_path.unlink()
+    annotate('segments', segments)
+    annotate('bytes', size)
+    return hash_val.hexdigest()
+
+
+# fetch_from_mirrors downloads the file the mirrors serve into part_path and
+# returns its SHA-512. A file that is at least two segments long, from mirrors
+# that serve byte ranges, is fetched in segments, in parallel. Otherwise it is
+# streamed from the most promising mirror, falling back to the next ones.
+@traced('download.mirrors')
+def fetch_from_mirrors(mirrors: MirrorSet, part_path: Path) -> str:
+    size, ranges = probe_ranges(mirrors) if HS_DOWNLOAD_SEGMENTS > 1 else (None, False)
+    progress_path = part_path.with_name(part_path.name + SEGMENTS_SUFFIX)
+    if ranges and size is not None and size >= 2 * HS_DOWNLOAD_SEGMENT_SIZE:
+        checksum = segmented_download(mirrors, part_path, size)
+        print(f'Mirrors: {mirrors.describe()}')
+        return checksum
+    if progress_path.exists():  # the part holds scattered segments, which can't be resumed as a stream
+        progress_path.unlink()
+        if part_path.exists():
+            part_path.unlink()
+    last_error: Optional[BaseException] = None
+    for url in mirrors.ranked():
+        try:
+            checksum = stream_download(url, part_path)
+            annotate('mirror', url)
+            return checksum
+        except (OSError, HTTPException) as e:
+            print(f"Mirror '{url}' failed: {e}")
+            mirrors.fail(url)
+            last_error = e
+    raise MirrorsExhaustedError(mirrors.urls, part_path.name, last_error)
+
+
+# Makes dst a hard link to src, or else a copy, replacing dst in one step
+def link_or_copy(src: Path, dst: Path) -> None:
+    tmp_path = dst.with_name(f'.{dst.name}.{os.getpid()}.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+    try:
+        os.link(str(src), str(tmp_path))
+    except OSError:
+        shutil.copyfile(str(src), str(tmp_path))
+    os.replace(str(tmp_path), str(dst))
+
+
+# ArtifactCache is a directory of verified downloads, addressed by their
+# SHA-512, meant to be a volume shared by the containers of a host. A
+# download goes to a part file in the cache (so another container can resume
+# it) under a lock, so that containers starting together fetch the file once.
+#
+# Layout:
+#   sha512/ab/ab12...   verified artifacts
+#   tmp/ab12....part    downloads in progress
+#   locks/ab12....lock
+class ArtifactCache:
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def path_for(self, checksum: str) -> Path:
+        return self.root.joinpath('sha512').joinpath(checksum[:2]).joinpath(checksum)
+
+    def part_path(self, checksum: str) -> Path:
+        tmp_dir = self.root.joinpath('tmp')
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        return tmp_dir.joinpath(checksum + PARTIAL_SUFFIX)
+
+    # Holds the artifact's lock, waiting for other processes that hold it
+    @contextmanager
+    def locked(self, checksum: str) -> Iterator[None]:
+        lock_dir = self.root.joinpath('locks')
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        with open(lock_dir.joinpath(checksum[:32] + '.lock'), 'w') as fp:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                print(f'Waiting for another download of {checksum[:12]} into {self.root}...')
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    # The cached artifact, if it is there and intact
+    def lookup(self, checksum: str) -> Optional[Path]:
+        path = self.path_for(checksum)
+        if not path.exists():
+            return None
+        if not is_sha512_valid(path, checksum)[0]:
+            print(f"Removing corrupt artifact '{path}' from the cache")
+            path.unlink()
+            return None
+        return path
+
+    # Moves a verified download into the cache
+    def store(self, part_path: Path, checksum: str) -> Path:
+        path = self.path_for(checksum)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(str(part_path), str(path))
+        record_checksum(path, checksum)
+        return path
+
+
 # dld_with_checks downloads a file and verifies its expected_checksum.
+# The download goes to filepath.part (resumed if it's there) and is renamed to
+# filepath only once its checksum matches.
+# mirrors are other URLs serving the same file; see fetch_from_mirrors. With an
+# artifact cache, the file is looked up there (by its expected checksum) and
+# downloaded into it if missing, then linked to filepath.
 # Algorithm:
 # * File Already Present: Calculate expected_checksum
 #   * Checksum matches: Continue successfully
@@ -51,7 +515,14 @@ def is_sha512_valid(filepath: Path, expected_hash: str) -> Tuple[bool, Any]:
 #  * File not yet Present: download & calculate expected_checksum
 #    * Checksum matches: Continue successfully
 #    * Checksum mismatch: Error out. Need to delete file manually now
-def dld_with_checks(url: str, filepath: Path, expected_checksum: str) -> None:
+@traced('download.dld_with_checks')
+def dld_with_checks(
+        url: str,
+        filepath: Path,
+        expected_checksum: str,
+        mirrors: List[str] = [],
+        cache_dir: str = HS_ARTIFACT_CACHE,
+) -> None:
     if filepath.exists():
         checksum_verified, actual_checksum = is_sha512_valid(filepath, expected_checksum)
 
@@ -63,10 +534,36 @@ def dld_with_checks(url: str, filepath: Path, expected_checksum: str) -> None:
             print(f"Download '{filepath}' from '{url}' has expected_checksum '{actual_checksum}' but expected expected_checksum '{expected_checksum}'.")
             print(f"Either update the expected_checksum in this script or delete '{filepath}' and try again!")
 
+    elif cache_dir:
+        cache = ArtifactCache(Path(cache_dir))
+        with cache.locked(expected_checksum):
+            cached = cache.lookup(expected_checksum)
+            if cached is not None:
+                print(f"Found '{filepath.name}' in the artifact cache at '{cached}'")
+                actual_checksum = expected_checksum
+            else:
+                print(f"Downloading '{url}' into the artifact cache at '{cache_dir}'...")
+                part_path = cache.part_path(expected_checksum)
+                actual_checksum = fetch_from_mirrors(MirrorSet([url] + mirrors), part_path)
+                if actual_checksum == expected_checksum:
+                    cached = cache.store(part_path, expected_checksum)
+                else:
+                    part_path.unlink()  # so that the next attempt starts afresh
+        checksum_verified = cached is not None
+        if cached is not None:
+            link_or_copy(cached, filepath)
+            record_checksum(filepath, expected_checksum)
+
     else:
         print(f"Downloading '{url}' to '{filepath}'...")
-        request.urlretrieve(url, filepath)
-        checksum_verified, actual_checksum = is_sha512_valid(filepath, expected_checksum)
+        part_path = filepath.with_name(filepath.name + PARTIAL_SUFFIX)
+        actual_checksum = fetch_from_mirrors(MirrorSet([url] + mirrors), part_path)
+        checksum_verified = actual_checksum == expected_checksum
+        if checksum_verified:
+            os.replace(part_path, filepath)
+            record_checksum(filepath, actual_checksum)
+        else:
+            part_path.unlink()  # so that the next attempt starts afresh
 
     if not checksum_verified:
         raise ChecksumMismatchError(filepath, expected_checksum, actual_checksum)
@@ -85,10 +582,10 @@ def derive_file_name(url: str) -> str:  # eg: https://example.com/path/to/filena
 # dld_with_checks_infer_name downloads the file pointed to by a URL into
 # the current directory. It infers the name of the file from the URL
 # It returns the path to the downloaded file.
-def dld_with_checks_get_path(url: str, expected_checksum: str) -> Path:
+def dld_with_checks_get_path(url: str, expected_checksum: str, mirrors: List[str] = []) -> Path:
     file_name = derive_file_name(url)
     cwd = Path(getcwd())
     dld_file_path = cwd.joinpath(file_name)
-    dld_with_checks(url, dld_file_path, expected_checksum)
+    dld_with_checks(url, dld_file_path, expected_checksum, mirrors)
     return dld_file_path
     pass
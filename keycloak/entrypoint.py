@@ -6,16 +6,35 @@
 ################################################################################
 
 # Stdlib Imports
-import subprocess
+import sys
+from typing import List
 
 # Local Imports
 import env
+from dag import Step, run_dag
+from keycloak import KeycloakHandle, singleton
+from prebake import is_prebaked
 from step_create_execution import step_create_execution
-from step_download_install import step_download_extract_install
+from step_download_install import (
+    AUTHENTICATOR_CHECKSUM,
+    HS_AUTH_SERVER_ENDPOINT,
+    MODULE_NAME,
+    deploy_config,
+    deploy_module_offline,
+    download_plugin,
+    extract_files,
+    install_theme,
+    is_module_current,
+)
 from step_ensure_flow import step_ensure_hs_flow
+from step_reconcile import step_reconcile
+from step_snapshot import HS_REALM_SNAPSHOT, step_apply_snapshot
+from step_tuning import HS_TUNING_PROFILE, step_tune
+from supervisor import supervise
+from tracing import profiling, tracer
 
-# Look for environment variables that are mandatory
-env.check_env([
+# Environment variables that need to be set for the entrypoint to run
+MANDATORY_ENV = [
     'DB_VENDOR',
     'DB_ADDR',
     'DB_DATABASE',
@@ -34,10 +53,71 @@ env.check_env([
     'HS_AUTH_SERVER_ENDPOINT',
     'KC_EXECUTION_STRATEGY',
     'KC_BASEURL',
-])
+]
+
+
+# The steps form a dependency graph and run as soon as their dependencies are
+# done. Keycloak boots as soon as the module is in place, while the theme and
+# configuration are installed alongside. If the module from this very tarball
+# is already deployed (say, on a container restart), Keycloak boots right away,
+# in parallel with the download.
+# An image pre-baked for the same plugin (see prebake.py) skips the download
+# and install altogether: only the configuration, which holds the deployment
+# specific hs-auth-server endpoint, is written before Keycloak boots.
+# With a realm snapshot (HS_REALM_SNAPSHOT), the flow and execution are part
+# of it, so applying the snapshot replaces those two steps.
+# With a tuning preset (HS_TUNING_PROFILE), the container's limits are applied
+# right before the boot. Like the module, its settings are written offline to
+# the configuration file, so the two take turns.
+def provisioning_steps(kc: KeycloakHandle) -> List[Step]:
+    steps = [Step('config', lambda r: deploy_config(kc, HS_AUTH_SERVER_ENDPOINT))]
+    tuning = ['tuning'] if HS_TUNING_PROFILE else []
+    if is_prebaked(kc):
+        print(f'KeyCloak is pre-baked with module {MODULE_NAME}; skipping the plugin install')
+        steps.append(Step('start', lambda r: kc.start(), ['config'] + tuning))
+        offline = []
+        installed = ['start', 'config']
+    else:
+        module_current = is_module_current(kc, MODULE_NAME, AUTHENTICATOR_CHECKSUM)
+        offline = [] if module_current else ['module']
+        steps += [
+            Step('download', lambda r: download_plugin()),
+            Step('extract', lambda r: extract_files(r['download']), ['download']),
+            Step('theme', lambda r: install_theme(kc, r['extract']), ['extract']),
+            Step('start', lambda r: kc.start(), tuning or offline),
+        ]
+        if not module_current:
+            steps.append(
+                Step('module', lambda r: deploy_module_offline(kc, MODULE_NAME, r['extract'].jar_path), ['extract']))
+        installed = ['start', 'theme', 'config']
+    if tuning:
+        steps.append(Step('tuning', lambda r: step_tune(kc), offline))
+    if HS_REALM_SNAPSHOT:
+        steps += [
+            Step('snapshot', lambda r: step_apply_snapshot(kc), installed),
+            Step('reconcile', lambda r: step_reconcile(kc), ['snapshot']),
+        ]
+    else:
+        steps += [
+            Step('flow', lambda r: step_ensure_hs_flow(kc), ['start']),
+            Step('execution', lambda r: step_create_execution(kc), ['flow'] + installed[1:]),
+            Step('reconcile', lambda r: step_reconcile(kc), ['execution']),
+        ]
+    return steps
+
+
+# All jboss_cli calls made by the steps share one long-lived jboss_cli process
+# The trace and metrics (HS_TRACE_FILE, HS_PROM_FILE) are written once
+# provisioning is done, since the entrypoint then supervises Keycloak for good
+def provision(kc: KeycloakHandle) -> None:
+    with profiling(), kc.cli_session():
+        run_dag(provisioning_steps(kc))
+        kc.flush_restarts()
+    tracer.export()
+
 
 # Begin Execution
-step_download_extract_install()
-step_ensure_hs_flow()
-step_create_execution()
-subprocess.run(['sleep', 'infinity'])
+if __name__ == '__main__':
+    env.check_env(MANDATORY_ENV)
+    provision(singleton)
+    sys.exit(supervise([singleton]))
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import json
+import queue
+import re
+import threading
+from subprocess import Popen, PIPE, STDOUT
+from typing import List, Optional, Tuple
+
+# Constants
+SESSION_COMMAND_TIMEOUT = 300  # seconds a single request may take before the session is torn down
+SESSION_MARKER = '__HSKC_END__'
+PROMPT_PATTERN = re.compile(r'^\[(standalone|domain|disconnected)[^\]]*\]\s*')
+ERROR_LINE_PATTERN = re.compile(r'^(Failed|Error|Unexpected|Unrecognized|Cannot|Could not|The batch failed|WFLY[A-Z]*\d+)')
+DISCONNECTED_PATTERNS = [
+    'Failed to connect to the controller',
+    'The controller is not available',
+    'You are disconnected at the moment',
+    'WFLYPRT0053',  # Could not connect to remote
+    'Connection closed',
+]
+
+
+class JBossCLISessionError(Exception):
+
+    def __init__(self, reason: str, output: str) -> None:
+        self.reason = reason
+        self.output = output
+
+    def __str__(self) -> str:
+        return (
+            'jboss_cli session failed.\n'
+            f'Reason: {self.reason}\n'
+            f'Output:\n{self.output}\n'
+        )
+
+
+# Guesses if a request failed by looking at its output, since an interactive
+# jboss_cli doesn't exit with an error code. In --output-json mode, failed
+# operations print a JSON document with a non-success outcome, and CLI level
+# errors print plain text.
+def output_failed(output: str) -> bool:
+    decoder = json.JSONDecoder()
+    idx = output.find('{')
+    while idx != -1:
+        try:
+            doc, end = decoder.raw_decode(output, idx)
+        except ValueError:
+            idx = output.find('{', idx + 1)
+            continue
+        if isinstance(doc, dict) and doc.get('outcome') not in (None, 'success'):
+            return True
+        idx = output.find('{', end)
+    return any(ERROR_LINE_PATTERN.match(line) for line in output.splitlines())
+
+
+# JBossCLISession keeps a single interactive jboss_cli process around and feeds
+# it commands over stdin, so that many management calls share one JVM and one
+# connection. Each request is followed by an echo of a unique marker, which
+# frames its output on stdout. If the server has restarted in between, the
+# session notices the dropped connection, reconnects and retries once.
+class JBossCLISession:
+
+    def __init__(self, jboss_cli: str, extra_args: List[str] = [], timeout: float = SESSION_COMMAND_TIMEOUT) -> None:
+        self._jboss_cli = jboss_cli
+        self._extra_args = list(extra_args)
+        self._timeout = timeout
+        self._proc: Optional[Popen] = None
+        self._lines: 'queue.Queue[Optional[str]]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._connected = False
+        self._requests = 0
+        self.spawns = 0
+
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _reader(self, proc: Popen) -> None:
+        for line in proc.stdout:  # type: ignore
+            self._lines.put(line.rstrip('\n'))
+        self._lines.put(None)  # EOF
+
+    def _spawn(self) -> None:
+        self.spawns += 1
+        self._lines = queue.Queue()
+        self._proc = Popen(
+            [self._jboss_cli] + self._extra_args + ['--output-json'],
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=STDOUT,
+            universal_newlines=True,
+            bufsize=1,
+        )
+        self._connected = False
+        threading.Thread(target=self._reader, args=(self._proc,), daemon=True).start()
+
+    # Sends the lines and collects everything printed until the marker shows
+    # up. Returns whether the process is still alive, along with the output.
+    def _send(self, lines: List[str]) -> Tuple[bool, str]:
+        if not self.is_alive():
+            self._spawn()
+        self._requests += 1
+        marker = f'{SESSION_MARKER}{self._requests}'
+        proc = self._proc
+        assert proc is not None and proc.stdin is not None
+        try:
+            proc.stdin.write('\n'.join(lines + [f'echo {marker}']) + '\n')
+            proc.stdin.flush()
+        except OSError:
+            return False, ''
+        output: List[str] = []
+        while True:
+            try:
+                line = self._lines.get(timeout=self._timeout)
+            except queue.Empty:
+                self.close()
+                raise JBossCLISessionError(f'No response within {self._timeout} seconds', '\n'.join(output))
+            if line is None:
+                return False, '\n'.join(output)
+            line = PROMPT_PATTERN.sub('', line)
+            if line == marker:
+                return True, '\n'.join(output)
+            output.append(line)
+
+    # Tracks whether we're connected, dropping connect commands that would
+    # only reconnect an already connected session
+    def _prepare(self, commands: str) -> List[str]:
+        lines: List[str] = []
+        for line in commands.splitlines():
+            stripped = line.strip()
+            if stripped == 'connect':
+                if self._connected:
+                    continue
+                self._connected = True
+            elif stripped.startswith('embed-server'):
+                if self._connected:
+                    lines.append('disconnect')
+                self._connected = False
+            elif stripped.split(' ')[0] in ('shutdown', 'disconnect', 'stop-embedded-server'):
+                self._connected = False
+            lines.append(line)
+        return lines
+
+    # Runs the commands (same format as a jboss_cli --file) in this session and
+    # returns an exit code and the output, like a one-off jboss_cli would
+    def execute(self, commands: str) -> Tuple[int, str]:
+        with self._lock:
+            for attempt in range(2):
+                alive, output = self._send(self._prepare(commands))
+                dropped = not alive or any(p in output for p in DISCONNECTED_PATTERNS)
+                if dropped:
+                    self._connected = False
+                if dropped and attempt == 0 and 'connect' in commands.splitlines():
+                    continue
+                break
+            if not alive:
+                exitcode = self._proc.returncode if self._proc is not None else 1
+                return exitcode or 1, output
+            return (1 if output_failed(output) else 0), output
+
+    def close(self) -> None:
+        proc = self._proc
+        self._proc = None
+        self._connected = False
+        if proc is None:
+            return
+        try:
+            if proc.poll() is None and proc.stdin is not None:
+                proc.stdin.write('quit\n')
+                proc.stdin.flush()
+                proc.stdin.close()
+            proc.wait(timeout=10)
+        except Exception:
+            proc.kill()
+            proc.wait()
@@ -3,12 +3,24 @@
 # Stdlib Imports
 import os
 import shutil
+import sys
 import time
 import json
-import xml.etree.ElementTree as ET
-from subprocess import Popen, getstatusoutput, run as sub_run
+import shlex
+import tempfile
+from contextlib import contextmanager
+from subprocess import PIPE, STDOUT, Popen, TimeoutExpired, getstatusoutput
 from pathlib import Path
-from typing import List, Tuple, Any, Type, Union
+from typing import List, Tuple, Any, Union, Optional, NamedTuple, Dict, Iterator
+
+# Local Imports
+from admin_client import KeycloakAdminClient
+from jboss_session import JBossCLISession
+from readiness import ReadinessProbe, parse_backoff
+from server_config import ServerConfig, ServerConfigCache
+from server_log import BootTimings, ServerLog, describe_timings
+from theme_deployer import ThemeChanges, deploy_theme
+from tracing import annotate, span, traced
 
 
 # Environment Variable Arguments
@@ -18,10 +30,19 @@ KCBASE = os.getenv('KCBASE', '')
 KEYCLOAK_MODE = os.getenv('KEYCLOAK_MODE', 'standalone') # standalone is a sane default!
 KC_EXECUTION_STRATEGY = os.getenv('KC_EXECUTION_STRATEGY', '')
 KC_BASEURL = os.getenv('KC_BASEURL', '')
+KC_ADMIN_BACKEND = os.getenv('KC_ADMIN_BACKEND', 'kcadm')  # kcadm or rest
+KC_READY_URL = os.getenv('KC_READY_URL', '')  # defaults to the master realm under KC_BASEURL
+KC_MGMT_READY_URL = os.getenv('KC_MGMT_READY_URL', '')  # optional, like http://localhost:9990/health
+KC_READY_BACKOFF = os.getenv('KC_READY_BACKOFF', '')  # comma separated seconds between readiness probes
+KC_READY_DEADLINE = float(os.getenv('KC_READY_DEADLINE', '100'))  # give up on startup after these many seconds
+KC_RUN_AS_UID = int(os.getenv('KC_RUN_AS_UID', '1000'))  # user keycloak runs as when started by root; 0 keeps root
+KC_STOP_TIMEOUT = float(os.getenv('KC_STOP_TIMEOUT', '30'))  # seconds for a graceful shutdown, before a kill
 
 # Constants
-STARTUP_WAIT_SLEEP_TIME = 5  # each time wait 5 seconds
-STARTUP_WAIT_MAX_RETRIES = 20  # don't retry more than these many times
+DEFAULT_BASEURL = 'http://localhost:8080'
+BOOT_FAILURE_TAIL_LINES = 20  # server output lines shown when a boot fails
+DEFAULT_THEME_NAME = 'hypersign'  # theme the plugin's theme files are published as
+ATTACHED_RESTART_POLL = 0.1  # seconds between checks that an attached server went down for a restart
 
 
 # Writes some text to a file
@@ -40,15 +61,138 @@ def read_from_file(filepath: Union[str, Path]) -> str:
 # Checks if this text is JSON and then returns the json-encoded text
 def to_json_if_json(txt: str) -> Tuple[bool, Any]:
     try:
-        json_obj = json.loads(txt, encoding='utf-8')
+        json_obj = json.loads(txt)
     except ValueError:
         return False, None
     return True, json_obj
 
 
-# Used to run keycloak as non-root user
+# jboss_cli --output-json prints one JSON document per command, back to back.
+# This returns all of them, skipping any non-JSON noise in between.
+def split_json_documents(txt: str) -> List[Any]:
+    decoder = json.JSONDecoder()
+    docs: List[Any] = []
+    idx = txt.find('{')
+    while idx != -1:
+        try:
+            doc, end = decoder.raw_decode(txt, idx)
+        except ValueError:
+            idx = txt.find('{', idx + 1)
+            continue
+        docs.append(doc)
+        idx = txt.find('{', end)
+    return docs
+
+
+# kcadm_args_* build the kcadm_cli arguments of the realm administration calls
+# supported by both KeycloakHandle and AsyncKeycloakHandle
+def kcadm_args_login(base_url: str, user: str, password: str) -> str:
+    return f'config credentials --server {base_url}/auth --realm master --user {user} --password {password}'
+
+
+def kcadm_args_list_authentication_flows(realm: str) -> str:
+    return f'get authentication/flows --format json --noquotes -r {realm}'
+
+
+def kcadm_args_create_authentication_flow(
+        realm: str,
+        alias: str,
+        provider_id: str,
+        description: str,
+        top_level: bool,
+        built_in: bool,
+) -> str:
+    return (
+        'create authentication/flows'
+        f' -s alias="{alias}"'
+        f' -s providerId="{provider_id}"'
+        f' -s description="{description}"'
+        f' -s topLevel={str(top_level).lower()}'
+        f' -s builtIn={str(built_in).lower()}'
+        f' -r {realm}'
+    )
+
+
+def kcadm_args_list_executions(realm: str, auth_flow_name: str) -> str:
+    return f'get authentication/flows/{auth_flow_name}/executions --format json -r {realm}'
+
+
+def kcadm_args_create_execution(realm: str, auth_flow_name: str, provider_id: str, requirement: str) -> str:
+    return (
+        f'create authentication/flows/{auth_flow_name}/executions/execution'
+        f' -r {realm}'
+        f' -s provider="{provider_id}"'
+        f' -s requirement={requirement}'
+    )
+
+
+def kcadm_args_update_execution(realm: str, auth_flow_name: str, payload: Dict[str, Any]) -> str:
+    return (
+        f'update authentication/flows/{auth_flow_name}/executions'
+        f' -r {realm}'
+        f' -b {shlex.quote(json.dumps(payload))}'
+    )
+
+
+def kcadm_args_get_authentication_config(realm: str, config_id: str) -> str:
+    return f'get authentication/config/{config_id} --format json -r {realm}'
+
+
+def kcadm_args_create_execution_config(realm: str, execution_id: str, payload: Dict[str, Any]) -> str:
+    return (
+        f'create authentication/executions/{execution_id}/config'
+        f' -r {realm}'
+        f' -b {shlex.quote(json.dumps(payload))}'
+    )
+
+
+def kcadm_args_update_authentication_config(realm: str, config_id: str, payload: Dict[str, Any]) -> str:
+    return (
+        f'update authentication/config/{config_id}'
+        f' -r {realm}'
+        f' -b {shlex.quote(json.dumps(payload))}'
+    )
+
+
+def kcadm_args_get_realm(realm: str) -> str:
+    return f'get realms/{realm} --format json'
+
+
+def kcadm_args_update_realm(realm: str, payload: Dict[str, Any]) -> str:
+    return f'update realms/{realm} -b {shlex.quote(json.dumps(payload))}'
+
+
+def kcadm_args_partial_export(realm: str, export_clients: bool, export_groups_and_roles: bool) -> str:
+    return (
+        f'create realms/{realm}/partial-export'
+        f' -q exportClients={str(export_clients).lower()}'
+        f' -q exportGroupsAndRoles={str(export_groups_and_roles).lower()}'
+        " -b '{}' -o"
+    )
+
+
+# -o prints the reply, which lists what happened to each imported resource
+def kcadm_args_partial_import(realm: str, payload_file: Path) -> str:
+    return f'create partialImport -r {realm} -f {shlex.quote(str(payload_file))} -o'
+
+
+def kcadm_args_update_client(realm: str, client_id: str, payload_file: Path) -> str:
+    return f'update clients/{client_id} -r {realm} -f {shlex.quote(str(payload_file))}'
+
+
+# Writes a request body too large for the command line (like a partial import)
+# to a file of its own under directory, for kcadm_cli's -f. The caller removes it.
+def write_payload_file(directory: Path, name: str, payload: Any) -> Path:
+    fd, path = tempfile.mkstemp(prefix=f'{name}.', suffix='.hskc.json', dir=str(directory))
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(payload, fp)
+    return Path(path)
+
+
+# Used to run keycloak as non-root user, when started as root
 def pre_exec_fn() -> None:
-    os.setuid(1000)
+    if os.getuid() == 0 and KC_RUN_AS_UID != 0:
+        os.setuid(KC_RUN_AS_UID)
 
 
 class KeycloakError(Exception):
@@ -73,6 +217,29 @@ class JBossCLIError(KeycloakError):
         )
 
 
+class JBossCLIBatchError(JBossCLIError):
+
+    def __init__(
+            self,
+            exitcode: int,
+            output: str,
+            cmd_name: str,
+            commands: str,
+            results: List['BatchStepResult'],
+    ) -> None:
+        super().__init__(exitcode, output, cmd_name, commands)
+        self.results = results
+
+    def __str__(self) -> str:
+        failed = [r for r in self.results if r.outcome != 'success']
+        failures = ''.join(f'{r.operation}\n    => {r.failure}\n' for r in failed)
+        return (
+            'Batch was rolled back.\n'
+            f'Failed Operations:\n{failures}\n'
+            f'{super().__str__()}'
+        )
+
+
 class KeycloakAdminCLIError(KeycloakError):
 
     def __init__(self, exit_code: int, output: str, cli_args: str) -> None:
@@ -100,12 +267,40 @@ class UnknownKeycloakStartupCommandError(KeycloakError):
 
 class KeycloakWaitTimeExceededError(KeycloakError):
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, max_wait_time: float) -> None:
+        self.max_wait_time = max_wait_time
 
     def __str__(self) -> str:
-        max_wait_time = STARTUP_WAIT_MAX_RETRIES * STARTUP_WAIT_SLEEP_TIME
-        return f'Startup exceeds max wait time of {max_wait_time} seconds'
+        return f'Startup exceeds max wait time of {self.max_wait_time} seconds'
+
+
+class KeycloakStillServingError(KeycloakError):
+
+    def __init__(self, base_url: str, waited: float) -> None:
+        self.base_url = base_url
+        self.waited = waited
+
+    def __str__(self) -> str:
+        return (
+            'Keycloak was asked to restart but kept serving.\n'
+            f'Base URL: {self.base_url}\n'
+            f'Waited: {self.waited} seconds\n'
+        )
+
+
+class KeycloakBootFailedError(KeycloakError):
+
+    def __init__(self, reason: str, tail: List[str]) -> None:
+        self.reason = reason
+        self.tail = tail
+
+    def __str__(self) -> str:
+        output = ''.join(f'{line}\n' for line in self.tail)
+        return (
+            'Keycloak failed to boot.\n'
+            f'Reason: {self.reason}\n'
+            f'Last Output Lines:\n{output}'
+        )
 
 
 class InvalidKeycloakModeError(KeycloakError):
@@ -116,6 +311,125 @@ class InvalidKeycloakModeError(KeycloakError):
     def __str__(self) -> str:
         return 'Keycloak Mode be one of standalone, standalone-ha or domain'
 
+
+class InvalidAdminBackendError(KeycloakError):
+
+    def __init__(self) -> None:
+        pass
+
+    def __str__(self) -> str:
+        return 'Admin backend must be one of kcadm or rest'
+
+
+# Outcome of a single operation within a jboss_cli batch
+class BatchStepResult(NamedTuple):
+    operation: str
+    outcome: str
+    result: Any
+    failure: Any
+
+
+# JBossCLIBatch collects management operations and flushes them to a single
+# jboss_cli invocation, wrapped in batch/run-batch so that they are applied
+# atomically: either every operation succeeds or all of them are rolled back.
+# Local commands like `module add` are not management operations and cannot be
+# part of a batch; they run in the same jboss_cli process right before it.
+#
+# An offline batch doesn't connect to a running server. Instead it boots an
+# embedded, admin-only server on the configuration file and writes the changes
+# straight into it, so Keycloak can be configured before its very first boot.
+#
+# Usage:
+#   batch = kc.batch('install-hs')
+#   batch.add_module(name, jar_path, dependencies)
+#   batch.register_module(name)
+#   results = batch.run()
+class JBossCLIBatch:
+
+    def __init__(self, kc: 'KeycloakHandle', name: str, offline: bool = False) -> None:
+        self._kc = kc
+        self._name = name
+        self._offline = offline
+        self._local_commands: List[str] = []
+        self._operations: List[str] = []
+        self._providers: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._local_commands) + len(self._operations)
+
+    def add_module(self, module_name: str, jar_path: Path, dependencies: List[str]) -> 'JBossCLIBatch':
+        self._local_commands.append(
+            f'module add --name={module_name} --resources={jar_path} --dependencies={",".join(dependencies)}'
+        )
+        return self
+
+    # Adds a raw management operation, like /subsystem=io/worker=default:read-resource
+    def operation(self, op: str) -> 'JBossCLIBatch':
+        self._operations.append(op)
+        return self
+
+    # value is serialized as JSON, which jboss_cli accepts for strings, numbers,
+    # booleans and lists
+    def write_attribute(self, address: str, name: str, value: Any) -> 'JBossCLIBatch':
+        return self.operation(f'{address}:write-attribute(name={name},value={json.dumps(value)})')
+
+    # Appends module:<module_name> to the keycloak-server providers, taking
+    # into account modules registered earlier in this same batch
+    def register_module(self, module_name: str) -> 'JBossCLIBatch':
+        if self._providers is None:
+            self._providers = self._kc.get_providers()
+        provider = f'module:{module_name}'
+        if provider in self._providers:
+            return self
+        self._providers.append(provider)
+        write_providers = '/subsystem=keycloak-server/:write-attribute(name=providers,'
+        self._operations = [op for op in self._operations if not op.startswith(write_providers)]
+        return self.write_attribute('/subsystem=keycloak-server/', 'providers', self._providers)
+
+    def commands(self) -> str:
+        lines = list(self._local_commands)
+        if self._operations and self._offline:
+            server_config = self._kc.get_cfg_path().name
+            lines += [f'embed-server --server-config={server_config} --std-out=discard', 'batch']
+            lines += self._operations + ['run-batch --verbose', 'stop-embedded-server']
+        elif self._operations:
+            lines += ['connect', 'batch'] + self._operations + ['run-batch --verbose']
+        return '\n'.join(lines)
+
+    # Pulls per-step results out of the composite response of run-batch.
+    # Steps are reported as step-1, step-2, ... in the order they were added.
+    def _parse_results(self, output: str) -> List[BatchStepResult]:
+        response: Dict[str, Any] = {}
+        for doc in split_json_documents(output):
+            if isinstance(doc, dict) and isinstance(doc.get('result'), dict) and 'step-1' in doc['result']:
+                response = doc
+        steps = response.get('result', {})
+        results: List[BatchStepResult] = []
+        for i, op in enumerate(self._operations):
+            step = steps.get(f'step-{i + 1}', {})
+            outcome = step.get('outcome', response.get('outcome', 'unknown'))
+            results.append(BatchStepResult(op, outcome, step.get('result'), step.get('failure-description')))
+        return results
+
+    # Runs every collected command in one jboss_cli process. Raises
+    # JBossCLIBatchError (after jboss_cli has rolled the batch back) if any
+    # operation fails.
+    def run(self) -> List[BatchStepResult]:
+        if not len(self):
+            return []
+        commands = self.commands()
+        exitcode, output = self._kc.jboss_cli(self._name, commands)
+        results = self._parse_results(output)
+        if exitcode != 0 or any(r.outcome != 'success' for r in results):
+            raise JBossCLIBatchError(exitcode, output, self._name, commands, results)
+        if self._operations:
+            self._kc.invalidate_server_config()
+        self._local_commands = []
+        self._operations = []
+        self._providers = None
+        return results
+
+
 # KeycloakHandle is a handle to the main keycloak instance, within docker
 class KeycloakHandle:
 
@@ -123,6 +437,12 @@ class KeycloakHandle:
     # execution strategy (docker for dockerized keycloak and kcdist if you
     # downloaded keycloak via the bundle on the official website) or a custom
     # start command (in a list form, like ['ls', '-l']).
+    # The admin backend decides how realm administration (flows, executions)
+    # is done: kcadm spawns kcadm.sh per call, rest uses an in-process,
+    # connection-pooled client for the Admin REST API.
+    # base_url (like http://10.0.0.5:8080) and controller (jboss_cli's
+    # --controller, like 10.0.0.5:9990) point the handle at a node other than
+    # the local one; both default to the local instance.
     def __init__(
             self,
             kcbase: str,
@@ -131,10 +451,15 @@ class KeycloakHandle:
             kc_pass: str,
             execution_strategy: str,
             custom_start_cmd: List[str] = [],
+            admin_backend: str = KC_ADMIN_BACKEND,
+            base_url: str = '',
+            controller: str = '',
     ) -> None:
 
-        self._handle = Type[Popen]
+        self._handle: Optional[Popen] = None
+        self._server_log: Optional[ServerLog] = None
         self._running = False
+        self._attached = False  # serving, but not started by this handle
         self._kc_user = kc_user
         self._kc_pass = kc_pass
 
@@ -159,10 +484,40 @@ class KeycloakHandle:
         else:
             raise UnknownKeycloakStartupCommandError()
 
+        self._base_url = (base_url or KC_BASEURL or DEFAULT_BASEURL).rstrip('/')
+        self._controller = controller
+
+        if admin_backend not in ['kcadm', 'rest']:
+            raise InvalidAdminBackendError
+        self._admin_client: Optional[KeycloakAdminClient] = None
+        if admin_backend == 'rest':
+            self._admin_client = KeycloakAdminClient(f'{self._base_url}/auth', kc_user, kc_pass)
+
+        # KC_READY_URL and KC_MGMT_READY_URL describe the local instance only
+        ready_urls = [f'{self._base_url}/auth/realms/master']
+        if not base_url:
+            ready_urls = [KC_READY_URL or ready_urls[0]]
+            if KC_MGMT_READY_URL:
+                ready_urls.append(KC_MGMT_READY_URL)
+        self._readiness = ReadinessProbe(ready_urls, parse_backoff(KC_READY_BACKOFF), KC_READY_DEADLINE)
+
+        self._cli_session: Optional[JBossCLISession] = None
+        self._pending_restarts: List[str] = []
+        self._server_config = ServerConfigCache()
+
     @property
     def kcbase(self) -> Path:
         return self._kcbase
 
+    @property
+    def base_url(self) -> str:
+        return self._base_url
+
+    # The in-process Admin REST client, when admin_backend is rest
+    @property
+    def admin_client(self) -> Optional[KeycloakAdminClient]:
+        return self._admin_client
+
     def get_module_basedir(self, module_name: str) -> Path:
         return self._kcbase.joinpath('modules').joinpath(module_name)
 
@@ -175,43 +530,36 @@ class KeycloakHandle:
 
     # https://www.keycloak.org/docs/latest/server_development/index.html#register-a-provider-using-modules
     def add_module(self, module_name: str, jar_path: Path, dependencies: List[str]) -> None:
-        cli_name = f'add_module_{module_name}'
-        cli_commands = f'module add --name={module_name} --resources={jar_path} --dependencies={",".join(dependencies)}'
-        self.jboss_cli_raise_error(cli_name, cli_commands)
+        self.batch(f'add_module_{module_name}').add_module(module_name, jar_path, dependencies).run()
 
     def get_cfg_path(self) -> Path:
         return self._kcbase.joinpath('standalone').joinpath('configuration').joinpath(f'{self._kc_mode}.xml')
 
+    # The script standalone.sh sources for JAVA_OPTS, whatever the configuration file
+    def get_standalone_conf_path(self) -> Path:
+        return self._kcbase.joinpath('bin').joinpath('standalone.conf')
+
+    # The keycloak-server subsystem of the configuration file, parsed once and
+    # then reused until the file changes on disk (or is written by a batch)
+    def server_config(self) -> ServerConfig:
+        return self._server_config.get(self.get_cfg_path())
+
+    def invalidate_server_config(self) -> None:
+        self._server_config.invalidate()
+
     def get_providers(self) -> List[str]:
-        cfg_path = self.get_cfg_path()
-        cfg = ET.parse(str(cfg_path))
-        xpath_str = './/{urn:jboss:domain:keycloak-server:1.1}subsystem/{urn:jboss:domain:keycloak-server:1.1}providers'
-        providers_node = cfg.find(xpath_str)
-        providers: List[str] = []
-        child: ET.Element
-        for child in providers_node:
-            provider_key = str(child.text).strip()
-            providers.append(provider_key)
-        return providers
+        return list(self.server_config().providers)
 
     def is_module_registered(self, module_name: str) -> bool:
-        return f'module:{module_name}' in self.get_providers()
+        return self.server_config().has_module(module_name)
 
     # https://www.keycloak.org/docs/latest/server_development/#register-a-provider-using-modules
     # We are automating the above step by using jboss_cli's write-attribute feature
-    # This needs the server to be running. It'll fail otherwise!
+    # When the server isn't running, this is written offline via embed-server.
     def register_module(self, module_name: str) -> None:
         if self.is_module_registered(module_name):
             return
-        providers = self.get_providers()
-        providers.append(f'module:{module_name}')
-        cli_name = f'add-module-{module_name}'
-        cli_cmd = (
-            'connect\n'
-            f'/subsystem=keycloak-server/:write-attribute(name=providers,value={json.dumps(providers)})'
-        )
-        self.jboss_cli(cli_name, cli_cmd)
-        pass
+        self.batch(f'add-module-{module_name}', offline=not self._running).register_module(module_name).run()
 
     # Example output:
     # [ {
@@ -276,8 +624,9 @@ class KeycloakHandle:
     # TODO create a class to serialize the authentication flows output into
     # so that auto-complete works properly
     def list_authentication_flows(self, realm: str) -> Any:
-        args = f'get authentication/flows --format json --noquotes -r {realm}'
-        flows = self.kcadm_cli_as_json_raise_error(args)
+        if self._admin_client is not None:
+            return self._admin_client.list_authentication_flows(realm)
+        flows = self.kcadm_cli_as_json_raise_error(kcadm_args_list_authentication_flows(realm))
         return flows
 
     def list_authentication_flow_names(self, realm: str) -> List[str]:
@@ -293,16 +642,12 @@ class KeycloakHandle:
             top_level: bool,
             built_in: bool,
     ) -> None:
-        args = (
-            'create authentication/flows'
-            f' -s alias="{alias}"'
-            f' -s providerId="{provider_id}"'
-            f' -s description="{description}"'
-            f' -s topLevel={str(top_level).lower()}'
-            f' -s builtIn={str(built_in).lower()}'
-            f' -r {realm}'
+        if self._admin_client is not None:
+            self._admin_client.create_authentication_flow(realm, alias, provider_id, description, top_level, built_in)
+            return
+        self.kcadm_cli_raise_error(
+            kcadm_args_create_authentication_flow(realm, alias, provider_id, description, top_level, built_in)
         )
-        self.kcadm_cli_raise_error(args)
 
     # Example output:
     #
@@ -318,51 +663,185 @@ class KeycloakHandle:
     # } ]
     #
     def list_executions(self, realm: str, auth_flow_name: str) -> Any:
-        args = f'get authentication/flows/{auth_flow_name}/executions --format json -r {realm}'
-        return self.kcadm_cli_as_json_raise_error(args)
+        if self._admin_client is not None:
+            return self._admin_client.list_executions(realm, auth_flow_name)
+        return self.kcadm_cli_as_json_raise_error(kcadm_args_list_executions(realm, auth_flow_name))
 
     def list_execution_names(self, realm: str, auth_flow_name: str) -> List[str]:
         executions = self.list_executions(realm, auth_flow_name)
         return list(map(lambda execution: str(execution.get('displayName')), executions))
 
     def create_execution(self, realm: str, auth_flow_name: str, provider_id: str, requirement: str) -> None:
-        args = (
-            f'create authentication/flows/{auth_flow_name}/executions/execution'
-            f' -r {realm}'
-            f' -s provider="{provider_id}"'
-            f' -s requirement={requirement}'
-        )
-        self.kcadm_cli_raise_error(args)
+        if self._admin_client is not None:
+            self._admin_client.create_execution(realm, auth_flow_name, provider_id, requirement)
+            return
+        self.kcadm_cli_raise_error(kcadm_args_create_execution(realm, auth_flow_name, provider_id, requirement))
 
     def create_required_execution(self, realm: str, auth_flow_name: str, provider: str) -> None:
         self.create_execution(realm, auth_flow_name, provider, 'REQUIRED')
 
+    def update_execution_requirement(self, realm: str, auth_flow_name: str, execution_id: str, requirement: str) -> None:
+        payload = {'id': execution_id, 'requirement': requirement}
+        if self._admin_client is not None:
+            self._admin_client.update_execution(realm, auth_flow_name, payload)
+            return
+        self.kcadm_cli_raise_error(kcadm_args_update_execution(realm, auth_flow_name, payload))
+
+    # Example output:
+    #
+    # {
+    #   "id" : "5e6e1b1c-6a3e-4b6e-9a9e-2f1c5f1f6c11",
+    #   "alias" : "hs-config",
+    #   "config" : {
+    #     "some-key" : "some-value"
+    #   }
+    # }
+    #
+    def get_authentication_config(self, realm: str, config_id: str) -> Any:
+        if self._admin_client is not None:
+            return self._admin_client.get_authentication_config(realm, config_id)
+        return self.kcadm_cli_as_json_raise_error(kcadm_args_get_authentication_config(realm, config_id))
+
+    def create_execution_config(self, realm: str, execution_id: str, alias: str, config: Dict[str, str]) -> None:
+        payload = {'alias': alias, 'config': config}
+        if self._admin_client is not None:
+            self._admin_client.create_execution_config(realm, execution_id, payload)
+            return
+        self.kcadm_cli_raise_error(kcadm_args_create_execution_config(realm, execution_id, payload))
+
+    def update_authentication_config(self, realm: str, config_id: str, alias: str, config: Dict[str, str]) -> None:
+        payload = {'id': config_id, 'alias': alias, 'config': config}
+        if self._admin_client is not None:
+            self._admin_client.update_authentication_config(realm, config_id, payload)
+            return
+        self.kcadm_cli_raise_error(kcadm_args_update_authentication_config(realm, config_id, payload))
+
+    def get_realm(self, realm: str) -> Any:
+        if self._admin_client is not None:
+            return self._admin_client.get_realm(realm)
+        return self.kcadm_cli_as_json_raise_error(kcadm_args_get_realm(realm))
+
+    # Changes the realm settings present in payload, leaving the rest alone.
+    # Attributes are added or replaced one by one, never removed.
+    def update_realm(self, realm: str, payload: Dict[str, Any]) -> None:
+        if self._admin_client is not None:
+            self._admin_client.update_realm(realm, payload)
+            return
+        self.kcadm_cli_raise_error(kcadm_args_update_realm(realm, payload))
+
+    # The realm representation, including its authenticationFlows and
+    # authenticatorConfig and (with export_clients) its clients. Secrets come
+    # back masked.
+    def partial_export(self, realm: str, export_clients: bool = True, export_groups_and_roles: bool = False) -> Any:
+        if self._admin_client is not None:
+            return self._admin_client.partial_export(realm, export_clients, export_groups_and_roles)
+        return self.kcadm_cli_as_json_raise_error(
+            kcadm_args_partial_export(realm, export_clients, export_groups_and_roles)
+        )
+
+    # Example output:
+    #
+    # {
+    #   "overwritten" : 0,
+    #   "added" : 1,
+    #   "skipped" : 1,
+    #   "results" : [ {
+    #     "action" : "ADDED",
+    #     "resourceType" : "CLIENT",
+    #     "resourceName" : "hs_playground",
+    #     "id" : "0b3a6d5e-5b1c-4bb1-9c6e-8f1f0e2f7c4a"
+    #   }, {
+    #     "action" : "SKIPPED",
+    #     "resourceType" : "CLIENT",
+    #     "resourceName" : "hs-api",
+    #     "id" : "7c1f4d0e-2a4b-4c9e-b1d8-3e6f5a9c2b17"
+    #   } ]
+    # }
+    #
+    def partial_import(self, realm: str, payload: Dict[str, Any]) -> Any:
+        if self._admin_client is not None:
+            return self._admin_client.partial_import(realm, payload)
+        payload_file = write_payload_file(self._kcbase, 'partial-import', payload)
+        try:
+            return self.kcadm_cli_as_json_raise_error(kcadm_args_partial_import(realm, payload_file))
+        finally:
+            payload_file.unlink()
+
+    # Updates the client with the (internal) id client_id in place. Fields
+    # missing from payload, like a secret, are left as they are.
+    def update_client(self, realm: str, client_id: str, payload: Dict[str, Any]) -> None:
+        if self._admin_client is not None:
+            self._admin_client.update_client(realm, client_id, payload)
+            return
+        payload_file = write_payload_file(self._kcbase, 'client', payload)
+        try:
+            self.kcadm_cli_raise_error(kcadm_args_update_client(realm, client_id, payload_file))
+        finally:
+            payload_file.unlink()
+
     # when provided a file name and text, it creates a config file with this and copies
     # it over to the appropriate location
     def add_config_file_content(self, file_name: str, file_text: str) -> None:
         file_path = self._kcbase.joinpath('standalone').joinpath('configuration').joinpath(file_name)
         write_to_file(file_path, file_text)
 
-    def add_login_theme_files(self, files: List[Path]) -> None:
-        install_dir = self._kcbase.joinpath('themes').joinpath('base').joinpath('login')
-        for theme_file in files:
-            shutil.copy2(theme_file, install_dir)
-        pass
+    # Publishes theme files as the theme_type (like login) of a dedicated
+    # theme, linked into the same type of the base theme so that every theme
+    # finds them. Only what differs from the deployed files is written, and
+    # Keycloak switches to the new files at once (see theme_deployer).
+    def deploy_theme(self, theme_name: str, theme_type: str, contents: Dict[str, bytes]) -> ThemeChanges:
+        themes_dir = self._kcbase.joinpath('themes')
+        base_dir = themes_dir.joinpath('base').joinpath(theme_type)
+        return deploy_theme(themes_dir, theme_name, theme_type, contents, [base_dir])
+
+    def add_login_theme_files(self, files: List[Path], theme_name: str = DEFAULT_THEME_NAME) -> ThemeChanges:
+        return self.add_login_theme_contents({Path(f).name: Path(f).read_bytes() for f in files}, theme_name)
+
+    # Same as add_login_theme_files, but for file contents held in memory,
+    # keyed by file name
+    def add_login_theme_contents(
+            self,
+            contents: Dict[str, bytes],
+            theme_name: str = DEFAULT_THEME_NAME,
+    ) -> ThemeChanges:
+        return self.deploy_theme(theme_name, 'login', contents)
 
+    @traced('kc.start')
     def start(self) -> None:
         if self._running:
             return
         print('Starting KeyCloak...')
-        self._handle = Popen(self._start_cmd, preexec_fn=pre_exec_fn)
-        # time.sleep(60)
-        self.wait_ready()
+        handle = Popen(self._start_cmd, stdout=PIPE, stderr=STDOUT, preexec_fn=pre_exec_fn)
+        self._handle = handle
+        self._server_log = ServerLog(handle.stdout) if handle.stdout is not None else None
+        try:
+            self.wait_ready()
+        except KeycloakError:
+            self._terminate(handle)
+            self._handle = None
+            raise
         self._running = True
-        print('...Started KeyCloak!')
+        timings = self.boot_timings
+        if timings is not None:
+            annotate('boot_reported_ms', timings.reported_ms)
+            print(f'...Started KeyCloak! Boot: {describe_timings(timings)}')
+        else:
+            print('...Started KeyCloak!')
 
     # kcadm_cli invokes the kcadm_cli with the provided cli_args
     # it returns the exit_code and the output of the command
+    # Only the action and the path of the args are traced, since some of them
+    # (like the login) carry credentials
     def kcadm_cli(self, cli_args: str) -> Tuple[int, str]:
-        return getstatusoutput(f'{self._kcadm_cli} {cli_args}')
+        with span('kc.kcadm_cli', call=' '.join(cli_args.split(' ')[:2])) as sp:
+            exitcode, output = getstatusoutput(f'{self._kcadm_cli} {cli_args}')
+            sp.subprocess_exited(exitcode)
+        return exitcode, output
+
+    # The same kcadm_cli invocation as an argument vector, for running it
+    # without a shell
+    def kcadm_cli_argv(self, cli_args: str) -> List[str]:
+        return [self._kcadm_cli] + shlex.split(cli_args)
 
     def kcadm_cli_raise_error(self, cli_args: str) -> str:
         exitcode, output = self.kcadm_cli(cli_args)
@@ -379,14 +858,59 @@ class KeycloakHandle:
     # then invoke it via jboss_cli.sh --output-json --file=cmd_name.hskc.jboss.cli
     # The contents of ${KCBASE}/hskc.cmd_name.jboss.cli are left intact, so you can
     # manually execute them later for debugging.
+    # Within a cli_session() the commands are instead sent to the long-lived
+    # jboss_cli process of that session.
     def jboss_cli(self, cmd_name: str, commands: str) -> Tuple[int, str]:
         cli_name = f'{cmd_name}.hskc.jboss.cli'
         cli_location = self._kcbase.joinpath(cli_name)
         write_to_file(cli_location, commands)
-        cmd = f'{self._jboss_cli} --output-json --file="{cli_location}"'
-        exitcode, output = getstatusoutput(cmd)
+        with span('kc.jboss_cli', cmd_name=cmd_name, session=self._cli_session is not None) as sp:
+            if self._cli_session is not None:
+                exitcode, output = self._cli_session.execute(commands)
+                sp.set('exitcode', exitcode)
+                return exitcode, output
+            cmd = f'{self._jboss_cli} {self._controller_arg()}--output-json --file="{cli_location}"'
+            exitcode, output = getstatusoutput(cmd)
+            sp.subprocess_exited(exitcode)
         return exitcode, output
 
+    # Writes the commands file like jboss_cli() does and returns the argument
+    # vector that runs it, for callers that spawn jboss_cli themselves
+    def jboss_cli_argv(self, cmd_name: str, commands: str) -> List[str]:
+        cli_location = self._kcbase.joinpath(f'{cmd_name}.hskc.jboss.cli')
+        write_to_file(cli_location, commands)
+        controller = [f'--controller={self._controller}'] if self._controller else []
+        return [self._jboss_cli] + controller + ['--output-json', f'--file={cli_location}']
+
+    def _controller_arg(self) -> str:
+        return f'--controller={shlex.quote(self._controller)} ' if self._controller else ''
+
+    # Within this context, every jboss_cli call (including is_ready, kill and
+    # batches) goes through a single interactive jboss_cli process, instead of
+    # spawning a JVM each. Nested uses share the outer session.
+    #
+    # Usage:
+    #   with kc.cli_session():
+    #       kc.register_module(name)
+    #       kc.is_ready()
+    @contextmanager
+    def cli_session(self) -> Iterator[JBossCLISession]:
+        if self._cli_session is not None:
+            yield self._cli_session
+            return
+        session = JBossCLISession(self._jboss_cli, [f'--controller={self._controller}'] if self._controller else [])
+        self._cli_session = session
+        try:
+            yield session
+        finally:
+            self._cli_session = None
+            session.close()
+
+    # Returns a new, empty batch of jboss_cli operations for this instance.
+    # Offline batches apply to the configuration file and need Keycloak stopped.
+    def batch(self, cmd_name: str, offline: bool = False) -> JBossCLIBatch:
+        return JBossCLIBatch(self, cmd_name, offline)
+
     def jboss_cli_raise_error(self, cmd_name: str, commands: str) -> str:
         exitcode, output = self.jboss_cli(cmd_name, commands)
         if exitcode != 0:
@@ -401,59 +925,182 @@ class KeycloakHandle:
             return False
         return True
 
+    # Raises KeycloakBootFailedError if the server this handle started has
+    # logged a fatal boot error, or exited (its output has ended)
+    def _check_boot(self) -> None:
+        server_log = self._server_log
+        if server_log is None:
+            return
+        if server_log.fatal:
+            raise KeycloakBootFailedError(server_log.fatal, server_log.tail(BOOT_FAILURE_TAIL_LINES))
+        if server_log.ended:
+            raise KeycloakBootFailedError('the server exited', server_log.tail(BOOT_FAILURE_TAIL_LINES))
+
+    # Waits for Keycloak to answer on its HTTP endpoint(s). Probing backs off
+    # from milliseconds upwards, so readiness is noticed almost as soon as it
+    # happens, without spawning jboss_cli for every check. Between probes, the
+    # server output is checked for fatal errors, so a failed boot gives up
+    # right away instead of at the deadline.
+    @traced('kc.wait_ready')
     def wait_ready(self) -> None:
-
         print('Waiting for keycloak to start....')
+        is_ready = self._readiness.wait(self._check_boot)
+        total_wait = self._readiness.last_wait_time
+        if not is_ready:
+            raise KeycloakWaitTimeExceededError(self._readiness.deadline)
+        print(f'Keycloak startup wait took {total_wait:.3f} seconds ({self._readiness.last_wait_probes} probes)!')
 
-        total_wait = 0
+    # A single readiness probe, without any waiting
+    def check_ready(self) -> bool:
+        return self._readiness.check()
 
-        is_ready = False
-        for i in range(STARTUP_WAIT_MAX_RETRIES):
-            print(f'Checking if keycloak has started. Iteration #{i}')
-            is_ready = self.is_ready()
-            if is_ready:
-                break
-            else:
-                print(f'Going to sleep now for {STARTUP_WAIT_SLEEP_TIME} seconds')
-                time.sleep(STARTUP_WAIT_SLEEP_TIME)
-                total_wait += STARTUP_WAIT_SLEEP_TIME
+    # Seconds the most recent wait_ready() call took
+    @property
+    def last_ready_wait(self) -> float:
+        return self._readiness.last_wait_time
 
-        if not is_ready:
-            raise KeycloakWaitTimeExceededError
-        else:
-            print(f'Keycloak startup wait took {total_wait} seconds!')
+    # What the output of the last server started by this handle tells about
+    # its boot, or None if it hasn't started one
+    @property
+    def boot_timings(self) -> Optional[BootTimings]:
+        return self._server_log.timings() if self._server_log is not None else None
+
+    # The last lines of output of the last server started by this handle
+    def server_log_tail(self, n: int = BOOT_FAILURE_TAIL_LINES) -> List[str]:
+        return self._server_log.tail(n) if self._server_log is not None else []
+
+    # The pid of the server process this handle started, while it is around
+    @property
+    def pid(self) -> Optional[int]:
+        return self._handle.pid if self._handle is not None else None
+
+    # Asks the server to shut down gracefully, and kills it if it takes longer
+    # than KC_STOP_TIMEOUT
+    def _terminate(self, handle: Popen) -> None:
+        handle.terminate()
+        try:
+            handle.wait(KC_STOP_TIMEOUT)
+        except TimeoutExpired:
+            print(f'KeyCloak did not stop within {KC_STOP_TIMEOUT} seconds; killing it')
+            handle.kill()
+            handle.wait()
+        if self._server_log is not None:
+            self._server_log.close()
 
     # Stops the keycloak instance pointed to by this KeycloakHandle
     # Returns False if the keycloak instance was already stopped
+    @traced('kc.stop')
     def stop(self) -> bool:
-        if not self._running:
+        if not self._running or self._handle is None:
             return False
         print('Stopping KeyCloak...')
-        self._handle.terminate()
-        self._handle.wait()
+        self._terminate(self._handle)
         print('...Stopped KeyCloak!')
+        self.forget_exited()
+        return True
+
+    # Tells the handle its server process is gone, like when whoever reaps
+    # child processes saw it exit on its own
+    def forget_exited(self) -> None:
+        if self._server_log is not None:
+            self._server_log.close(timeout=1)
+        self._handle = None
         self._running = False
+        self._attached = False
+        self._pending_restarts = []  # the next start picks up every change anyway
+
+    # Points the handle at a server that already serves but wasn't started by
+    # it (like a cluster node), found with a readiness probe. Changes are then
+    # made online, and restarts go through the management API. Returns whether
+    # the handle is attached.
+    def attach(self) -> bool:
+        if self._running:
+            return self._attached
+        if not self.check_ready():
+            return False
+        print(f'Attached to the KeyCloak serving at {self._base_url}')
+        self._running = True
+        self._attached = True
         return True
 
-    # Shortcut to manually calling stop() then start()
+    @property
+    def is_attached(self) -> bool:
+        return self._attached
+
+    # Shortcut to manually calling stop() then start(). A server the handle is
+    # attached to is restarted through the management API instead.
+    @traced('kc.restart')
     def restart(self) -> None:
         print('Restarting KeyCloak...')
-        self.stop()
-        self.start()
+        if self._attached:
+            self._restart_attached()
+        else:
+            self.stop()
+            self.start()
         print('...Restarted KeyCloak!')
 
+    # There is no process of ours to stop and start: the server exits with the
+    # restart code, which standalone.sh answers by launching it again. Once it
+    # stops answering, it is waited for like a fresh boot.
+    def _restart_attached(self) -> None:
+        self.jboss_cli_raise_error('restart', 'connect\nshutdown --restart=true')
+        start = time.monotonic()
+        while self.check_ready():
+            if time.monotonic() - start >= KC_STOP_TIMEOUT:
+                raise KeycloakStillServingError(self._base_url, KC_STOP_TIMEOUT)
+            time.sleep(ATTACHED_RESTART_POLL)
+        self.wait_ready()
+        self._pending_restarts = []
+
+    # Records that a change needs a restart to take effect, without restarting
+    # right away. Requests from several steps are merged into a single restart,
+    # done by restart_barrier() or flush_restarts(). If Keycloak isn't running,
+    # nothing is needed since the next start picks the change up.
+    def request_restart(self, reason: str) -> None:
+        if not self._running:
+            print(f'Not scheduling a restart for "{reason}" since Keycloak is not running')
+            return
+        print(f'Scheduling a restart for "{reason}"')
+        self._pending_restarts.append(reason)
+
+    # Performs the pending restart (if any), for a caller that needs the new
+    # configuration live. Returns True if Keycloak was restarted.
+    def restart_barrier(self, needed_by: str) -> bool:
+        reasons = self._pending_restarts
+        if not reasons:
+            return False
+        print(f'Restarting once for {len(reasons)} request(s), needed by "{needed_by}":')
+        for reason in reasons:
+            print(f'  - {reason}')
+        self.restart()
+        return True
+
+    # Performs the pending restart (if any) once all steps are done
+    def flush_restarts(self) -> bool:
+        return self.restart_barrier('end of provisioning')
+
+    @property
+    def pending_restarts(self) -> List[str]:
+        return list(self._pending_restarts)
+
     # Returns if this KeycloakHandle points to a currently running inmstance
     def is_running(self) -> bool:
         return self._running
 
+    def kcadm_login_args(self) -> str:
+        return kcadm_args_login(self._base_url, self._kc_user, self._kc_pass)
+
     # Attempts to login to currently running keycloak instance
     def login(self) -> None:
         print('Logging into KeyCloak...')
-        cli_args = f'config credentials --server http://localhost:8080/auth --realm master --user {self._kc_user} --password {self._kc_pass}'
-        self.kcadm_cli_raise_error(cli_args)
+        if self._admin_client is not None:
+            self._admin_client.login()
+            print('...Successfully logged into KeyCloak!')
+            return
+        self.kcadm_cli_raise_error(self.kcadm_login_args())
         print('...Successfully logged into KeyCloak!')
 
-    # Force kills a keycloak instance that's running anywhere on localhost
+    # Force kills the keycloak instance behind the controller (localhost by default)
     def kill(self) -> None:
         print('Attempting to kill Keycloak...')
         _, msg = self.jboss_cli('shutdown', 'connect\nshutdown')
@@ -461,7 +1108,7 @@ class KeycloakHandle:
         print('...Done attempting to kill Keycloak!')
 
     def __del__(self) -> None:
-        if self._running:
+        if self._running and not self._attached:
             print(f'Keycloak Destructor: Premature destruction of running keycloak handle! Calling stop.')
             self.stop()
             print(f'Keycloak Destructor: Keycloak has (hopefully) been shutdown gracefully. Bye now!')
@@ -474,4 +1121,5 @@ if __name__ == '__main__':
     singleton.kill()
     singleton.start()
     singleton.login()
-    sub_run(['sleep', 'infinity'])
+    from supervisor import supervise
+    sys.exit(supervise([singleton]))
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import hashlib
+import json
+import shutil
+import sys
+from typing import Any, Dict, Optional
+
+# Local Imports
+from downloader import VERIFY_CACHE_SUFFIX
+from keycloak import KeycloakHandle, KEYCLOAK_MODE, read_from_file, write_to_file
+from step_download_install import (
+    AUTHENTICATOR_CHECKSUM,
+    MODULE_DEPENDENCIES,
+    MODULE_NAME,
+    download_plugin,
+    extract_files,
+    is_module_current,
+    stage_plugin,
+)
+from tracing import traced
+
+# Constants
+PREBAKED_FILE = 'hskc.prebaked.json'  # under KCBASE; what the image was pre-baked with
+
+
+# The inputs that decide what a plugin install leaves in KCBASE. The
+# hs-auth-server endpoint isn't one of them: it differs per deployment, and
+# writing hypersign.properties at runtime costs nothing.
+def prebake_inputs() -> Dict[str, Any]:
+    return {
+        'plugin_checksum': AUTHENTICATOR_CHECKSUM,
+        'module': MODULE_NAME,
+        'module_dependencies': MODULE_DEPENDENCIES,
+        'keycloak_mode': KEYCLOAK_MODE,
+    }
+
+
+def prebake_fingerprint(inputs: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def read_prebaked(kc: KeycloakHandle) -> Optional[Dict[str, Any]]:
+    path = kc.kcbase.joinpath(PREBAKED_FILE)
+    if not path.exists():
+        return None
+    return json.loads(read_from_file(path))
+
+
+# is_prebaked tells if KCBASE already holds the plugin install these inputs
+# would produce, so the entrypoint only has to start Keycloak. Besides the
+# fingerprint, the module and theme files are checked to still be in place.
+def is_prebaked(kc: KeycloakHandle) -> bool:
+    record = read_prebaked(kc)
+    if record is None:
+        return False
+    if record.get('fingerprint') != prebake_fingerprint(prebake_inputs()):
+        inputs = record.get('inputs', {})
+        print(
+            'Not using the pre-baked install: it was made from plugin '
+            f'{str(inputs.get("plugin_checksum"))[:12]} for {inputs.get("keycloak_mode")}')
+        return False
+    login_theme_dir = kc.kcbase.joinpath('themes').joinpath('base').joinpath('login')
+    missing_theme_files = [f for f in record.get('theme_files', []) if not login_theme_dir.joinpath(f).exists()]
+    if missing_theme_files or not is_module_current(kc, MODULE_NAME, AUTHENTICATOR_CHECKSUM):
+        print('Not using the pre-baked install: its module or theme files are gone')
+        return False
+    return True
+
+
+# prebake does the whole plugin install into KCBASE without ever starting
+# Keycloak (the module is registered offline, via embed-server), then records
+# the fingerprint of its inputs. Meant for image builds: the download and the
+# extracted files are removed, leaving only what Keycloak needs.
+@traced('prebake', 'step')
+def prebake(kc: KeycloakHandle) -> str:
+    inputs = prebake_inputs()
+    fingerprint = prebake_fingerprint(inputs)
+    hs_tarball = download_plugin()
+    print('Extracting files...')
+    index = extract_files(hs_tarball)
+    stage_plugin(kc, index)
+    if index.extract_dir is not None:
+        shutil.rmtree(index.extract_dir)
+    for path in [hs_tarball, hs_tarball.with_name(hs_tarball.name + VERIFY_CACHE_SUFFIX)]:
+        if path.exists():
+            path.unlink()
+    record = {'fingerprint': fingerprint, 'inputs': inputs, 'theme_files': sorted(index.theme_files)}
+    write_to_file(kc.kcbase.joinpath(PREBAKED_FILE), json.dumps(record, indent=2) + '\n')
+    print(f'Pre-baked {MODULE_NAME} into {kc.kcbase} (fingerprint {fingerprint[:12]})')
+    return fingerprint
+
+
+# Main()
+# Usage: prebake.py [--check]
+# With --check, exits with 0 only if KCBASE is pre-baked for the current inputs
+if __name__ == '__main__':
+    from keycloak import singleton
+    if '--check' in sys.argv[1:]:
+        sys.exit(0 if is_prebaked(singleton) else 1)
+    prebake(singleton)
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import socket
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Constants
+READY_BACKOFF_SCHEDULE = [0.05, 0.1, 0.2, 0.25, 0.5]  # seconds between probes; the last one repeats
+READY_PROBE_TIMEOUT = 2  # seconds a single probe may take
+
+
+# parse_backoff turns a comma separated list of seconds, like '0.05,0.1,0.5'
+# into a backoff schedule. An empty string gives the default schedule.
+def parse_backoff(spec: str) -> List[float]:
+    values = [float(v) for v in spec.split(',') if v.strip()]
+    return values or list(READY_BACKOFF_SCHEDULE)
+
+
+def _host_port(url: str) -> Tuple[str, int]:
+    parsed = urlparse(url)
+    default_port = 443 if parsed.scheme == 'https' else 80
+    return str(parsed.hostname), parsed.port or default_port
+
+
+# Returns True if something is listening on the URL's host and port
+def probe_tcp(url: str, timeout: float = READY_PROBE_TIMEOUT) -> bool:
+    try:
+        with socket.create_connection(_host_port(url), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+# Returns True if a GET on the URL answers with 200 OK
+def probe_http(url: str, timeout: float = READY_PROBE_TIMEOUT) -> bool:
+    parsed = urlparse(url)
+    host, port = _host_port(url)
+    conn_class = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection
+    conn = conn_class(host, port, timeout=timeout)
+    try:
+        conn.request('GET', parsed.path or '/')
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status == 200
+    except (HTTPException, OSError):
+        return False
+    finally:
+        conn.close()
+
+
+# ReadinessProbe decides if Keycloak is ready by hitting its HTTP endpoints
+# directly. Each URL first gets a cheap TCP connect, and only once the port is
+# open a full HTTP request. Probes are spaced out as per the backoff schedule,
+# so a server that comes up quickly is noticed within milliseconds.
+class ReadinessProbe:
+
+    def __init__(self, urls: List[str], backoff: List[float], deadline: float) -> None:
+        self._urls = urls
+        self._backoff = backoff or list(READY_BACKOFF_SCHEDULE)
+        self._deadline = deadline
+        self.probes = 0  # in total, by every check and wait
+        self.last_wait_time = 0.0
+        self.last_wait_probes = 0
+
+    @property
+    def deadline(self) -> float:
+        return self._deadline
+
+    def check(self) -> bool:
+        self.probes += 1
+        return all(probe_tcp(url) and probe_http(url) for url in self._urls)
+
+    # Probes until every URL is ready or the deadline has passed. Returns
+    # whether the server became ready. The abort callback runs between probes
+    # and may raise to give up early (say, when the server process has died).
+    def wait(self, abort: Optional[Callable[[], None]] = None) -> bool:
+        start = time.monotonic()
+        attempt = 0
+        is_ready = False
+        while True:
+            if abort is not None:
+                abort()
+            is_ready = self.check()
+            elapsed = time.monotonic() - start
+            if is_ready or elapsed >= self._deadline:
+                break
+            sleep_time = self._backoff[min(attempt, len(self._backoff) - 1)]
+            time.sleep(min(sleep_time, self._deadline - elapsed))
+            attempt += 1
+        self.last_wait_time = time.monotonic() - start
+        self.last_wait_probes = attempt + 1
+        return is_ready
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import json
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+# Local Imports
+from dag import Step, run_dag
+from keycloak import KeycloakHandle
+
+
+class ReconcileError(Exception):
+
+    def __init__(self, realm: str, flow: str, provider: str, reason: str) -> None:
+        self.realm = realm
+        self.flow = flow
+        self.provider = provider
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return (
+            'Error reconciling an execution.\n'
+            f'Realm: {self.realm}\n'
+            f'Flow: {self.flow}\n'
+            f'Provider: {self.provider}\n'
+            f'Reason: {self.reason}\n'
+        )
+
+
+# A single change the reconciler wants to make. Execution level actions carry
+# the desired execution spec in detail and the existing execution in current.
+class PlanAction(NamedTuple):
+    realm: str
+    kind: str  # create-flow, create-execution, set-requirement, create-config or update-config
+    flow: str
+    detail: Dict[str, Any]
+    current: Any = None
+
+    def describe(self) -> str:
+        target = self.detail.get('provider', '')
+        if self.kind == 'set-requirement':
+            target = f'{target} -> {self.detail["requirement"]}'
+        elif self.kind in ('create-config', 'update-config'):
+            target = f'{target} config "{self.detail["config"]["alias"]}"'
+        return f'[{self.realm}] {self.kind} "{self.flow}" {target}'.rstrip()
+
+
+# Loads a desired-state document, like:
+# {
+#   "realms": [ {
+#     "realm": "master",
+#     "flows": [ {
+#       "alias": "hs-auth-flow",
+#       "description": "hs-auth-flow",
+#       "providerId": "basic-flow",
+#       "topLevel": true,
+#       "executions": [ {
+#         "provider": "hyerpsign-qrocde-authenticator",
+#         "requirement": "REQUIRED",
+#         "config": { "alias": "hs-config", "config": { "key": "value" } }
+#       } ]
+#     } ]
+#   } ]
+# }
+# Executions are matched against existing ones by their provider.
+def load_desired_state(path: Path) -> Dict[str, Any]:
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def _find_execution(executions: List[Any], provider: str) -> Optional[Any]:
+    for execution in executions:
+        if execution.get('providerId') == provider:
+            return execution
+    return None
+
+
+# Reconciler brings realms in line with a desired-state document. The current
+# state of a realm is fetched once (its flows, plus the executions of the flows
+# that are described), the difference is computed and only that is applied.
+# A realm that is already in the desired state costs just the fetch.
+class Reconciler:
+
+    def __init__(self, kc: KeycloakHandle, desired: Dict[str, Any]) -> None:
+        self._kc = kc
+        self._desired = desired
+
+    @property
+    def realm_specs(self) -> List[Dict[str, Any]]:
+        return list(self._desired.get('realms', []))
+
+    # Compares a desired execution against the existing one, returning the
+    # updates it needs
+    def _diff_execution(self, realm: str, flow: str, spec: Dict[str, Any], current: Any) -> List[PlanAction]:
+        actions: List[PlanAction] = []
+        requirement = spec.get('requirement')
+        if requirement and current.get('requirement') != requirement:
+            actions.append(PlanAction(realm, 'set-requirement', flow, spec, current))
+        config = spec.get('config')
+        if config:
+            config_id = current.get('authenticationConfig')
+            if not config_id:
+                actions.append(PlanAction(realm, 'create-config', flow, spec, current))
+            else:
+                existing = self._kc.get_authentication_config(realm, config_id)
+                if existing.get('alias') != config['alias'] or existing.get('config', {}) != config.get('config', {}):
+                    actions.append(PlanAction(realm, 'update-config', flow, spec, current))
+        return actions
+
+    def plan_realm(self, realm_spec: Dict[str, Any]) -> List[PlanAction]:
+        realm = realm_spec['realm']
+        flows = self._kc.list_authentication_flows(realm)
+        existing_flows = {str(flow.get('alias')) for flow in flows}
+        actions: List[PlanAction] = []
+        for flow_spec in realm_spec.get('flows', []):
+            alias = flow_spec['alias']
+            executions: List[Any] = []
+            if alias not in existing_flows:
+                actions.append(PlanAction(realm, 'create-flow', alias, flow_spec))
+            else:
+                executions = self._kc.list_executions(realm, alias)
+            for execution_spec in flow_spec.get('executions', []):
+                current = _find_execution(executions, execution_spec['provider'])
+                if current is None:
+                    actions.append(PlanAction(realm, 'create-execution', alias, execution_spec))
+                else:
+                    actions += self._diff_execution(realm, alias, execution_spec, current)
+        return actions
+
+    def plan(self) -> List[PlanAction]:
+        actions: List[PlanAction] = []
+        for realm_spec in self.realm_specs:
+            actions += self.plan_realm(realm_spec)
+        return actions
+
+    def _apply_execution_action(self, action: PlanAction) -> None:
+        spec = action.detail
+        current = action.current
+        if action.kind == 'set-requirement':
+            self._kc.update_execution_requirement(action.realm, action.flow, current['id'], spec['requirement'])
+        elif action.kind == 'create-config':
+            config = spec['config']
+            self._kc.create_execution_config(action.realm, current['id'], config['alias'], config.get('config', {}))
+        elif action.kind == 'update-config':
+            config = spec['config']
+            config_id = current['authenticationConfig']
+            self._kc.update_authentication_config(action.realm, config_id, config['alias'], config.get('config', {}))
+
+    # Applies the actions of a single realm. New executions are created first;
+    # since Keycloak creates them as DISABLED and without any config, their
+    # flows are then listed once more and the remaining differences applied.
+    def apply_realm(self, actions: List[PlanAction]) -> None:
+        created_in: Set[str] = set()
+        for action in actions:
+            print(f'Applying {action.describe()}')
+            if action.kind == 'create-flow':
+                spec = action.detail
+                self._kc.create_authentication_flow(
+                    realm=action.realm,
+                    alias=action.flow,
+                    provider_id=spec.get('providerId', 'basic-flow'),
+                    description=spec.get('description', action.flow),
+                    top_level=spec.get('topLevel', True),
+                    built_in=False)
+            elif action.kind == 'create-execution':
+                spec = action.detail
+                requirement = spec.get('requirement', 'DISABLED')
+                self._kc.create_execution(action.realm, action.flow, spec['provider'], requirement)
+                created_in.add(action.flow)
+            else:
+                self._apply_execution_action(action)
+        for flow in created_in:
+            realm = actions[0].realm
+            executions = self._kc.list_executions(realm, flow)
+            for action in actions:
+                if action.kind != 'create-execution' or action.flow != flow:
+                    continue
+                current = _find_execution(executions, action.detail['provider'])
+                if current is None:
+                    raise ReconcileError(realm, flow, action.detail['provider'],
+                                         'the execution was created but is not listed in its flow')
+                for follow_up in self._diff_execution(realm, flow, action.detail, current):
+                    print(f'Applying {follow_up.describe()}')
+                    self._apply_execution_action(follow_up)
+
+    def _reconcile_realm(self, realm_spec: Dict[str, Any], plan_only: bool) -> List[PlanAction]:
+        actions = self.plan_realm(realm_spec)
+        if not actions:
+            print(f'Realm {realm_spec["realm"]} is already in the desired state')
+        elif plan_only:
+            for action in actions:
+                print(f'Planned {action.describe()}')
+        else:
+            self.apply_realm(actions)
+        return actions
+
+    def _realm_step(self, realm_spec: Dict[str, Any], plan_only: bool) -> Callable[[Dict[str, Any]], Any]:
+        return lambda _: self._reconcile_realm(realm_spec, plan_only)
+
+    # Plans and (unless plan_only is set) applies, realm by realm. Realms are
+    # independent of each other, so with max_workers > 1 they are reconciled
+    # concurrently. Returns all the actions that were planned.
+    def reconcile(self, plan_only: bool = False, max_workers: int = 1) -> List[PlanAction]:
+        realm_specs = self.realm_specs
+        if max_workers <= 1 or len(realm_specs) <= 1:
+            planned: List[PlanAction] = []
+            for realm_spec in realm_specs:
+                planned += self._reconcile_realm(realm_spec, plan_only)
+            return planned
+        steps = [Step(f'realm {spec["realm"]}', self._realm_step(spec, plan_only)) for spec in realm_specs]
+        results = run_dag(steps, max_workers)
+        return [action for step in steps for action in results[step.name].value]
+
+
+# Main()
+# Usage: reconciler.py desired-state.json [--plan]
+if __name__ == '__main__':
+    from keycloak import singleton
+    singleton.start()
+    singleton.login()
+    reconciler = Reconciler(singleton, load_desired_state(Path(sys.argv[1])))
+    reconciler.reconcile(plan_only='--plan' in sys.argv[2:])
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import os
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Constants
+KEYCLOAK_SUBSYSTEM_NS_PREFIX = 'urn:jboss:domain:keycloak-server:'
+
+
+class KeycloakSubsystemNotFoundError(Exception):
+
+    def __init__(self, cfg_path: Path) -> None:
+        self.cfg_path = cfg_path
+
+    def __str__(self) -> str:
+        return f'No keycloak-server subsystem found in {self.cfg_path}'
+
+
+def _split_tag(tag: str) -> Tuple[str, str]:
+    if tag.startswith('{'):
+        ns, local = tag[1:].split('}', 1)
+        return ns, local
+    return '', tag
+
+
+# ServerConfig is an index over the keycloak-server subsystem of a
+# standalone*.xml file, like:
+# <subsystem xmlns="urn:jboss:domain:keycloak-server:1.1">
+#   <web-context>auth</web-context>
+#   <providers>
+#     <provider>classpath:${jboss.home.dir}/providers/*</provider>
+#     <provider>module:hs-plugin-keycloak-ejb</provider>
+#   </providers>
+#   <master-realm-name>master</master-realm-name>
+#   <theme><staticMaxAge>2592000</staticMaxAge>...</theme>
+#   <spi name="userCache"><provider name="default" enabled="true"/></spi>
+# </subsystem>
+# Simple settings (web-context, master-realm-name, ...) are found in
+# attributes, nested ones like theme in sections and SPI providers in spis.
+class ServerConfig:
+
+    def __init__(self, cfg_path: Path, namespace: str, subsystem: ET.Element) -> None:
+        self.cfg_path = cfg_path
+        self.namespace = namespace
+        self.providers: List[str] = []
+        self.attributes: Dict[str, str] = {}
+        self.sections: Dict[str, Dict[str, str]] = {}
+        self.spis: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for child in subsystem:
+            _, name = _split_tag(child.tag)
+            if name == 'providers':
+                self.providers = [str(p.text).strip() for p in child]
+            elif name == 'spi':
+                self.spis[child.get('name', '')] = {
+                    p.get('name', ''): dict(p.attrib) for p in child if _split_tag(p.tag)[1] == 'provider'
+                }
+            elif len(child):
+                self.sections[name] = {_split_tag(c.tag)[1]: str(c.text or '').strip() for c in child}
+            else:
+                self.attributes[name] = str(child.text or '').strip()
+        self._provider_set = set(self.providers)
+
+    # Names of the JBoss modules registered as providers
+    @property
+    def modules(self) -> List[str]:
+        return [p[len('module:'):] for p in self.providers if p.startswith('module:')]
+
+    def has_provider(self, provider: str) -> bool:
+        return provider in self._provider_set
+
+    def has_module(self, module_name: str) -> bool:
+        return f'module:{module_name}' in self._provider_set
+
+
+# Streams through the file until the end of the keycloak-server subsystem, so
+# whatever follows it (undertow, infinispan, jgroups, ... in a heavily
+# customized standalone-ha.xml) is never read. Elements of the subsystems
+# before it are dropped as soon as they end, so no full DOM is built.
+def parse_server_config(cfg_path: Path) -> ServerConfig:
+    depth = 0
+    subsystem_depth = -1
+    with open(cfg_path, 'rb') as fp:
+        for event, elem in ET.iterparse(fp, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                ns, name = _split_tag(elem.tag)
+                if subsystem_depth < 0 and name == 'subsystem' and ns.startswith(KEYCLOAK_SUBSYSTEM_NS_PREFIX):
+                    subsystem_depth = depth
+                continue
+            if depth == subsystem_depth:
+                return ServerConfig(cfg_path, _split_tag(elem.tag)[0], elem)
+            if subsystem_depth < 0 and _split_tag(elem.tag)[1] == 'subsystem':
+                elem.clear()
+            depth -= 1
+    raise KeycloakSubsystemNotFoundError(cfg_path)
+
+
+# ServerConfigCache keeps the last parsed ServerConfig of a file around and
+# parses it again only when the file's mtime or size has changed.
+class ServerConfigCache:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._key: Optional[Tuple[str, int, int]] = None
+        self._config: Optional[ServerConfig] = None
+        self.parses = 0
+
+    def get(self, cfg_path: Path) -> ServerConfig:
+        st = os.stat(cfg_path)
+        key = (str(cfg_path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if self._config is None or self._key != key:
+                self._config = parse_server_config(cfg_path)
+                self._key = key
+                self.parses += 1
+            return self._config
+
+    # Forgets the cached config. Needed after writing to the file, as a write
+    # within the file system's timestamp granularity may keep mtime and size.
+    def invalidate(self) -> None:
+        with self._lock:
+            self._key = None
+            self._config = None
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from typing import IO, Deque, Dict, List, NamedTuple, Optional
+
+# Environment Variable Arguments
+KC_SERVER_LOG_LINES = int(os.getenv('KC_SERVER_LOG_LINES', '2000'))  # server output lines kept in memory
+KC_SERVER_LOG_ECHO = os.getenv('KC_SERVER_LOG_ECHO', 'true') == 'true'  # copy the server output to ours
+# Comma separated message codes that also fail a boot; -CODE keeps a built-in one from failing it
+KC_BOOT_FATAL_CODES = os.getenv('KC_BOOT_FATAL_CODES', '')
+
+# Constants
+# WildFly messages start with a code made of a subsystem prefix and a number,
+# like WFLYSRV0025 (server) or KC-SERVICES0001 (Keycloak)
+MESSAGE_CODE = re.compile(r'\b([A-Z]+(?:-[A-Z]+)*)(\d{4,5}):')
+BOOT_REPORT = re.compile(r'\b(WFLYSRV0025|WFLYSRV0026): .* started (?:\(with errors\) )?in (\d+)ms')
+# Messages marking how far a boot got, by the name of the phase they end
+BOOT_PHASES = {
+    'WFLYSRV0049': 'starting',
+    'WFLYUT0006': 'http_listening',
+    'KC-SERVICES0001': 'keycloak_config',
+    'WFLYSRV0010': 'deployed',
+    'WFLYSRV0025': 'started',
+}
+BOOT_FATAL_OVERRIDES = [code.strip() for code in KC_BOOT_FATAL_CODES.split(',') if code.strip()]
+# Messages after which the server will never become ready
+BOOT_FATAL_CODES = [code for code in [
+    'WFLYSRV0026',  # started (with errors); only fatal when keycloak-server.war is what failed
+    'WFLYSRV0055',  # caught exception during boot
+    'WFLYSRV0056',  # server boot has failed in an unrecoverable manner
+    'WFLYCTL0085',  # failed to parse the configuration
+] + [code for code in BOOT_FATAL_OVERRIDES if not code.startswith('-')] if f'-{code}' not in BOOT_FATAL_OVERRIDES]
+KEYCLOAK_DEPLOYMENT = 'keycloak-server.war'
+DEPLOYMENT_FAILURE_CODES = [
+    'WFLYCTL0013',  # operation failed
+    'WFLYSRV0021',  # deploy of a deployment was rolled back
+]
+
+
+# What the server output tells about a boot. Times are seconds since the
+# server process was launched, as the lines were read. reported_ms is the
+# boot time WildFly reports itself, once it has started.
+class BootTimings(NamedTuple):
+    reported_ms: Optional[int]
+    phases: Dict[str, float]
+    subsystems: Dict[str, float]  # message prefix -> seconds from its first to last boot message
+    deployment_failures: List[str]
+
+
+# ServerLog captures the output of a server process. A daemon thread reads the
+# pipe (so the server never blocks on a full one), echoes each line, keeps the
+# last `max_lines` of them and parses the WildFly boot messages on the way:
+# the phases reached, the time each subsystem took, deployment failures, and
+# the first fatal message, after which waiting for readiness is pointless.
+#
+# Usage:
+#   handle = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+#   server_log = ServerLog(handle.stdout)
+#   ... server_log.fatal, server_log.timings(), server_log.tail(20)
+class ServerLog:
+
+    def __init__(
+            self,
+            stream: IO[bytes],
+            max_lines: int = KC_SERVER_LOG_LINES,
+            echo: bool = KC_SERVER_LOG_ECHO,
+    ) -> None:
+        self._stream = stream
+        self._echo = echo
+        self._lines: Deque[str] = deque(maxlen=max(1, max_lines))
+        self._lock = threading.Lock()
+        self._launched = time.monotonic()
+        self._reported_ms: Optional[int] = None
+        self._phases: Dict[str, float] = {}
+        self._subsystems: Dict[str, List[float]] = {}
+        self._deployment_failures: List[str] = []
+        self._booted = False
+        self.fatal = ''
+        self._thread = threading.Thread(target=self._read, name='server-log', daemon=True)
+        self._thread.start()
+
+    def _read(self) -> None:
+        for raw in iter(self._stream.readline, b''):
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            if self._echo:
+                sys.stdout.write(line + '\n')
+                sys.stdout.flush()
+            with self._lock:
+                self._lines.append(line)
+                if not self._booted:
+                    self._parse(line, time.monotonic() - self._launched)
+        self._stream.close()
+
+    # Whether the output has ended, which happens when the server exits
+    @property
+    def ended(self) -> bool:
+        return not self._thread.is_alive()
+
+    def _parse(self, line: str, at: float) -> None:
+        match = MESSAGE_CODE.search(line)
+        if match is None:
+            return
+        prefix, code = match.group(1), match.group(1) + match.group(2)
+        times = self._subsystems.setdefault(prefix, [at, at])
+        times[1] = at
+        if code in BOOT_PHASES:
+            self._phases.setdefault(BOOT_PHASES[code], at)
+        if code in DEPLOYMENT_FAILURE_CODES:
+            self._deployment_failures.append(line[match.start():])
+        if code in BOOT_FATAL_CODES and not self.fatal and self._is_fatal(code):
+            self.fatal = line[match.start():]
+        report = BOOT_REPORT.search(line)
+        if report is not None:
+            self._reported_ms = int(report.group(2))
+            self._booted = True
+
+    # WildFly reports a boot with failed deployments as started (with errors)
+    # once everything else is up. Keycloak is serving by then, unless it is
+    # keycloak-server.war that failed, so only that fails the boot; otherwise
+    # readiness is left to the probes.
+    def _is_fatal(self, code: str) -> bool:
+        if code != 'WFLYSRV0026':
+            return True
+        return any(KEYCLOAK_DEPLOYMENT in failure for failure in self._deployment_failures)
+
+    def timings(self) -> BootTimings:
+        with self._lock:
+            return BootTimings(
+                self._reported_ms,
+                dict(self._phases),
+                {prefix: last - first for prefix, (first, last) in self._subsystems.items()},
+                list(self._deployment_failures),
+            )
+
+    # The last n lines of output
+    def tail(self, n: int) -> List[str]:
+        with self._lock:
+            return list(self._lines)[-n:]
+
+    # Waits for the output to end, once the process has exited
+    def close(self, timeout: float = 5) -> None:
+        self._thread.join(timeout)
+
+
+def describe_timings(timings: BootTimings) -> str:
+    phases = ', '.join(f'{name} at {at:.2f}s' for name, at in sorted(timings.phases.items(), key=lambda p: p[1]))
+    slowest = sorted(timings.subsystems.items(), key=lambda s: -s[1])[:5]
+    subsystems = ', '.join(f'{prefix} {seconds:.2f}s' for prefix, seconds in slowest)
+    reported = f'{timings.reported_ms}ms' if timings.reported_ms is not None else 'n/a'
+    return f'reported {reported}; phases: {phases or "none"}; slowest subsystems: {subsystems or "none"}'
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Local Imports
+from bulk import match_results
+from keycloak import KeycloakHandle
+from reconciler import Reconciler
+from tracing import span
+
+
+# Constants
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_HASH_ATTRIBUTE = 'hskc.snapshot.sha256'  # realm attribute holding the hash of the last snapshot applied
+# Realm settings carried by a snapshot: the themes and the flows bound to the realm
+REALM_SETTINGS = [
+    'loginTheme',
+    'accountTheme',
+    'adminTheme',
+    'emailTheme',
+    'internationalizationEnabled',
+    'supportedLocales',
+    'defaultLocale',
+    'browserFlow',
+    'registrationFlow',
+    'directGrantFlow',
+    'resetCredentialsFlow',
+    'clientAuthenticationFlow',
+    'dockerAuthenticationFlow',
+]
+# Clients Keycloak creates on its own, in every realm
+BUILTIN_CLIENTS = ['account', 'account-console', 'admin-cli', 'broker', 'realm-management', 'security-admin-console']
+MASKED_SECRET = '**********'
+
+
+class SnapshotFormatError(Exception):
+
+    def __init__(self, path: Path, reason: str) -> None:
+        self.path = path
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return (
+            'Not a usable realm snapshot.\n'
+            f'Path: {self.path}\n'
+            f'Reason: {self.reason}\n'
+        )
+
+
+# Hash of the snapshot content, independent of key order and whitespace
+def content_hash(content: Dict[str, Any]) -> str:
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _is_builtin_client(client: Dict[str, Any]) -> bool:
+    client_id = str(client.get('clientId', ''))
+    return client_id in BUILTIN_CLIENTS or client_id.endswith('-realm')
+
+
+# Authentication flows of an export, in the desired-state format of the
+# reconciler. Only custom, top-level flows made of authenticators are kept:
+# the reconciler matches executions by provider and doesn't create sub-flows.
+def _flows_from_export(export: Dict[str, Any]) -> List[Dict[str, Any]]:
+    configs = {c.get('alias'): c.get('config', {}) for c in export.get('authenticatorConfig', [])}
+    flows: List[Dict[str, Any]] = []
+    for flow in export.get('authenticationFlows', []):
+        if flow.get('builtIn') or not flow.get('topLevel'):
+            continue
+        executions: List[Dict[str, Any]] = []
+        for execution in sorted(flow.get('authenticationExecutions', []), key=lambda e: e.get('priority', 0)):
+            if execution.get('autheticatorFlow') or not execution.get('authenticator'):
+                print(f'Snapshot: leaving out sub-flow "{execution.get("flowAlias")}" of flow "{flow["alias"]}"')
+                continue
+            spec: Dict[str, Any] = {
+                'provider': execution['authenticator'],
+                'requirement': execution.get('requirement', 'DISABLED'),
+            }
+            config_alias = execution.get('authenticatorConfig')
+            if config_alias:
+                spec['config'] = {'alias': config_alias, 'config': configs.get(config_alias, {})}
+            executions.append(spec)
+        flows.append({
+            'alias': flow['alias'],
+            'description': flow.get('description', ''),
+            'providerId': flow.get('providerId', 'basic-flow'),
+            'topLevel': True,
+            'executions': executions,
+        })
+    return sorted(flows, key=lambda f: f['alias'])
+
+
+# Custom clients of an export, without anything specific to the Keycloak they
+# came from: ids are dropped, masked secrets are dropped (so Keycloak generates
+# new ones) and flow overrides refer to flows by alias instead of by id
+def _clients_from_export(export: Dict[str, Any]) -> List[Dict[str, Any]]:
+    flow_aliases = {f.get('id'): f.get('alias') for f in export.get('authenticationFlows', [])}
+    clients: List[Dict[str, Any]] = []
+    for client in export.get('clients', []):
+        if _is_builtin_client(client):
+            continue
+        client = {k: v for k, v in client.items() if k != 'id'}
+        if client.get('secret') == MASKED_SECRET:
+            del client['secret']
+        if 'protocolMappers' in client:
+            client['protocolMappers'] = [{k: v for k, v in m.items() if k != 'id'} for m in client['protocolMappers']]
+        overrides = client.get('authenticationFlowBindingOverrides', {})
+        client['authenticationFlowBindingOverrides'] = {
+            binding: flow_aliases.get(flow_id, flow_id) for binding, flow_id in overrides.items()
+        }
+        clients.append(client)
+    return sorted(clients, key=lambda c: str(c.get('clientId')))
+
+
+# Exports the configured state of a realm (its settings and themes, custom
+# flows with their executions and configs, and custom clients) as a snapshot:
+# {
+#   "format": 1,
+#   "realm": "master",
+#   "created": "2020-05-04T10:00:00Z",
+#   "sha256": "<hash of the content>",
+#   "content": { "realm": {...}, "flows": [...], "clients": [...] }
+# }
+def export_snapshot(kc: KeycloakHandle, realm: str) -> Dict[str, Any]:
+    with span('snapshot.export', realm=realm):
+        export = kc.partial_export(realm, export_clients=True)
+    content = {
+        'realm': {key: export[key] for key in REALM_SETTINGS if key in export},
+        'flows': _flows_from_export(export),
+        'clients': _clients_from_export(export),
+    }
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'realm': realm,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'sha256': content_hash(content),
+        'content': content,
+    }
+
+
+def save_snapshot(snapshot: Dict[str, Any], path: Path) -> None:
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'w') as fp:
+        json.dump(snapshot, fp, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Loads a snapshot, making sure its content is the one its hash was taken of
+def load_snapshot(path: Path) -> Dict[str, Any]:
+    with open(path, 'r') as fp:
+        snapshot = json.load(fp)
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotFormatError(path, f'format {snapshot.get("format")} is not {SNAPSHOT_FORMAT}')
+    if content_hash(snapshot.get('content', {})) != snapshot.get('sha256'):
+        raise SnapshotFormatError(path, 'the content does not match its sha256')
+    return snapshot
+
+
+# Hash of the snapshot last applied to the realm, if any
+def applied_hash(kc: KeycloakHandle, realm: str) -> Optional[str]:
+    attributes = kc.get_realm(realm).get('attributes') or {}
+    return attributes.get(SNAPSHOT_HASH_ATTRIBUTE)
+
+
+# Brings a realm to the state of a snapshot. When the realm records that this
+# very snapshot was applied already, that single lookup is all it costs.
+# Otherwise the flows are reconciled (creating only what is missing), the
+# clients are imported in one partial import and the realm settings are
+# updated along with the hash, last, so that a failed attempt is retried in
+# full on the next boot. Returns True if anything was applied.
+# Clients that exist already are skipped by the import and updated in place
+# instead: overwriting them would make Keycloak delete and recreate them, with
+# a new id and secret and without their roles and service account user.
+def apply_snapshot(kc: KeycloakHandle, snapshot: Dict[str, Any], realm: str = '') -> bool:
+    realm = realm or snapshot['realm']
+    digest = snapshot['sha256']
+    if applied_hash(kc, realm) == digest:
+        print(f'Realm {realm} already matches snapshot {digest[:12]}; skipping')
+        return False
+    content = snapshot['content']
+    print(f'Applying snapshot {digest[:12]} to realm {realm}...')
+    with span('snapshot.apply', realm=realm):
+        flows = content.get('flows', [])
+        if flows:
+            Reconciler(kc, {'realms': [{'realm': realm, 'flows': flows}]}).reconcile()
+        clients = content.get('clients', [])
+        if clients:
+            flow_ids = {str(f.get('alias')): f.get('id') for f in kc.list_authentication_flows(realm)}
+            clients = [dict(client, authenticationFlowBindingOverrides={
+                binding: flow_ids.get(alias, alias)
+                for binding, alias in client.get('authenticationFlowBindingOverrides', {}).items()
+            }) for client in clients]
+            reply = kc.partial_import(realm, {'ifResourceExists': 'SKIP', 'clients': clients})
+            by_client_id = {str(client.get('clientId')): client for client in clients}
+            for result in match_results(reply, 'CLIENT', [(0, client_id) for client_id in by_client_id]):
+                if result.action == 'SKIPPED':
+                    kc.update_client(realm, result.id, by_client_id[result.name])
+        settings = dict(content.get('realm', {}))
+        settings['attributes'] = {SNAPSHOT_HASH_ATTRIBUTE: digest}
+        kc.update_realm(realm, settings)
+    print(f'...Applied snapshot to realm {realm}: {len(flows)} flow(s), {len(clients)} client(s)')
+    return True
+
+
+# Main()
+# Usage: snapshot.py export realm snapshot.json
+#        snapshot.py apply snapshot.json [realm]
+if __name__ == '__main__':
+    from keycloak import singleton
+    singleton.start()
+    singleton.login()
+    if sys.argv[1] == 'export':
+        snapshot = export_snapshot(singleton, sys.argv[2])
+        save_snapshot(snapshot, Path(sys.argv[3]))
+        print(f'Snapshot {snapshot["sha256"][:12]} of realm {sys.argv[2]} written to {sys.argv[3]}')
+    else:
+        apply_snapshot(singleton, load_snapshot(Path(sys.argv[2])), sys.argv[3] if len(sys.argv) > 3 else '')
@@ -5,6 +5,7 @@ import os
 
 # Local Imports
 from keycloak import KeycloakHandle, singleton
+from tracing import traced
 
 # Environment Variables
 AUTH_FLOW_NAME = os.getenv('AUTH_FLOW_NAME', '')
@@ -15,11 +16,13 @@ HYPERSIGN_PROVIDER = 'hyerpsign-qrocde-authenticator'
 
 
 # Create HyperSign Execution
+@traced('step_create_execution', 'step')
 def step_create_execution(
         kc: KeycloakHandle = singleton,
         auth_flow_name: str = AUTH_FLOW_NAME,
         execution_name: str = HYPERSIGN_EXECUTION_NAME) -> None:
     kc.start()
+    kc.restart_barrier(f'execution "{execution_name}"')  # the plugin must be loaded
     kc.login()
     print('Checking if HyperSign Execution is present...')
     available_executions = kc.list_execution_names('master', auth_flow_name)
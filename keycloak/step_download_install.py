@@ -5,70 +5,123 @@ import os
 import shutil
 from pathlib import Path
 import tarfile
-from typing import List, Type
+from typing import Dict, IO, List, Optional
 
 # Local Imports
 from downloader import dld_with_checks_get_path
-from keycloak import KeycloakHandle, singleton
+from keycloak import DEFAULT_THEME_NAME, KeycloakHandle, singleton, read_from_file, write_to_file
+from theme_deployer import ThemeChanges
+from tracing import traced
 
 # Environment Variables
 AUTHENTICATOR_BUILD_URL = os.getenv('AUTHENTICATOR_BUILD_URL', '')
 AUTHENTICATOR_CHECKSUM = os.getenv('AUTHENTICATOR_CHECKSUM', '')
+AUTHENTICATOR_MIRRORS = os.getenv('AUTHENTICATOR_MIRRORS', '')  # comma separated URLs serving the same tarball
 HS_AUTH_SERVER_ENDPOINT = os.getenv('HS_AUTH_SERVER_ENDPOINT', '')
+HS_THEME_NAME = os.getenv('HS_THEME_NAME', DEFAULT_THEME_NAME)  # theme the plugin's theme files are published as
 
 # Constants
 MODULE_NAME = 'hs-plugin-keycloak-ejb'
 THEME_TARBALL_NAME = 'hs-theme.tar.gz'
-
-
-def get_files_in_tarfile(tarball_path: Path) -> List[str]:
-    with tarfile.open(tarball_path, mode='r') as archive:
-        files = archive.getnames()
-    return files
-
-
-def get_extract_dir(tarball_path: Path) -> Path:
-    files = get_files_in_tarfile(tarball_path)
-    common_prefix = os.path.commonpath(files)
-    return Path(common_prefix)
-
-
-def get_jar_path(tarball_path: Path) -> Path:
-
-    files = get_files_in_tarfile(tarball_path)
-
-    def ends_with(s: str) -> bool:
-        return s.endswith('.jar')
-
-    jar_relative_path = list(filter(ends_with, files))[0]
+MODULE_CHECKSUM_FILE = 'hskc.checksum'  # records which tarball the deployed module came from
+MODULE_DEPENDENCIES = [
+    'org.keycloak.keycloak-common',
+    'org.keycloak.keycloak-core',
+    'org.keycloak.keycloak-services',
+    'org.keycloak.keycloak-model-jpa',
+    'org.keycloak.keycloak-server-spi',
+    'org.keycloak.keycloak-server-spi-private',
+    'javax.ws.rs.api',
+    'javax.persistence.api',
+    'org.hibernate',
+    'org.javassist',
+    'org.liquibase',
+    'com.fasterxml.jackson.core.jackson-core',
+    'com.fasterxml.jackson.core.jackson-databind',
+    'com.fasterxml.jackson.core.jackson-annotations',
+    'org.jboss.resteasy.resteasy-jaxrs',
+    'org.jboss.logging',
+    'org.apache.httpcomponents',
+    'org.apache.commons.codec',
+    'org.keycloak.keycloak-wildfly-adduser',
+]
+
+
+class PluginJarMissingError(Exception):
+
+    def __init__(self, tarball_path: Path) -> None:
+        self.tarball_path = tarball_path
+
+    def __str__(self) -> str:
+        return f'No .jar file found in plugin tarball {self.tarball_path}'
+
+
+# TarIndex records what the plugin tarball holds: its members, the top level
+# directory it extracts to, the module's jar and the files of the nested theme
+# tarball. It is built by extract_files() in a single pass over the archive.
+class TarIndex:
+
+    def __init__(self, tarball_path: Path) -> None:
+        self.tarball_path = tarball_path
+        self.members: List[str] = []
+        self.extract_dir: Optional[Path] = None
+        self.jar_path: Optional[Path] = None
+        self.theme_files: Dict[str, bytes] = {}
+
+
+# Reads the nested theme tarball straight off the outer archive's stream and
+# returns the files right inside its top level directory, keyed by file name
+def read_theme_files(fileobj: IO[bytes]) -> Dict[str, bytes]:
+    names: List[str] = []
+    contents: Dict[str, bytes] = {}
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            names.append(member.name)
+            data = archive.extractfile(member) if member.isfile() else None
+            if data is not None:
+                contents[member.name] = data.read()
+    themes_dir = os.path.commonpath(names) if names else ''
+    return {
+        os.path.basename(name): data for name, data in contents.items()
+        if os.path.dirname(name) == themes_dir
+    }
+
+
+# extract_files decompresses the tarball exactly once: members are extracted
+# and indexed as they stream by, and the nested theme tarball is read into
+# memory on the way, instead of being written out and opened again.
+def extract_files(tarball_path: Path) -> TarIndex:
+    index = TarIndex(tarball_path)
     cwd = Path(os.getcwd())
-    jar_path = cwd.joinpath(jar_relative_path)
-
-    return jar_path
-
-
-def extract_files(tarball_path: Path) -> None:
-    extract_dir = get_extract_dir(tarball_path)
-    if extract_dir.exists():
-        print(f"Deleting directory '{extract_dir}' because it already exists")
-        shutil.rmtree(extract_dir)
-    with tarfile.open(tarball_path) as archive:
-        archive.extractall()
-
-
-def install_theme(kc: KeycloakHandle, tarball_path: Path) -> None:
-    extract_dir = get_extract_dir(tarball_path)
-    themes_tarball = extract_dir.joinpath(THEME_TARBALL_NAME)
-    with tarfile.open(themes_tarball) as archive:
-        archive.extractall()
-    themes_dir = get_extract_dir(themes_tarball)
-    file_paths: List[Path] = []
-    dir_entry: os.DirEntry
-    print(f'Themes have been extracted to {themes_dir}')
-    for dir_entry in os.scandir(themes_dir):  # find all files
-        file_path = Path(dir_entry.path)
-        file_paths.append(file_path)
-    kc.add_login_theme_files(file_paths)
+    with tarfile.open(tarball_path, mode='r|*') as archive:
+        for member in archive:
+            if index.extract_dir is None and ('/' in member.name or member.isdir()):
+                index.extract_dir = Path(member.name.split('/')[0])
+                if index.extract_dir.exists():
+                    print(f"Deleting directory '{index.extract_dir}' because it already exists")
+                    shutil.rmtree(index.extract_dir)
+            index.members.append(member.name)
+            if member.name.endswith(THEME_TARBALL_NAME):
+                theme_tarball = archive.extractfile(member)
+                if theme_tarball is not None:
+                    index.theme_files = read_theme_files(theme_tarball)
+                continue
+            if member.name.endswith('.jar') and index.jar_path is None:
+                index.jar_path = cwd.joinpath(member.name)
+            archive.extract(member)
+    return index
+
+
+# install_theme publishes the theme files, writing only what changed. A
+# running Keycloak may have cached the files that were updated or removed, so
+# a restart is requested for those.
+def install_theme(kc: KeycloakHandle, index: TarIndex) -> ThemeChanges:
+    print(f'Installing {len(index.theme_files)} theme files from {index.tarball_path}')
+    changes = kc.add_login_theme_contents(index.theme_files, HS_THEME_NAME)
+    print(f'Theme {HS_THEME_NAME}: {changes.describe()}')
+    if changes.needs_cache_flush:
+        kc.request_restart(f'theme {HS_THEME_NAME} changed')
+    return changes
 
 
 # deploy_config generates a hypersign.properties file that has the
@@ -82,31 +135,36 @@ def deploy_config(kc: KeycloakHandle, auth_server_endpoint: str) -> None:
     kc.add_config_file_content(file_name, file_text)
 
 
-def deploy_module(kc: KeycloakHandle, module_name: str, tarball_path: Path) -> None:
+# is_module_current tells if the module is registered and was deployed from
+# the tarball with this checksum. Such a module needn't be deployed again, so
+# Keycloak can be started without waiting for the download and extraction.
+def is_module_current(kc: KeycloakHandle, module_name: str, tarball_checksum: str) -> bool:
+    marker = kc.get_module_basedir(module_name).joinpath(MODULE_CHECKSUM_FILE)
+    if not marker.exists() or not kc.is_module_registered(module_name):
+        return False
+    return read_from_file(marker).strip() == tarball_checksum
+
+
+def mark_module_deployed(kc: KeycloakHandle, module_name: str, tarball_checksum: str) -> None:
+    write_to_file(kc.get_module_basedir(module_name).joinpath(MODULE_CHECKSUM_FILE), tarball_checksum)
+
+
+def deploy_module(kc: KeycloakHandle, module_name: str, jar_path: Path) -> None:
+    kc.delete_module(module_name)
+    kc.add_module(module_name, jar_path, MODULE_DEPENDENCIES)
+    mark_module_deployed(kc, module_name, AUTHENTICATOR_CHECKSUM)
+
+
+# deploy_module_offline adds the module and registers it as a provider in one
+# jboss_cli run against the configuration file, before Keycloak is started.
+# Keycloak then boots exactly once, with the plugin already in place.
+def deploy_module_offline(kc: KeycloakHandle, module_name: str, jar_path: Path) -> None:
     kc.delete_module(module_name)
-    dependencies = [
-        'org.keycloak.keycloak-common',
-        'org.keycloak.keycloak-core',
-        'org.keycloak.keycloak-services',
-        'org.keycloak.keycloak-model-jpa',
-        'org.keycloak.keycloak-server-spi',
-        'org.keycloak.keycloak-server-spi-private',
-        'javax.ws.rs.api',
-        'javax.persistence.api',
-        'org.hibernate',
-        'org.javassist',
-        'org.liquibase',
-        'com.fasterxml.jackson.core.jackson-core',
-        'com.fasterxml.jackson.core.jackson-databind',
-        'com.fasterxml.jackson.core.jackson-annotations',
-        'org.jboss.resteasy.resteasy-jaxrs',
-        'org.jboss.logging',
-        'org.apache.httpcomponents',
-        'org.apache.commons.codec',
-        'org.keycloak.keycloak-wildfly-adduser',
-    ]
-    jar_path = get_jar_path(tarball_path)
-    kc.add_module(module_name, jar_path, dependencies)
+    batch = kc.batch(f'install-{module_name}', offline=True)
+    batch.add_module(module_name, jar_path, MODULE_DEPENDENCIES)
+    batch.register_module(module_name)
+    batch.run()
+    mark_module_deployed(kc, module_name, AUTHENTICATOR_CHECKSUM)
 
 
 def register_module(kc: KeycloakHandle, module_name: str) -> None:
@@ -118,28 +176,49 @@ def register_module(kc: KeycloakHandle, module_name: str) -> None:
     print(f'Module {module_name} registered in keycloak!')
 
 
-# Download HyperSign Keycloak Authenticator, Extract it and Install it!
-def step_download_extract_install(kc: KeycloakHandle = singleton) -> None:
+def download_plugin() -> Path:
     print(f'Downloading plugin from {AUTHENTICATOR_BUILD_URL}')
-    hs_tarball = dld_with_checks_get_path(AUTHENTICATOR_BUILD_URL, AUTHENTICATOR_CHECKSUM)
+    mirrors = [url.strip() for url in AUTHENTICATOR_MIRRORS.split(',') if url.strip()]
+    hs_tarball = dld_with_checks_get_path(AUTHENTICATOR_BUILD_URL, AUTHENTICATOR_CHECKSUM, mirrors)
     print(f'Plugin tarball downloaded to {hs_tarball}')
-    print('Extracting files...')
-    extract_files(hs_tarball)
+    return hs_tarball
+
+
+# stage_plugin puts the theme, configuration and module in place without
+# (re)starting Keycloak. A stopped instance gets the module registered offline,
+# so its next start picks everything up. A running one has its module replaced
+# and registered online, and a restart requested for it to take effect.
+def stage_plugin(kc: KeycloakHandle, index: TarIndex) -> None:
+    if index.jar_path is None:
+        raise PluginJarMissingError(index.tarball_path)
     print('Installing theme...')
-    install_theme(kc, hs_tarball)
+    install_theme(kc, index)
     print(f'Deploying configuration. hs-auth-server is at {HS_AUTH_SERVER_ENDPOINT}')
     deploy_config(kc, HS_AUTH_SERVER_ENDPOINT)
+    if is_module_current(kc, MODULE_NAME, AUTHENTICATOR_CHECKSUM):
+        print(f'Not deploying module {MODULE_NAME} since it is already deployed from this tarball!')
+        return
+    if not kc.is_running():
+        print(f'Deploying and registering module {MODULE_NAME} offline')
+        deploy_module_offline(kc, MODULE_NAME, index.jar_path)
+        return
     print(f'Deploying module {MODULE_NAME}')
-    deploy_module(kc, MODULE_NAME, hs_tarball)
+    deploy_module(kc, MODULE_NAME, index.jar_path)
+    register_module(kc, MODULE_NAME)
+    kc.request_restart(f'module {MODULE_NAME} deployed')
+
+
+# Download HyperSign Keycloak Authenticator, Extract it and Install it!
+@traced('step_download_extract_install', 'step')
+def step_download_extract_install(kc: KeycloakHandle = singleton) -> None:
+    hs_tarball = download_plugin()
+    print('Extracting files...')
+    index = extract_files(hs_tarball)
+    stage_plugin(kc, index)
     kc.start()
-    if not kc.is_module_registered(MODULE_NAME):
-        print(f'Registering module {MODULE_NAME}')
-        register_module(kc, MODULE_NAME)
-        kc.restart()
-    else:
-        print(f'Not registering module {MODULE_NAME} since it is already registered!')
 
 
 # Main()
 if __name__ == '__main__':
     step_download_extract_install()
+    singleton.flush_restarts()
@@ -5,11 +5,13 @@ import os
 
 # Local imports
 from keycloak import KeycloakHandle, singleton
+from tracing import traced
 
 AUTH_FLOW_NAME = os.getenv('AUTH_FLOW_NAME', '')
 
 
 # Ensure that HyperSign Flow is present
+@traced('step_ensure_hs_flow', 'step')
 def step_ensure_hs_flow(kc: KeycloakHandle = singleton) -> None:
 
     kc.start()
@@ -34,7 +36,7 @@ def step_ensure_hs_flow(kc: KeycloakHandle = singleton) -> None:
             top_level=True,
             built_in=False)
         print(f'Created HyperSign Flow with Flow ID "{AUTH_FLOW_NAME}"')
-        kc.restart()
+        # No restart needed: flows created via the admin API are live right away
 
 
 # Main()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import os
+from pathlib import Path
+
+# Local Imports
+from keycloak import KeycloakHandle, singleton
+from reconciler import Reconciler, load_desired_state
+from tracing import traced
+
+# Environment Variables
+HS_DESIRED_STATE = os.getenv('HS_DESIRED_STATE', '')
+HS_RECONCILE_PLAN_ONLY = os.getenv('HS_RECONCILE_PLAN_ONLY', '') == 'true'
+HS_RECONCILE_WORKERS = int(os.getenv('HS_RECONCILE_WORKERS', '4'))  # realms reconciled at the same time
+
+
+# Bring every realm described in the desired-state document up to date
+@traced('step_reconcile', 'step')
+def step_reconcile(
+        kc: KeycloakHandle = singleton,
+        desired_state_path: str = HS_DESIRED_STATE,
+        plan_only: bool = HS_RECONCILE_PLAN_ONLY,
+        max_workers: int = HS_RECONCILE_WORKERS) -> None:
+    if not desired_state_path:
+        print('Skipping reconciliation since HS_DESIRED_STATE is not set')
+        return
+    kc.start()
+    kc.restart_barrier('reconciling realms')  # executions may need the plugin loaded
+    kc.login()
+    print(f'Reconciling realms against {desired_state_path}...')
+    reconciler = Reconciler(kc, load_desired_state(Path(desired_state_path)))
+    actions = reconciler.reconcile(plan_only, max_workers)
+    verb = 'Planned' if plan_only else 'Applied'
+    print(f'...{verb} {len(actions)} change(s) across {len(reconciler.realm_specs)} realm(s)')
+
+
+# Main()
+if __name__ == '__main__':
+    step_reconcile()
@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import os
+from pathlib import Path
+
+# Local Imports
+from keycloak import KeycloakHandle, singleton
+from snapshot import apply_snapshot, load_snapshot
+from tracing import traced
+
+# Environment Variables
+HS_REALM_SNAPSHOT = os.getenv('HS_REALM_SNAPSHOT', '')
+
+
+# Brings the realm to the state of the snapshot at HS_REALM_SNAPSHOT, which
+# takes the place of creating the HyperSign flow and execution one by one
+@traced('step_apply_snapshot', 'step')
+def step_apply_snapshot(kc: KeycloakHandle = singleton, snapshot_path: str = HS_REALM_SNAPSHOT) -> None:
+    snapshot = load_snapshot(Path(snapshot_path))
+    kc.start()
+    kc.restart_barrier(f'snapshot {snapshot_path}')  # its executions may need the plugin loaded
+    kc.login()
+    apply_snapshot(kc, snapshot)
+
+
+# Main()
+if __name__ == '__main__':
+    step_apply_snapshot()
@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import os
+
+# Local Imports
+from keycloak import KeycloakHandle, singleton
+from tracing import traced
+from tuning import tune
+
+# Environment Variables
+HS_TUNING_PROFILE = os.getenv('HS_TUNING_PROFILE', '')  # small, balanced or throughput; empty keeps the image's
+HS_TUNING_DRY_RUN = os.getenv('HS_TUNING_DRY_RUN', '') == 'true'
+
+
+# Sizes the heap, metaspace, Undertow threads and datasource pool for the
+# container's CPU and memory limits, with the HS_TUNING_PROFILE preset
+@traced('step_tune', 'step')
+def step_tune(
+        kc: KeycloakHandle = singleton,
+        profile: str = HS_TUNING_PROFILE,
+        dry_run: bool = HS_TUNING_DRY_RUN) -> None:
+    if not profile:
+        print('Skipping tuning since HS_TUNING_PROFILE is not set')
+        return
+    tune(kc, profile, dry_run)
+
+
+# Main()
+if __name__ == '__main__':
+    step_tune()
+    singleton.flush_restarts()
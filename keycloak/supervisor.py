@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import json
+import os
+import select
+import signal
+import time
+from typing import Any, Dict, List, Optional
+
+# Local Imports
+from keycloak import KeycloakHandle
+
+# Environment Variable Arguments
+KC_RESTART_BACKOFF_MIN = float(os.getenv('KC_RESTART_BACKOFF_MIN', '1'))  # seconds before restarting a crashed server
+KC_RESTART_BACKOFF_MAX = float(os.getenv('KC_RESTART_BACKOFF_MAX', '60'))  # the doubling delay between restarts stops here
+KC_RESTART_BACKOFF_RESET = float(os.getenv('KC_RESTART_BACKOFF_RESET', '300'))  # uptime after which backoff starts over
+KC_MAX_RESTARTS = int(os.getenv('KC_MAX_RESTARTS', '0'))  # failed restarts in a row before giving up; 0 never does
+KC_SUPERVISOR_STATS = os.getenv('KC_SUPERVISOR_STATS', '')  # JSON file the restart counts and uptimes are written to
+
+# Constants
+STOP_SIGNALS = [signal.SIGTERM, signal.SIGINT]
+FORWARDED_SIGNALS = [signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2]
+
+
+# Exit code of a wait status, negative when the process was killed by a signal
+def exit_code_of(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+# Restart counts and uptime of one supervised server
+class ServerStats:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.pid: Optional[int] = None
+        self.started = 0.0  # when the current server process started, 0 while it's down
+        self.restarts = 0
+        self.exits = 0
+        self.failed_starts = 0
+        self.failures_in_a_row = 0
+        self.last_exit_code: Optional[int] = None
+        self.last_exit = 0.0
+
+    def uptime(self) -> float:
+        return time.time() - self.started if self.started else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'pid': self.pid,
+            'running': self.pid is not None,
+            'uptime_seconds': round(self.uptime(), 3),
+            'started_at': self.started or None,
+            'restarts': self.restarts,
+            'exits': self.exits,
+            'failed_starts': self.failed_starts,
+            'failures_in_a_row': self.failures_in_a_row,
+            'last_exit_code': self.last_exit_code,
+            'last_exit_at': self.last_exit or None,
+        }
+
+
+# Supervisor keeps the servers started by the given handles running, as the
+# last thing an entrypoint does (in place of sleeping forever). As the
+# container's main process, it reaps every child that exits, zombies of
+# orphaned grandchildren included. A server that exits is noticed right away
+# and started again, after a delay that doubles with each failure in a row
+# (from backoff_min up to backoff_max) and starts over once a server has
+# stayed up for backoff_reset seconds. SIGTERM and SIGINT stop the servers
+# gracefully and end the supervisor; SIGHUP, SIGUSR1 and SIGUSR2 are passed
+# on to them. Restart counts and uptimes are written to stats_file.
+#
+# Usage:
+#   sys.exit(Supervisor([singleton]).run())
+class Supervisor:
+
+    def __init__(
+            self,
+            servers: List[KeycloakHandle],
+            backoff_min: float = KC_RESTART_BACKOFF_MIN,
+            backoff_max: float = KC_RESTART_BACKOFF_MAX,
+            backoff_reset: float = KC_RESTART_BACKOFF_RESET,
+            max_restarts: int = KC_MAX_RESTARTS,
+            stats_file: str = KC_SUPERVISOR_STATS,
+    ) -> None:
+        self._servers = servers
+        self._stats = [ServerStats(kc.base_url) for kc in servers]
+        self._backoff_min = backoff_min
+        self._backoff_max = max(backoff_min, backoff_max)
+        self._backoff_reset = backoff_reset
+        self._max_restarts = max_restarts
+        self._stats_file = stats_file
+        self._restart_at: Dict[int, float] = {}  # server index -> when to start it again
+        self._stopping = False
+        self._starting: Optional[int] = None  # index of the server being started
+        self._exit_code = 0
+
+    @property
+    def stats(self) -> List[Dict[str, Any]]:
+        return [dict(s.to_dict(), name=s.name) for s in self._stats]
+
+    def _write_stats(self) -> None:
+        if not self._stats_file:
+            return
+        tmp_path = f'{self._stats_file}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump({'servers': self.stats, 'written_at': time.time()}, fp, indent=2)
+        os.replace(tmp_path, self._stats_file)
+
+    def _on_stop(self, signum: int, frame: Any) -> None:
+        print(f'Supervisor: got signal {signum}; stopping')
+        self._stopping = True
+        if self._starting is not None:
+            # A server still booting would only be stopped once ready; the
+            # failed boot is noticed right away instead
+            self._signal(self._servers[self._starting].pid, signal.SIGTERM)
+
+    def _on_forward(self, signum: int, frame: Any) -> None:
+        for stats in self._stats:
+            self._signal(stats.pid, signum)
+
+    def _signal(self, pid: Optional[int], signum: int) -> None:
+        if pid is not None:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    # Reaps every child that has exited, noting the servers among them
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for index, stats in enumerate(self._stats):
+                if stats.pid == pid:
+                    self._exited(index, exit_code_of(status))
+
+    def _exited(self, index: int, exit_code: int) -> None:
+        stats = self._stats[index]
+        uptime = stats.uptime()
+        self._servers[index].forget_exited()
+        stats.pid = None
+        stats.started = 0.0
+        stats.exits += 1
+        stats.last_exit_code = exit_code
+        stats.last_exit = time.time()
+        if self._stopping:
+            return
+        if uptime >= self._backoff_reset:
+            stats.failures_in_a_row = 0
+        print(f'Supervisor: {stats.name} exited with code {exit_code} after {uptime:.1f}s up')
+        self._schedule(index)
+
+    def _schedule(self, index: int) -> None:
+        stats = self._stats[index]
+        stats.failures_in_a_row += 1
+        if self._max_restarts and stats.failures_in_a_row > self._max_restarts:
+            print(f'Supervisor: giving up on {stats.name} after {self._max_restarts} failed restart(s) in a row')
+            exit_code = stats.last_exit_code or 1
+            self._exit_code = 128 - exit_code if exit_code < 0 else exit_code  # like a shell reports signals
+            self._stopping = True
+            return
+        delay = min(self._backoff_max, self._backoff_min * 2 ** (stats.failures_in_a_row - 1))
+        print(f'Supervisor: starting {stats.name} again in {delay:.1f}s')
+        self._restart_at[index] = time.monotonic() + delay
+        self._write_stats()
+
+    def _start(self, index: int) -> None:
+        kc, stats = self._servers[index], self._stats[index]
+        stats.restarts += 1
+        self._starting = index
+        try:
+            kc.start()
+        except Exception as e:
+            print(f'Supervisor: starting {stats.name} failed: {e}')
+            stats.failed_starts += 1
+            if not self._stopping:
+                self._schedule(index)
+            return
+        finally:
+            self._starting = None
+        stats.pid = kc.pid
+        stats.started = time.time()
+        print(f'Supervisor: {stats.name} is up again (restart {stats.restarts})')
+        self._write_stats()
+
+    # Starts the servers whose time has come. Returns the seconds until the
+    # next one is due, or None if none is.
+    def _start_due(self) -> Optional[float]:
+        for index, at in sorted(self._restart_at.items(), key=lambda item: item[1]):
+            if self._stopping or at > time.monotonic():
+                break
+            del self._restart_at[index]
+            self._start(index)
+        if not self._restart_at:
+            return None
+        return max(0.0, min(self._restart_at.values()) - time.monotonic())
+
+    # Supervises until a stop signal (or giving up on a server) and returns
+    # the exit code for the entrypoint
+    def run(self) -> int:
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_read, False)
+        os.set_blocking(wakeup_write, False)
+        # Signal handlers only set flags; the byte Python writes to the wakeup
+        # fd for each signal is what interrupts the wait below
+        previous_wakeup_fd = signal.set_wakeup_fd(wakeup_write)
+        previous_handlers = {sig: signal.getsignal(sig) for sig in STOP_SIGNALS + FORWARDED_SIGNALS + [signal.SIGCHLD]}
+        for sig in STOP_SIGNALS:
+            signal.signal(sig, self._on_stop)
+        for sig in FORWARDED_SIGNALS:
+            signal.signal(sig, self._on_forward)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        for kc, stats in zip(self._servers, self._stats):
+            if kc.is_running() and kc.pid is not None:
+                stats.pid = kc.pid
+                stats.started = time.time()
+        print(f'Supervisor: watching {", ".join(s.name for s in self._stats if s.pid is not None) or "no servers"}')
+        self._write_stats()
+        try:
+            while not self._stopping:
+                self._reap()
+                timeout = self._start_due()
+                if self._stopping:
+                    break
+                select.select([wakeup_read], [], [], timeout)
+                while True:
+                    try:
+                        if not os.read(wakeup_read, 512):
+                            break
+                    except BlockingIOError:
+                        break
+        finally:
+            for kc in self._servers:
+                kc.stop()
+            self._reap()
+            for stats in self._stats:
+                stats.pid = None
+                stats.started = 0.0
+            self._write_stats()
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            for sig, handler in previous_handlers.items():
+                if handler is not None:  # None when set from outside Python
+                    signal.signal(sig, handler)
+            os.close(wakeup_read)
+            os.close(wakeup_write)
+        print(f'Supervisor: done; {sum(s.restarts for s in self._stats)} restart(s) in all')
+        return self._exit_code
+
+
+def supervise(servers: List[KeycloakHandle]) -> int:
+    return Supervisor(servers).run()
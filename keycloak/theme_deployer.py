@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+# Constants
+MANIFEST_FILE = '.hskc-manifest.json'  # within a theme version: file name -> sha256
+VERSIONS_DIR = '.versions'  # within a theme's directory; Keycloak only looks at the theme type directories
+THEME_PROPERTIES_FILE = 'theme.properties'
+DEFAULT_THEME_PROPERTIES = b'parent=keycloak\nimport=common/keycloak\n'
+
+
+# What deploying a theme changed, by file name
+class ThemeChanges(NamedTuple):
+    added: List[str]
+    updated: List[str]
+    removed: List[str]
+    unchanged: List[str]
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+    # Keycloak caches the templates and resources it has loaded, so only files
+    # that were updated or removed can be served stale
+    @property
+    def needs_cache_flush(self) -> bool:
+        return bool(self.updated or self.removed)
+
+    def describe(self) -> str:
+        return (
+            f'{len(self.added)} added, {len(self.updated)} updated, '
+            f'{len(self.removed)} removed, {len(self.unchanged)} unchanged'
+        )
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# Name of the version directory for a set of files: a hash of their names and
+# hashes, so the same files always end up in the same version
+def version_name(manifest: Dict[str, str]) -> str:
+    return _sha256(json.dumps(manifest, sort_keys=True).encode('utf-8'))[:16]
+
+
+# The manifest of a deployed version, hashing its files if it has none (like
+# a theme directory that predates versions)
+def read_manifest(version_dir: Path) -> Dict[str, str]:
+    manifest_path = version_dir.joinpath(MANIFEST_FILE)
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as fp:
+            return json.load(fp)
+    return {p.name: _sha256(p.read_bytes()) for p in version_dir.iterdir() if p.is_file()}
+
+
+# Puts a file in a new version: a hard link to the same file of the current
+# version when it is unchanged, or else a fresh copy
+def _place(path: Path, data: bytes, same_file: Optional[Path]) -> None:
+    if same_file is not None:
+        try:
+            os.link(str(same_file), str(path))
+            return
+        except OSError:
+            pass  # another filesystem, or links not allowed; copy instead
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+# Points a symlink at a new target in one step, by renaming a new symlink over it
+def _swap_symlink(link: Path, target: str) -> None:
+    tmp_link = link.with_name(f'.{link.name}.{os.getpid()}.tmp')
+    if os.path.lexists(str(tmp_link)):
+        tmp_link.unlink()
+    os.symlink(target, str(tmp_link))
+    os.replace(str(tmp_link), str(link))
+
+
+# deploy_theme publishes the files of a theme type (like login) of a dedicated
+# theme, under themes_dir/theme_name/theme_type. Each set of files is written
+# once, to a version directory named after their hashes, and theme_type is a
+# symlink to the current version that is swapped in one rename: Keycloak sees
+# either the old files or the new ones, never a mix. Unchanged files are hard
+# linked from the current version rather than written again. Files that are
+# already deployed cost a single readlink.
+# Every file but theme.properties also gets a symlink in each of link_dirs
+# (like themes/base/login), through the theme_type symlink, so themes that
+# don't inherit from this one still find its templates, and switch versions
+# along with it.
+def deploy_theme(
+        themes_dir: Path,
+        theme_name: str,
+        theme_type: str,
+        contents: Dict[str, bytes],
+        link_dirs: List[Path] = [],
+) -> ThemeChanges:
+    files = dict(contents)
+    files.setdefault(THEME_PROPERTIES_FILE, DEFAULT_THEME_PROPERTIES)
+    manifest = {name: _sha256(data) for name, data in files.items()}
+    version = version_name(manifest)
+    theme_dir = themes_dir.joinpath(theme_name)
+    versions_dir = theme_dir.joinpath(VERSIONS_DIR)
+    link = theme_dir.joinpath(theme_type)
+    new_target = f'{VERSIONS_DIR}/{version}'
+    linked = sorted(name for name in files if name != THEME_PROPERTIES_FILE)
+
+    current_dir: Optional[Path] = None
+    if link.is_symlink():
+        if os.readlink(str(link)) == new_target and versions_dir.joinpath(version).is_dir():
+            _link_files(link, linked, link_dirs)
+            return ThemeChanges([], [], [], sorted(manifest))
+        current_dir = link.resolve() if link.exists() else None
+    elif link.is_dir():
+        current_dir = link
+    current = read_manifest(current_dir) if current_dir is not None else {}
+
+    version_dir = versions_dir.joinpath(version)
+    if not version_dir.is_dir():
+        versions_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = versions_dir.joinpath(f'.{version}.{os.getpid()}.tmp')
+        if tmp_dir.exists():
+            shutil.rmtree(str(tmp_dir))
+        tmp_dir.mkdir()
+        for name, data in files.items():
+            same_file = None
+            if current_dir is not None and current.get(name) == manifest[name]:
+                same_file = current_dir.joinpath(name)
+            _place(tmp_dir.joinpath(name), data, same_file)
+        with open(tmp_dir.joinpath(MANIFEST_FILE), 'w') as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+        os.rename(str(tmp_dir), str(version_dir))
+
+    if link.is_dir() and not link.is_symlink():
+        # A plain directory can't be swapped for a symlink in one step; it is
+        # moved aside first, the only time the theme is briefly missing
+        link.rename(versions_dir.joinpath(f'unversioned-{int(time.time())}'))
+    _swap_symlink(link, new_target)
+    _link_files(link, linked, link_dirs)
+    removed = sorted(set(current) - set(manifest))
+    _unlink_files(link, [name for name in removed if name != THEME_PROPERTIES_FILE], link_dirs)
+    for old_dir in versions_dir.iterdir():
+        if old_dir.name != version:
+            shutil.rmtree(str(old_dir), ignore_errors=True)
+    return ThemeChanges(
+        sorted(name for name in manifest if name not in current),
+        sorted(name for name in manifest if name in current and current[name] != manifest[name]),
+        removed,
+        sorted(name for name in manifest if current.get(name) == manifest[name]),
+    )
+
+
+# Makes sure each of link_dirs has a symlink to every file, through link.
+# Copies left there by earlier, file-by-file installs are replaced in one step.
+def _link_files(link: Path, names: List[str], link_dirs: List[Path]) -> None:
+    for link_dir in link_dirs:
+        for name in names:
+            path = link_dir.joinpath(name)
+            target = os.path.relpath(str(link.joinpath(name)), str(link_dir))
+            if path.is_symlink() and os.readlink(str(path)) == target:
+                continue
+            _swap_symlink(path, target)
+
+
+def _unlink_files(link: Path, names: List[str], link_dirs: List[Path]) -> None:
+    for link_dir in link_dirs:
+        for name in names:
+            path = link_dir.joinpath(name)
+            target = os.path.relpath(str(link.joinpath(name)), str(link_dir))
+            if path.is_symlink() and os.readlink(str(path)) == target:
+                path.unlink()
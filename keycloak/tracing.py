@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, TypeVar, cast
+
+# Environment Variable Arguments
+HS_TRACE_FILE = os.getenv('HS_TRACE_FILE', '')  # Chrome trace (chrome://tracing, Perfetto) written here on exit
+HS_PROM_FILE = os.getenv('HS_PROM_FILE', '')  # Prometheus textfile written here on exit
+HS_PROFILE_FILE = os.getenv('HS_PROFILE_FILE', '')  # cProfile stats of the profiled section written here
+
+# Constants
+TRACE_MAX_SPANS = 100000  # spans beyond these many are counted, but not kept
+PROM_PREFIX = 'hskc'
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+# A timed section of work. Spans nest per thread: a span started while another
+# one is open on the same thread becomes its child, and its subprocesses count
+# towards the parent's as well.
+class Span:
+
+    def __init__(self, name: str, category: str, parent: Optional['Span'], attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.subprocesses = 0
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    # Records a subprocess that ran within this span and how it exited
+    def subprocess_exited(self, exitcode: int) -> None:
+        self.subprocesses += 1
+        self.attrs['exitcode'] = exitcode
+
+
+# Tracer collects finished spans and aggregates per span name, for exporting
+# as a Chrome trace and as Prometheus metrics
+class Tracer:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._spans: List[Span] = []
+        self._dropped = 0
+        # name -> [count, total seconds, subprocesses]
+        self._totals: Dict[str, List[float]] = {}
+        # (name, exitcode) -> count
+        self._exitcodes: Dict[Tuple[str, int], int] = {}
+
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self) -> Optional[Span]:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, category: str = 'hskc', **attrs: Any) -> Iterator[Span]:
+        stack = self._stack()
+        sp = Span(name, category, stack[-1] if stack else None, attrs)
+        stack.append(sp)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.set('error', type(e).__name__)
+            raise
+        finally:
+            sp.duration = time.perf_counter() - sp.start
+            stack.pop()
+            if sp.parent is not None:
+                sp.parent.subprocesses += sp.subprocesses
+            self._finish(sp)
+
+    def _finish(self, sp: Span) -> None:
+        with self._lock:
+            if len(self._spans) < TRACE_MAX_SPANS:
+                self._spans.append(sp)
+            else:
+                self._dropped += 1
+            totals = self._totals.setdefault(sp.name, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += sp.duration
+            totals[2] += sp.subprocesses
+            if 'exitcode' in sp.attrs:
+                key = (sp.name, int(sp.attrs['exitcode']))
+                self._exitcodes[key] = self._exitcodes.get(key, 0) + 1
+
+    # Number of spans of this name finished so far
+    def count(self, name: str) -> int:
+        with self._lock:
+            return int(self._totals.get(name, [0])[0])
+
+    @property
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    # Complete ('X') events of the Chrome trace event format, one lane per thread
+    def chrome_trace(self) -> Dict[str, Any]:
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = []
+        for sp in self.spans:
+            args = {k: v if isinstance(v, (str, int, float, bool)) else str(v) for k, v in sp.attrs.items()}
+            if sp.subprocesses:
+                args['subprocesses'] = sp.subprocesses
+            events.append({
+                'name': sp.name,
+                'cat': sp.category,
+                'ph': 'X',
+                'ts': round((sp.start - self._origin) * 1e6, 3),
+                'dur': round(sp.duration * 1e6, 3),
+                'pid': pid,
+                'tid': sp.thread_id,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'droppedSpans': self._dropped}}
+
+    def prometheus(self) -> str:
+        lines = [
+            f'# HELP {PROM_PREFIX}_span_duration_seconds Time spent in traced sections, by name',
+            f'# TYPE {PROM_PREFIX}_span_duration_seconds summary',
+        ]
+        with self._lock:
+            totals = sorted(self._totals.items())
+            exitcodes = sorted(self._exitcodes.items())
+        for name, (count, seconds, _) in totals:
+            label = json.dumps(name)
+            lines.append(f'{PROM_PREFIX}_span_duration_seconds_sum{{name={label}}} {seconds:.6f}')
+            lines.append(f'{PROM_PREFIX}_span_duration_seconds_count{{name={label}}} {int(count)}')
+        lines += [
+            f'# HELP {PROM_PREFIX}_subprocesses_total Subprocesses spawned within traced sections, by name',
+            f'# TYPE {PROM_PREFIX}_subprocesses_total counter',
+        ]
+        for name, (_, _, subprocesses) in totals:
+            if subprocesses:
+                lines.append(f'{PROM_PREFIX}_subprocesses_total{{name={json.dumps(name)}}} {int(subprocesses)}')
+        lines += [
+            f'# HELP {PROM_PREFIX}_subprocess_exits_total Subprocess exits, by name and exit code',
+            f'# TYPE {PROM_PREFIX}_subprocess_exits_total counter',
+        ]
+        for (name, exitcode), count in exitcodes:
+            lines.append(f'{PROM_PREFIX}_subprocess_exits_total{{name={json.dumps(name)},exitcode="{exitcode}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the trace and/or metrics to the files configured, atomically, so a
+    # node_exporter textfile collector never reads half a file
+    def export(self, trace_file: str = HS_TRACE_FILE, prom_file: str = HS_PROM_FILE) -> None:
+        if trace_file:
+            _write_atomic(Path(trace_file), json.dumps(self.chrome_trace()))
+            print(f'Trace written to {trace_file}')
+        if prom_file:
+            _write_atomic(Path(prom_file), self.prometheus())
+            print(f'Metrics written to {prom_file}')
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'w') as fp:
+        fp.write(text)
+    os.replace(tmp_path, path)
+
+
+tracer = Tracer()
+
+
+def span(name: str, category: str = 'hskc', **attrs: Any) -> ContextManager[Span]:
+    return tracer.span(name, category, **attrs)
+
+
+# Sets an attribute on the innermost open span of this thread, if any
+def annotate(key: str, value: Any) -> None:
+    sp = tracer.current()
+    if sp is not None:
+        sp.set(key, value)
+
+
+# Decorator that runs the function within a span of the given name
+def traced(name: str, category: str = 'hskc') -> Callable[[F], F]:
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with tracer.span(name, category):
+                return fn(*args, **kwargs)
+        return cast(F, wrapper)
+    return decorator
+
+
+# Profiles the section with cProfile when HS_PROFILE_FILE (or profile_file)
+# is set; the stats can be read with python3 -m pstats. Does nothing otherwise.
+@contextmanager
+def profiling(profile_file: str = HS_PROFILE_FILE) -> Iterator[None]:
+    if not profile_file:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        print(f'Profile written to {profile_file}')
+
+
+if HS_TRACE_FILE or HS_PROM_FILE:
+    atexit.register(tracer.export)
@@ -0,0 +1,383 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import os
+import shutil
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Local Imports
+from keycloak import KeycloakHandle, read_from_file, write_to_file
+
+# Environment Variable Arguments
+HS_TUNING_CPUS = int(os.getenv('HS_TUNING_CPUS', '0'))  # CPUs to tune for; 0 reads the cgroup limit
+HS_TUNING_MEMORY_MB = int(os.getenv('HS_TUNING_MEMORY_MB', '0'))  # MiB to tune for; 0 reads the cgroup limit
+HS_TUNING_MAX_POOL_SIZE = int(os.getenv('HS_TUNING_MAX_POOL_SIZE', '0'))  # database connections per node; 0 = preset's
+HS_TUNING_DATASOURCE = os.getenv('HS_TUNING_DATASOURCE', 'KeycloakDS')  # pool-name of Keycloak's datasource
+HS_TUNING_IO_WORKER = os.getenv('HS_TUNING_IO_WORKER', 'default')  # io worker Undertow serves requests with
+
+# Constants
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+NATIVE_RESERVE_MB = 192  # code cache, GC structures, direct buffers and the JVM itself
+THREAD_STACK_MB = 1  # -Xss on 64 bit Linux
+MIN_HEAP_MB = 256
+MIN_INITIAL_HEAP_MB = 64
+INITIAL_METASPACE_MB = 96
+METASPACE_SHARE = 0.08  # of the memory, for -XX:MaxMetaspaceSize
+METASPACE_RANGE_MB = (128, 512)
+IO_NS_PREFIX = 'urn:jboss:domain:io:'
+DATASOURCES_NS_PREFIX = 'urn:jboss:domain:datasources:'
+JAVA_OPTS_BEGIN = '# BEGIN hskc tuning'
+JAVA_OPTS_END = '# END hskc tuning'
+JAVA_OPTS_SETTING = 'standalone.conf JAVA_OPTS'
+
+
+# A tuning preset: how each setting scales with the CPUs or memory available
+class Preset(NamedTuple):
+    name: str
+    heap_share: float  # of the memory left once metaspace, thread stacks and native memory are set aside
+    initial_heap_share: float  # -Xms as a share of -Xmx
+    io_threads_per_cpu: int
+    task_threads_per_cpu: int
+    min_pool_per_cpu: int
+    max_pool_per_cpu: int
+    max_pool_cap: int
+
+
+PRESETS = {
+    # Development boxes and small tenants: a modest heap that grows on demand
+    'small': Preset('small', 0.6, 0.25, 1, 8, 1, 5, 20),
+    # Undertow's own thread defaults, with a pool large enough to keep them busy
+    'balanced': Preset('balanced', 0.75, 0.5, 2, 16, 2, 10, 100),
+    # Login heavy nodes: a heap committed up front, more workers and connections
+    'throughput': Preset('throughput', 0.8, 1.0, 2, 32, 5, 20, 200),
+}
+
+
+class UnknownPresetError(Exception):
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __str__(self) -> str:
+        return (
+            'Unknown tuning preset.\n'
+            f'Preset: {self.name}\n'
+            f'Known presets: {", ".join(sorted(PRESETS))}\n'
+        )
+
+
+# CPUs and memory Keycloak may use
+class ResourceLimits(NamedTuple):
+    cpus: int
+    memory_mb: int
+    source: str  # where they were read from, like cgroup v2
+
+
+# Settings derived from a preset for some resource limits
+class TuningPlan(NamedTuple):
+    preset: str
+    limits: ResourceLimits
+    heap_mb: int
+    initial_heap_mb: int
+    metaspace_mb: int
+    max_metaspace_mb: int
+    io_threads: int
+    task_max_threads: int
+    min_pool_size: int
+    max_pool_size: int
+
+    @property
+    def java_opts(self) -> str:
+        return (
+            f'-Xms{self.initial_heap_mb}m -Xmx{self.heap_mb}m '
+            f'-XX:MetaspaceSize={self.metaspace_mb}m -XX:MaxMetaspaceSize={self.max_metaspace_mb}m'
+        )
+
+    # Memory the JVM may take in all, which should stay within the limit
+    @property
+    def footprint_mb(self) -> int:
+        threads = self.io_threads + self.task_max_threads
+        return self.heap_mb + self.max_metaspace_mb + threads * THREAD_STACK_MB + NATIVE_RESERVE_MB
+
+    # The server settings, by jboss_cli resource address and attribute
+    def server_settings(self, io_worker: str, datasource: str) -> Dict[Tuple[str, str], int]:
+        return {
+            (io_worker_address(io_worker), 'io-threads'): self.io_threads,
+            (io_worker_address(io_worker), 'task-max-threads'): self.task_max_threads,
+            (datasource_address(datasource), 'min-pool-size'): self.min_pool_size,
+            (datasource_address(datasource), 'max-pool-size'): self.max_pool_size,
+        }
+
+
+# A setting tuning changes, or would change in a dry run. current is empty
+# when the setting is left to its default.
+class TuningChange(NamedTuple):
+    setting: str
+    current: str
+    planned: str
+
+
+def io_worker_address(io_worker: str) -> str:
+    return f'/subsystem=io/worker={io_worker}'
+
+
+def datasource_address(datasource: str) -> str:
+    return f'/subsystem=datasources/data-source={datasource}'
+
+
+def _read_text(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+# CPU quota (in whole CPUs) and memory limit (in bytes) of a cgroup v2, None
+# where there is none. cpu.max reads like "200000 100000" or "max 100000".
+def _cgroup_v2_limits(root: Path) -> Tuple[Optional[int], Optional[int]]:
+    cpus = None
+    cpu_max = (_read_text(root.joinpath('cpu.max')) or 'max').split()
+    if cpu_max[0] != 'max':
+        cpus = _ceil_div(int(cpu_max[0]), int(cpu_max[1]) if len(cpu_max) > 1 else 100000)
+    memory_max = _read_text(root.joinpath('memory.max')) or 'max'
+    return cpus, None if memory_max == 'max' else int(memory_max)
+
+
+# Same for a cgroup v1, where no CPU quota reads as -1 and no memory limit as
+# a huge number (which the host's memory bounds anyway)
+def _cgroup_v1_limits(root: Path) -> Tuple[Optional[int], Optional[int]]:
+    cpus = None
+    quota = _read_text(root.joinpath('cpu', 'cpu.cfs_quota_us'))
+    period = _read_text(root.joinpath('cpu', 'cpu.cfs_period_us'))
+    if quota is not None and period is not None and int(quota) > 0:
+        cpus = _ceil_div(int(quota), int(period))
+    memory_limit = _read_text(root.joinpath('memory', 'memory.limit_in_bytes'))
+    return cpus, int(memory_limit) if memory_limit is not None else None
+
+
+# read_limits finds the CPUs and memory this container may use: the CPU quota
+# and memory limit of its cgroup (v2, or else v1), bounded by the CPUs it may
+# run on and the memory of the host. cpus and memory_mb override either.
+def read_limits(
+        root: Path = CGROUP_ROOT,
+        cpus: int = HS_TUNING_CPUS,
+        memory_mb: int = HS_TUNING_MEMORY_MB,
+) -> ResourceLimits:
+    host_cpus = len(os.sched_getaffinity(0))
+    host_memory_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    if root.joinpath('cgroup.controllers').exists():
+        source = 'cgroup v2'
+        quota_cpus, memory_limit = _cgroup_v2_limits(root)
+    elif root.joinpath('memory').is_dir():
+        source = 'cgroup v1'
+        quota_cpus, memory_limit = _cgroup_v1_limits(root)
+    else:
+        source, quota_cpus, memory_limit = 'host', None, None
+    found_cpus = min(host_cpus, quota_cpus or host_cpus)
+    found_memory_mb = min(host_memory_mb, memory_limit // (1024 * 1024) if memory_limit else host_memory_mb)
+    if cpus or memory_mb:
+        source += ', overridden'
+    return ResourceLimits(max(1, cpus or found_cpus), memory_mb or found_memory_mb, source)
+
+
+def get_preset(name: str) -> Preset:
+    if name not in PRESETS:
+        raise UnknownPresetError(name)
+    return PRESETS[name]
+
+
+# plan_tuning scales a preset to the resource limits. Metaspace gets a share
+# of the memory, and the heap a share of what is left once metaspace, the
+# stacks of the Undertow threads and the JVM's native memory are set aside.
+# The datasource pool grows with the CPUs, up to max_pool_cap connections
+# (the preset's cap when 0), since the database limits those for all nodes.
+def plan_tuning(limits: ResourceLimits, preset: Preset, max_pool_cap: int = HS_TUNING_MAX_POOL_SIZE) -> TuningPlan:
+    io_threads = limits.cpus * preset.io_threads_per_cpu
+    task_max_threads = limits.cpus * preset.task_threads_per_cpu
+    max_metaspace_mb = int(min(max(limits.memory_mb * METASPACE_SHARE, METASPACE_RANGE_MB[0]), METASPACE_RANGE_MB[1]))
+    reserved_mb = max_metaspace_mb + (io_threads + task_max_threads) * THREAD_STACK_MB + NATIVE_RESERVE_MB
+    heap_mb = max(MIN_HEAP_MB, int((limits.memory_mb - reserved_mb) * preset.heap_share))
+    max_pool_size = max(1, min(max_pool_cap or preset.max_pool_cap, limits.cpus * preset.max_pool_per_cpu))
+    return TuningPlan(
+        preset.name,
+        limits,
+        heap_mb,
+        max(MIN_INITIAL_HEAP_MB, min(heap_mb, int(heap_mb * preset.initial_heap_share))),
+        min(INITIAL_METASPACE_MB, max_metaspace_mb),
+        max_metaspace_mb,
+        io_threads,
+        task_max_threads,
+        min(max_pool_size, limits.cpus * preset.min_pool_per_cpu),
+        max_pool_size,
+    )
+
+
+def _split_tag(tag: str) -> Tuple[str, str]:
+    if tag.startswith('{'):
+        ns, local = tag[1:].split('}', 1)
+        return ns, local
+    return '', tag
+
+
+# read_server_settings finds the io worker and the datasource in the
+# configuration file and returns the attributes tuning sets on them, by
+# resource address. A resource missing from the file has no entry; an
+# attribute left to its default has none within its resource's. Reading stops
+# once both are found, and elements of other subsystems are dropped as soon
+# as they end.
+def read_server_settings(cfg_path: Path, io_worker: str, datasource: str) -> Dict[str, Dict[str, str]]:
+    found: Dict[str, Dict[str, str]] = {}
+    with open(cfg_path, 'rb') as fp:
+        for _, elem in ET.iterparse(fp, events=('end',)):
+            ns, name = _split_tag(elem.tag)
+            if name == 'worker' and ns.startswith(IO_NS_PREFIX) and elem.get('name') == io_worker:
+                found[io_worker_address(io_worker)] = {
+                    attribute: value for attribute, value in elem.attrib.items()
+                    if attribute in ['io-threads', 'task-max-threads']
+                }
+            elif name == 'datasource' and ns.startswith(DATASOURCES_NS_PREFIX) and elem.get('pool-name') == datasource:
+                pool: Dict[str, str] = {}
+                for child in elem:
+                    if _split_tag(child.tag)[1] == 'pool':
+                        pool = {_split_tag(c.tag)[1]: str(c.text or '').strip() for c in child}
+                found[datasource_address(datasource)] = {
+                    attribute: value for attribute, value in pool.items()
+                    if attribute in ['min-pool-size', 'max-pool-size']
+                }
+            elif name == 'subsystem':
+                elem.clear()
+            if len(found) == 2:
+                break
+    return found
+
+
+def java_opts_block(plan: TuningPlan) -> str:
+    return (
+        f'{JAVA_OPTS_BEGIN}: {plan.preset} preset for {plan.limits.cpus} CPU(s) and {plan.limits.memory_mb} MiB\n'
+        f'JAVA_OPTS="$JAVA_OPTS {plan.java_opts}"\n'
+        f'{JAVA_OPTS_END}\n'
+    )
+
+
+# The managed block of a standalone.conf, if it has one, and the text around it
+def _split_java_opts_block(text: str) -> Tuple[str, Optional[str], str]:
+    lines = text.splitlines(keepends=True)
+    begin = next((i for i, line in enumerate(lines) if line.startswith(JAVA_OPTS_BEGIN)), None)
+    end = next((i for i, line in enumerate(lines) if line.startswith(JAVA_OPTS_END)), None)
+    if begin is None or end is None or end < begin:
+        return text, None, ''
+    return ''.join(lines[:begin]), ''.join(lines[begin:end + 1]), ''.join(lines[end + 1:])
+
+
+# The JAVA_OPTS of a managed block, like "-Xms512m -Xmx1024m ..."
+def _block_java_opts(block: Optional[str]) -> str:
+    for line in (block or '').splitlines():
+        if line.startswith('JAVA_OPTS="$JAVA_OPTS '):
+            return line[len('JAVA_OPTS="$JAVA_OPTS '):].rstrip('"')
+    return ''
+
+
+# Replaces the managed block of standalone.conf, or else adds it at the end:
+# its options then come after, and so win over, the image's defaults. The
+# file is replaced in one rename, keeping its mode.
+def write_java_opts_block(conf_path: Path, block: str) -> None:
+    before, _, after = _split_java_opts_block(read_from_file(conf_path))
+    if before and not before.endswith('\n'):
+        before += '\n'
+    tmp_path = conf_path.with_name(f'.{conf_path.name}.tmp')
+    write_to_file(tmp_path, before + block + after)
+    shutil.copymode(str(conf_path), str(tmp_path))
+    os.replace(str(tmp_path), str(conf_path))
+
+
+# plan_changes compares a plan to what standalone.conf and the configuration
+# file hold. Settings of a resource missing from the configuration file (like
+# a datasource with another name) are left out, with a note.
+def plan_changes(
+        kc: KeycloakHandle,
+        plan: TuningPlan,
+        io_worker: str = HS_TUNING_IO_WORKER,
+        datasource: str = HS_TUNING_DATASOURCE,
+) -> List[TuningChange]:
+    changes: List[TuningChange] = []
+    conf_path = kc.get_standalone_conf_path()
+    if conf_path.exists():
+        current_opts = _block_java_opts(_split_java_opts_block(read_from_file(conf_path))[1])
+        if current_opts != plan.java_opts:
+            changes.append(TuningChange(JAVA_OPTS_SETTING, current_opts, plan.java_opts))
+    else:
+        print(f'Tuning: no {conf_path}; leaving the JVM options alone')
+    current = read_server_settings(kc.get_cfg_path(), io_worker, datasource)
+    for (address, attribute), value in plan.server_settings(io_worker, datasource).items():
+        if address not in current:
+            if attribute in ['io-threads', 'min-pool-size']:  # once per resource
+                print(f'Tuning: no {address} in {kc.get_cfg_path().name}; leaving it alone')
+            continue
+        current_value = current[address].get(attribute, '')
+        if current_value != str(value):
+            changes.append(TuningChange(f'{address}:{attribute}', current_value, str(value)))
+    return changes
+
+
+def describe_plan(plan: TuningPlan, changes: List[TuningChange]) -> str:
+    limits = plan.limits
+    lines = [
+        f'Tuning for {limits.cpus} CPU(s) and {limits.memory_mb} MiB ({limits.source}) with the {plan.preset} preset:',
+        f'  JVM: {plan.java_opts}',
+        f'  Undertow: {plan.io_threads} IO threads, {plan.task_max_threads} worker threads',
+        f'  Datasource pool: {plan.min_pool_size} to {plan.max_pool_size} connections',
+    ]
+    if plan.footprint_mb > limits.memory_mb:
+        lines.append(f'  Warning: the JVM may take up to {plan.footprint_mb} MiB, over the {limits.memory_mb} MiB limit')
+    for change in changes:
+        lines.append(f'  {change.setting}: {change.current or "(default)"} -> {change.planned}')
+    if not changes:
+        lines.append('  Everything is tuned already')
+    return '\n'.join(lines)
+
+
+# tune applies the preset's settings to what differs from them: the managed
+# JAVA_OPTS block of standalone.conf, and the Undertow io worker and
+# datasource pool in one jboss_cli batch. A stopped Keycloak has the batch
+# written offline, so its next boot picks everything up; a running one gets a
+# restart requested. With dry_run, the changes are only reported. Returns them.
+def tune(kc: KeycloakHandle, preset_name: str, dry_run: bool = False) -> List[TuningChange]:
+    plan = plan_tuning(read_limits(), get_preset(preset_name))
+    changes = plan_changes(kc, plan)
+    print(describe_plan(plan, changes))
+    if dry_run or not changes:
+        return changes
+    if any(change.setting == JAVA_OPTS_SETTING for change in changes):
+        write_java_opts_block(kc.get_standalone_conf_path(), java_opts_block(plan))
+    batch = kc.batch(f'tuning-{plan.preset}', offline=not kc.is_running())
+    for change in changes:
+        if change.setting != JAVA_OPTS_SETTING:
+            address, attribute = change.setting.rsplit(':', 1)
+            batch.write_attribute(address, attribute, int(change.planned))
+    batch.run()
+    if kc.is_running():
+        kc.request_restart(f'tuning with the {plan.preset} preset')
+    return changes
+
+
+# Main()
+# Usage: tuning.py preset [--dry-run]
+# Presets: small, balanced, throughput
+# Writes to the files of a stopped Keycloak (the batch runs offline); a dry run
+# can be done any time
+if __name__ == '__main__':
+    from keycloak import singleton
+    args = sys.argv[1:]
+    presets = [arg for arg in args if arg != '--dry-run']
+    if len(presets) != 1:
+        print('Usage: tuning.py preset [--dry-run]')
+        print(f'Presets: {", ".join(PRESETS)}')
+        sys.exit(1)
+    tune(singleton, presets[0], '--dry-run' in args)
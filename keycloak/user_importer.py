@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+
+# Stdlib Imports
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+# Local Imports
+from admin_client import KeycloakAdminAPIError
+from async_keycloak import AsyncKeycloakHandle, run_async
+from bulk import (
+    IF_EXISTS_POLICIES,
+    ImportResult,
+    SourceRecord,
+    check_if_exists_policy,
+    count_actions,
+    describe_counts,
+    error_reason,
+    is_rejection,
+    match_results,
+    read_records,
+)
+from keycloak import KeycloakAdminCLIError
+from tracing import span
+
+
+# Environment Variable Arguments
+HS_USER_BATCH_SIZE = int(os.getenv('HS_USER_BATCH_SIZE', '500'))  # users per partial import request
+HS_USER_IMPORT_CONCURRENCY = int(os.getenv('HS_USER_IMPORT_CONCURRENCY', '4'))  # partial imports in flight
+HS_USER_IF_EXISTS = os.getenv('HS_USER_IF_EXISTS', 'SKIP')  # SKIP or OVERWRITE users that already exist
+HS_USER_CHECKPOINT = os.getenv('HS_USER_CHECKPOINT', '')  # defaults to <users file>.checkpoint
+
+# Constants
+# CSV columns holding lists; their values are separated by whitespace
+CSV_LIST_COLUMNS = ['groups', 'realmRoles', 'requiredActions']
+# CSV columns holding true or false
+CSV_BOOLEAN_COLUMNS = ['enabled', 'emailVerified', 'temporaryPassword', 'totp']
+
+
+class UserRecordError(Exception):
+
+    def __init__(self, line: int, reason: str) -> None:
+        self.line = line
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f'Invalid user on line {self.line}: {self.reason}'
+
+
+class CheckpointMismatchError(Exception):
+
+    def __init__(self, checkpoint_path: Path, source: str) -> None:
+        self.checkpoint_path = checkpoint_path
+        self.source = source
+
+    def __str__(self) -> str:
+        return (
+            'The checkpoint belongs to a different users file (or the file has changed since).\n'
+            f'Checkpoint: {self.checkpoint_path}\n'
+            f'Checkpointed File: {self.source}\n'
+            'Remove the checkpoint to import the file from the start.\n'
+        )
+
+
+# User records are JSON objects (one per line) or CSV rows with the username
+# and any other fields of a user representation, like email, firstName,
+# lastName, enabled, groups or attributes. A password (plus temporaryPassword,
+# if it has to be changed on first login) becomes the user's credential.
+def read_user_records(path: Path, start_after: int = 0) -> Iterator[SourceRecord]:
+    return read_records(path, CSV_LIST_COLUMNS, CSV_BOOLEAN_COLUMNS, attribute_lists=True, start_after=start_after)
+
+
+def user_from_record(record: SourceRecord) -> Dict[str, Any]:
+    fields = dict(record.fields)
+    username = fields.get('username')
+    if not isinstance(username, str) or not username:
+        raise UserRecordError(record.line, 'username is missing')
+    password = fields.pop('password', None)
+    temporary = fields.pop('temporaryPassword', False)
+    user: Dict[str, Any] = {'enabled': True}
+    user.update(fields)
+    if password:
+        user['credentials'] = [{'type': 'password', 'value': str(password), 'temporary': bool(temporary)}]
+    return user
+
+
+# A run of consecutive records, imported with a single request. last_line is
+# the line of the last record it covers, including the ones that were invalid.
+class UserBatch(NamedTuple):
+    number: int
+    last_line: int
+    users: List[Tuple[int, Dict[str, Any]]]
+    invalid: List[ImportResult]
+
+
+def user_batches(records: Iterable[SourceRecord], batch_size: int) -> Iterator[UserBatch]:
+    number = 0
+    users: List[Tuple[int, Dict[str, Any]]] = []
+    invalid: List[ImportResult] = []
+    last_line = 0
+    for record in records:
+        last_line = record.line
+        if record.error:
+            invalid.append(ImportResult(record.line, '', 'ERROR', error=record.error))
+        else:
+            try:
+                users.append((record.line, user_from_record(record)))
+            except UserRecordError as e:
+                invalid.append(ImportResult(record.line, '', 'ERROR', error=e.reason))
+        if len(users) == batch_size:
+            number += 1
+            yield UserBatch(number, last_line, users, invalid)
+            users, invalid = [], []
+    if users or invalid:
+        yield UserBatch(number + 1, last_line, users, invalid)
+
+
+# ImportCheckpoint remembers the last line of the users file up to which
+# everything was imported, along with the running counts. It is tied to the
+# file by its path, size and modification time, so a checkpoint is never
+# applied to another file. Saves replace the file atomically.
+class ImportCheckpoint:
+
+    def __init__(self, path: Path, source: Path) -> None:
+        self.path = path
+        stat = source.stat()
+        self._source = f'{source.resolve()}:{stat.st_size}:{stat.st_mtime_ns}'
+        self.line = 0
+        self.counts: Dict[str, int] = {}
+
+    # Returns True if an earlier import of the same file is being resumed
+    def load(self) -> bool:
+        if not self.path.exists():
+            return False
+        with open(self.path, 'r') as fp:
+            doc = json.load(fp)
+        if doc.get('source') != self._source:
+            raise CheckpointMismatchError(self.path, str(doc.get('source')))
+        self.line = int(doc.get('line', 0))
+        self.counts = dict(doc.get('counts', {}))
+        return True
+
+    def save(self, line: int, counts: Dict[str, int]) -> None:
+        self.line = line
+        self.counts = dict(counts)
+        tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({'source': self._source, 'line': line, 'counts': counts}, fp)
+        os.replace(tmp_path, self.path)
+
+
+# UserImporter streams a users file into a realm through the partial import
+# endpoint. Records are read lazily and grouped into batches, and at most
+# `concurrency` batches are held at a time (being uploaded, or waiting for an
+# earlier one to finish), so memory stays flat however large the file is.
+# Batches are committed in file order: the checkpoint only moves past a batch
+# once it and every batch before it are done, so an interrupted import resumes
+# right after the last line known to be imported. Batches in flight at the
+# time are imported again, which SKIP and OVERWRITE make harmless. A batch
+# Keycloak rejects is bisected until the offending users are isolated.
+#
+# Usage:
+#   importer = UserImporter(AsyncKeycloakHandle(singleton), 'master', checkpoint)
+#   counts = importer.import_file(users_path)
+class UserImporter:
+
+    def __init__(
+            self,
+            akc: AsyncKeycloakHandle,
+            realm: str,
+            checkpoint: ImportCheckpoint,
+            if_exists: str = HS_USER_IF_EXISTS,
+            batch_size: int = HS_USER_BATCH_SIZE,
+            concurrency: int = HS_USER_IMPORT_CONCURRENCY,
+            report: Optional[TextIO] = None,
+    ) -> None:
+        self._akc = akc
+        self._realm = realm
+        self._checkpoint = checkpoint
+        self._if_exists = check_if_exists_policy(if_exists)
+        self._batch_size = max(1, batch_size)
+        self._concurrency = max(1, concurrency)
+        self._report = report
+        self._counts: Dict[str, int] = {}
+        self._next = 1  # number of the next batch to commit
+        self._done: Dict[int, Tuple[int, List[ImportResult]]] = {}
+        self._failure: Optional[BaseException] = None
+        self.requests = 0
+
+    async def _import(self, users: List[Tuple[int, Dict[str, Any]]]) -> List[ImportResult]:
+        payload = {'ifResourceExists': self._if_exists, 'users': [user for _, user in users]}
+        self.requests += 1
+        reply = await self._akc.partial_import(self._realm, payload)
+        return match_results(reply, 'USER', [(line, user['username']) for line, user in users])
+
+    # Submits users, bisecting them when Keycloak rejects the request
+    async def _submit(self, users: List[Tuple[int, Dict[str, Any]]]) -> List[ImportResult]:
+        if not users:
+            return []
+        try:
+            return await self._import(users)
+        except (KeycloakAdminAPIError, KeycloakAdminCLIError) as e:
+            if not is_rejection(e):
+                raise
+            if len(users) == 1:
+                line, user = users[0]
+                return [ImportResult(line, user['username'], 'ERROR', error=error_reason(e))]
+            middle = len(users) // 2
+            return await self._submit(users[:middle]) + await self._submit(users[middle:])
+
+    # Records a finished batch and commits every batch that is now done in
+    # order, freeing their slots
+    def _commit(self, batch: UserBatch, results: List[ImportResult], slots: asyncio.Semaphore) -> None:
+        self._done[batch.number] = (batch.last_line, sorted(results + batch.invalid))
+        while self._next in self._done:
+            last_line, committed = self._done.pop(self._next)
+            count_actions(committed, self._counts)
+            for result in committed:
+                if self._report is not None:
+                    self._report.write(result.to_json() + '\n')
+                if result.action == 'ERROR':
+                    print(f'User "{result.name}" (line {result.line}) failed: {result.error}')
+            self._checkpoint.save(last_line, self._counts)
+            print(f'Imported up to line {last_line}: {describe_counts(self._counts)}')
+            self._next += 1
+            slots.release()
+
+    async def _upload(self, batch: UserBatch, slots: asyncio.Semaphore) -> None:
+        try:
+            results = await self._submit(batch.users)
+        except Exception as e:
+            if self._failure is None:
+                self._failure = e
+            slots.release()  # unblocks the reader, which then stops
+            return
+        self._commit(batch, results, slots)
+
+    async def run(self, records: Iterable[SourceRecord]) -> Dict[str, int]:
+        slots = asyncio.Semaphore(self._concurrency)
+        tasks: List[Any] = []
+        for batch in user_batches(records, self._batch_size):
+            await slots.acquire()
+            if self._failure is not None:
+                break
+            tasks = [task for task in tasks if not task.done()]
+            tasks.append(asyncio.ensure_future(self._upload(batch, slots)))
+        if tasks:
+            await asyncio.gather(*tasks)
+        if self._failure is not None:
+            raise self._failure
+        return dict(self._counts)
+
+    # Imports the file, resuming from the checkpoint if there is one. Returns
+    # the number of users per action, including the ones imported before.
+    def import_file(self, path: Path) -> Dict[str, int]:
+        if self._checkpoint.load():
+            print(f'Resuming the import of {path} after line {self._checkpoint.line}')
+        self._counts = dict(self._checkpoint.counts)
+        with span('users.import', realm=self._realm) as sp:
+            counts = run_async(self.run(read_user_records(path, self._checkpoint.line)))
+            sp.set('requests', self.requests)
+        return counts
+
+
+# Main()
+# Usage: user_importer.py users.jsonl|users.csv [--realm R] [--if-exists SKIP|OVERWRITE]
+#                         [--batch-size N] [--concurrency N] [--checkpoint PATH] [--report results.jsonl]
+if __name__ == '__main__':
+    from keycloak import singleton
+    parser = argparse.ArgumentParser(description='Import users into Keycloak in bulk via partial imports')
+    parser.add_argument('users', type=Path, help='users, as JSON Lines or CSV (by extension)')
+    parser.add_argument('--realm', default='master')
+    parser.add_argument('--if-exists', default=HS_USER_IF_EXISTS, choices=IF_EXISTS_POLICIES, type=str.upper)
+    parser.add_argument('--batch-size', type=int, default=HS_USER_BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=HS_USER_IMPORT_CONCURRENCY)
+    parser.add_argument('--checkpoint', type=Path, help='progress is saved here (default: <users>.checkpoint)')
+    parser.add_argument('--report', type=Path, help='append one JSON line per user here')
+    args = parser.parse_args()
+    checkpoint_path = args.checkpoint or Path(HS_USER_CHECKPOINT or f'{args.users}.checkpoint')
+    singleton.start()
+    singleton.login()
+    akc = AsyncKeycloakHandle(singleton, args.concurrency)
+    report_fp = open(args.report, 'a') if args.report else None
+    try:
+        importer = UserImporter(
+            akc,
+            args.realm,
+            ImportCheckpoint(checkpoint_path, args.users),
+            args.if_exists,
+            args.batch_size,
+            args.concurrency,
+            report_fp)
+        counts = importer.import_file(args.users)
+    finally:
+        akc.close()
+        if report_fp is not None:
+            report_fp.close()
+    print(f'Done in {importer.requests} request(s): {describe_counts(counts)}')
+    sys.exit(1 if counts.get('ERROR') else 0)